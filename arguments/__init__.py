@@ -101,6 +101,8 @@ class ModelParams(ParamGroup):
 class PipelineParams(ParamGroup):
     def __init__(self, parser):
         self.debug = False
+        self.frustum_culling = False  # only preprocess the 3dgs whose grid chunk intersects the camera frustum.
+        self.frustum_culling_grid_size = 32  # number of grid cells per axis of the spatial index used by frustum_culling.
         super().__init__(parser, "Pipeline Parameters")
 
 
@@ -119,6 +121,9 @@ class OptimizationParams(ParamGroup):
         self.rotation_lr = 0.001
         self.percent_dense = 0.01
         self.lambda_dssim = 0.2
+        self.fast_ssim = False  # ssim loss with a cached separable window and the five filtered maps in one convolution.
+        self.stacked_loss = False  # compute l1 and ssim of all local image strips of a batch in one launch, timed with cuda events instead of host syncs.
+        self.mixed_precision_dtype = "float32"  # "float32", "float16" or "bfloat16": dtype of the rendered strips, gt and loss maps; losses are accumulated and 3dgs/optimizer states kept in float32.
         self.densification_interval = 100
         self.opacity_reset_interval = 3000
         self.densify_from_iter = 500
@@ -129,7 +134,13 @@ class OptimizationParams(ParamGroup):
         self.opacity_reset_until_iter = -1
         self.random_background = False
         self.min_opacity = 0.005
+        self.min_visible_cameras = 0  # prune 3dgs inside the frustum of fewer training cameras at densification; 0 disables it.
         self.lr_scale_mode = "sqrt"  # can be "linear", "sqrt", or "accumu"
+        self.fused_adam = False  # one multi-tensor Adam step over all parameter groups, with the 1/bsz grad scaling folded in.
+        self.sparse_adam = False  # only update the rows of the 3dgs visible in the batch, decaying the moments of skipped steps lazily.
+        self.offload_optimizer_state = "none"  # "none", "f_rest" or "all": keep the Adam moments of these parameter groups in pinned host memory.
+        # rows of offloaded moments streamed to the gpu at a time.
+        self.offload_chunk_size = 1048576
         super().__init__(parser, "Optimization Parameters")
 
 
@@ -138,29 +149,49 @@ class DistributionParams(ParamGroup):
         # Distribution for pixel-wise workloads.
         self.image_distribution = True
         self.image_distribution_mode = "final"
+        self.division_mode = "tile_rows"  # "tile_rows", "tile_blocks": kd-split each image into rectangular blocks of tiles when there are more gpus than cameras in a batch.
+        self.locality_aware_assignment = False  # give each gpu the cameras of a batch whose visible 3dgs it mostly stores.
         self.heuristic_decay = 0.0
         self.no_heuristics_update = False
         self.border_divpos_coeff = 1.0
         self.adjust_strategy_warmp_iterations = -1
         self.save_strategy_history = False
+        self.heuristic_dtype = "float32"  # "float32", "float16", "bfloat16" storage dtype of the accumulated division heuristics.
+        self.workload_cost_model = False  # predict the division heuristic of cameras without a measured one (unseen or during warm-up) from the 3dgs count of each tile row, with a linear model fitted online on render time.
+        self.visibility_workload_estimate = False  # estimate the division heuristic of not yet measured cameras from the 3dgs visible in each tile row.
 
         # Distribution for 3DGS-wise workloads.
         self.gaussians_distribution = True
-        self.redistribute_gaussians_mode = "random_redistribute"  # "no_redistribute"
+        self.redistribute_gaussians_mode = "random_redistribute"  # "no_redistribute", "minimal_redistribute"
         self.redistribute_gaussians_frequency = (
             10  # redistribution frequency for 3DGS storage location.
         )
         self.redistribute_gaussians_threshold = (
             1.1  # threshold to apply redistribution for 3DGS storage location
         )
+        self.fused_redistribute_gaussians = False  # if True, move all parameters and optimizer states with one all_to_all_single.
+        self.fused_screenspace_all_to_all = False  # if True, send all screen-space states of a batch with one all_to_all_single.
+        self.screenspace_means2D_dtype = "float32"  # "float32", "float16" or "bfloat16" precision of means2D and its gradient in the fused screen-space all-to-all.
+        self.screenspace_rgb_dtype = "float32"  # same for rgb.
+        self.screenspace_conic_opacity_dtype = "float32"  # same for conic_opacity.
+        self.all_to_all_chunk_size = 0  # if > 0, launch the screen-space all-to-all of every this many cameras on a side stream while the next ones are preprocessed.
+        self.hierarchical_all_to_all = False  # if True and on several nodes, the fused all-to-alls go inside the node first, then across nodes.
+        # reorder local 3dgs along a morton curve every N densifications; -1 disables it.
+        self.spatial_sort_gaussians_frequency = -1
         self.sync_grad_mode = "dense"  # "dense", "sparse", "fused_dense", "fused_sparse" gradient synchronization. Only use when gaussians_distribution is False.
+        self.sparse_grad_sync_threshold = 0.5  # fused_sparse falls back to fused_dense once this fraction of 3dgs have a non-zero grad on any rank.
         self.grad_normalization_mode = "none"  # "divide_by_visible_count", "square_multiply_by_visible_count", "multiply_by_visible_count", "none" gradient normalization mode.
 
         # Dataset and Model save
         self.bsz = 1  # batch size.
+        # if > 0, run forward and backward on micro-batches of this many cameras and accumulate their gradients;
+        # optimizer steps and learning rates still follow bsz.
+        self.micro_bsz = -1
         self.distributed_dataset_storage = True  # if True, we store dataset only on rank 0 and broadcast to other ranks.
         self.distributed_save = True
         self.local_sampling = False
+        self.batch_sampling = "random"  # "random" or "spatial": build each batch from nearby cameras, still visiting every camera once per epoch.
+        self.batch_sampling_direction_weight = 1.0  # weight of the viewing direction against the normalized camera center when clustering cameras.
         self.preload_dataset_to_gpu = (
             False  # By default, we do not preload dataset to GPU.
         )
@@ -193,6 +224,7 @@ class DebugParams(ParamGroup):
             False  # stop updating parameters. No optimizer.step() will be called.
         )
         self.time_image_loading = False  # Log image loading time.
+        self.check_strategy_final = False  # check the vectorized start/finish_strategy_final against their loop reference implementations.
 
         self.nsys_profile = False  # profile with nsys.
         self.drop_initial_3dgs_p = 0.0  # profile with nsys.
@@ -303,6 +335,49 @@ def init_args(args):
     if not args.gaussians_distribution:
         args.distributed_save = False
 
+    assert args.mixed_precision_dtype in [
+        "float32",
+        "float16",
+        "bfloat16",
+    ], "mixed_precision_dtype should be float32, float16 or bfloat16."
+    if args.mixed_precision_dtype != "float32":
+        # the ssim maps are only combined in float32 by the fast ssim.
+        args.fast_ssim = True
+        # rgb and conic_opacity follow into the screen-space all-to-all unless set explicitly.
+        # means2D stays: half precision is off by up to 2 pixels at 4K coordinates.
+        if args.screenspace_rgb_dtype == "float32":
+            args.screenspace_rgb_dtype = args.mixed_precision_dtype
+        if args.screenspace_conic_opacity_dtype == "float32":
+            args.screenspace_conic_opacity_dtype = args.mixed_precision_dtype
+
+    for dtype in [
+        args.screenspace_means2D_dtype,
+        args.screenspace_rgb_dtype,
+        args.screenspace_conic_opacity_dtype,
+    ]:
+        assert dtype in [
+            "float32",
+            "float16",
+            "bfloat16",
+        ], "screen-space transfer dtypes should be float32, float16 or bfloat16."
+        if dtype != "float32":
+            # reduced precision is only implemented in the packed buffer of the fused all-to-all.
+            args.fused_screenspace_all_to_all = True
+
+    assert not (
+        args.sparse_adam and args.offload_optimizer_state != "none"
+    ), "sparse_adam does not support offload_optimizer_state."
+
+    if args.micro_bsz > 0:
+        assert (
+            not args.local_sampling
+        ), "micro_bsz does not support local_sampling, which assigns cameras to gpus by bsz."
+
+    if args.hierarchical_all_to_all:
+        # the two-level exchange is implemented for the single-buffer all-to-alls.
+        args.fused_screenspace_all_to_all = True
+        args.fused_redistribute_gaussians = True
+
     # sort test_iterations
     args.test_iterations.sort()
     args.save_iterations.sort()
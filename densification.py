@@ -2,28 +2,44 @@ import torch
 import utils.general_utils as utils
 
 
-def densification(iteration, scene, gaussians, batched_screenspace_pkg):
+def update_densification_stats(iteration, gaussians, batched_screenspace_pkg):
     args = utils.get_args()
     timers = utils.get_timers()
-    log_file = utils.get_log_file()
 
-    # Densification
     if not args.disable_auto_densification and iteration <= args.densify_until_iter:
         # Keep track of max radii in image-space for pruning
-        timers.start("densification")
-
         timers.start("densification_update_stats")
-        for radii, visibility_filter, screenspace_mean2D in zip(
+        for radii, visibility_filter, screenspace_mean2D, local_ids in zip(
             batched_screenspace_pkg["batched_locally_preprocessed_radii"],
             batched_screenspace_pkg["batched_locally_preprocessed_visibility_filter"],
             batched_screenspace_pkg["batched_locally_preprocessed_mean2D"],
+            batched_screenspace_pkg["batched_locally_preprocessed_ids"],
         ):
-            gaussians.max_radii2D[visibility_filter] = torch.max(
-                gaussians.max_radii2D[visibility_filter], radii[visibility_filter]
+            # with frustum culling, screen-space tensors only cover the 3dgs in local_ids.
+            visible_ids = (
+                visibility_filter if local_ids is None else local_ids[visibility_filter]
+            )
+            gaussians.max_radii2D[visible_ids] = torch.max(
+                gaussians.max_radii2D[visible_ids], radii[visibility_filter]
+            )
+            gaussians.add_densification_stats(
+                screenspace_mean2D, visibility_filter, visible_ids
             )
-            gaussians.add_densification_stats(screenspace_mean2D, visibility_filter)
         timers.stop("densification_update_stats")
 
+
+def densification(iteration, scene, gaussians, batched_screenspace_pkg):
+    # batched_screenspace_pkg is None if the stats were already added, e.g. after every micro-batch.
+    args = utils.get_args()
+    timers = utils.get_timers()
+    log_file = utils.get_log_file()
+
+    # Densification
+    if not args.disable_auto_densification and iteration <= args.densify_until_iter:
+        timers.start("densification")
+        if batched_screenspace_pkg is not None:
+            update_densification_stats(iteration, gaussians, batched_screenspace_pkg)
+
         if iteration > args.densify_from_iter and utils.check_update_at_this_iter(
             iteration, args.bsz, args.densification_interval, 0
         ):
@@ -42,6 +58,21 @@ def densification(iteration, scene, gaussians, batched_screenspace_pkg):
             )
             timers.stop("densify_and_prune")
 
+            if args.min_visible_cameras > 0:
+                timers.start("prune_by_visible_cameras")
+                n_pruned = gaussians.prune_by_visible_cameras(
+                    scene.getTrainCameras(), args.min_visible_cameras
+                )
+                timers.stop("prune_by_visible_cameras")
+                log_file.write(
+                    "iteration[{},{}) pruned {} 3dgs seen by less than {} training cameras.\n".format(
+                        iteration,
+                        iteration + args.bsz,
+                        n_pruned,
+                        args.min_visible_cameras,
+                    )
+                )
+
             # redistribute after densify_and_prune, because we have new gaussians to distribute evenly.
             if utils.get_denfify_iter() % args.redistribute_gaussians_frequency == 0:
                 num_3dgs_before_redistribute = gaussians.get_xyz.shape[0]
@@ -59,6 +90,16 @@ def densification(iteration, scene, gaussians, batched_screenspace_pkg):
                     )
                 )
 
+            # sort after redistribution, because redistribution appends remote gaussians in rank order.
+            if (
+                args.spatial_sort_gaussians_frequency > 0
+                and utils.get_denfify_iter() % args.spatial_sort_gaussians_frequency
+                == 0
+            ):
+                timers.start("spatial_sort_gaussians")
+                gaussians.spatially_sort_gaussians()
+                timers.stop("spatial_sort_gaussians")
+
             utils.check_memory_usage(
                 log_file, args, iteration, gaussians, before_densification_stop=True
             )
@@ -85,16 +126,12 @@ def densification(iteration, scene, gaussians, batched_screenspace_pkg):
             )
 
 
-def gsplat_densification(iteration, scene, gaussians, batched_screenspace_pkg):
+def gsplat_update_densification_stats(iteration, gaussians, batched_screenspace_pkg):
     args = utils.get_args()
     timers = utils.get_timers()
-    log_file = utils.get_log_file()
 
-    # Densification
     if not args.disable_auto_densification and iteration <= args.densify_until_iter:
         # Keep track of max radii in image-space for pruning
-        timers.start("densification")
-
         timers.start("densification_update_stats")
         image_width = batched_screenspace_pkg["image_width"]
         image_height = batched_screenspace_pkg["image_height"]
@@ -120,6 +157,21 @@ def gsplat_densification(iteration, scene, gaussians, batched_screenspace_pkg):
             )
         timers.stop("densification_update_stats")
 
+
+def gsplat_densification(iteration, scene, gaussians, batched_screenspace_pkg):
+    # batched_screenspace_pkg is None if the stats were already added, e.g. after every micro-batch.
+    args = utils.get_args()
+    timers = utils.get_timers()
+    log_file = utils.get_log_file()
+
+    # Densification
+    if not args.disable_auto_densification and iteration <= args.densify_until_iter:
+        timers.start("densification")
+        if batched_screenspace_pkg is not None:
+            gsplat_update_densification_stats(
+                iteration, gaussians, batched_screenspace_pkg
+            )
+
         if iteration > args.densify_from_iter and utils.check_update_at_this_iter(
             iteration, args.bsz, args.densification_interval, 0
         ):
@@ -138,6 +190,21 @@ def gsplat_densification(iteration, scene, gaussians, batched_screenspace_pkg):
             )
             timers.stop("densify_and_prune")
 
+            if args.min_visible_cameras > 0:
+                timers.start("prune_by_visible_cameras")
+                n_pruned = gaussians.prune_by_visible_cameras(
+                    scene.getTrainCameras(), args.min_visible_cameras
+                )
+                timers.stop("prune_by_visible_cameras")
+                log_file.write(
+                    "iteration[{},{}) pruned {} 3dgs seen by less than {} training cameras.\n".format(
+                        iteration,
+                        iteration + args.bsz,
+                        n_pruned,
+                        args.min_visible_cameras,
+                    )
+                )
+
             # redistribute after densify_and_prune, because we have new gaussians to distribute evenly.
             if utils.get_denfify_iter() % args.redistribute_gaussians_frequency == 0:
                 num_3dgs_before_redistribute = gaussians.get_xyz.shape[0]
@@ -155,6 +222,16 @@ def gsplat_densification(iteration, scene, gaussians, batched_screenspace_pkg):
                     )
                 )
 
+            # sort after redistribution, because redistribution appends remote gaussians in rank order.
+            if (
+                args.spatial_sort_gaussians_frequency > 0
+                and utils.get_denfify_iter() % args.spatial_sort_gaussians_frequency
+                == 0
+            ):
+                timers.start("spatial_sort_gaussians")
+                gaussians.spatially_sort_gaussians()
+                timers.stop("spatial_sort_gaussians")
+
             utils.check_memory_usage(
                 log_file, args, iteration, gaussians, before_densification_stop=True
             )
@@ -0,0 +1,109 @@
+import os
+import sys
+
+
+def get_suffix_in_folder(folder):
+
+    if not os.path.exists(folder):
+        return None
+
+    if not folder.endswith("/"):
+        folder += "/"
+
+    suffix_list_candidates = []
+    for ws in [1, 2, 4, 8, 16, 32]:
+        for rk in range(ws):
+            suffix_list_candidates.append(f"ws={ws}_rk={rk}")
+
+    suffix_list = []
+    for suffix in suffix_list_candidates:
+        if os.path.exists(folder + "python_time_" + suffix + ".log"):
+            suffix_list.append(suffix)
+
+    return suffix_list
+
+
+def get_average_time_per_key(expe_folder):
+    # python_time_ws=4_rk=0.log: iter 251, TimeFor 'forward_preprocess_gaussians': 12.345678 ms
+    # Average every key over all logged iterations, then take the max over ranks (the slowest rank decides the step time).
+    all_rank_average = {}
+    for suffix in get_suffix_in_folder(expe_folder):
+        lines = open(os.path.join(expe_folder, f"python_time_{suffix}.log")).readlines()
+        sum_time = {}
+        cnt = {}
+        for line in lines:
+            if "TimeFor '" not in line:
+                continue
+            key = line.split("TimeFor '")[1].split("'")[0]
+            ms = float(line.split("': ")[1].split(" ms")[0])
+            sum_time[key] = sum_time.get(key, 0.0) + ms
+            cnt[key] = cnt.get(key, 0) + 1
+        for key in sum_time:
+            all_rank_average[key] = max(
+                all_rank_average.get(key, 0.0), sum_time[key] / cnt[key]
+            )
+    return all_rank_average
+
+
+def get_average_stat_per_key(expe_folder):
+    # python_ws=4_rk=0.log: iterations: [251, 255) sync_gradients_fused_sparsely ... touched_fraction=0.123456 dense_fallback=0
+    # Average every key=value field over all logged lines, then take the max over ranks, as for the timers.
+    all_rank_average = {}
+    for suffix in get_suffix_in_folder(expe_folder):
+        log_path = os.path.join(expe_folder, f"python_{suffix}.log")
+        if not os.path.exists(log_path):
+            continue
+        sum_value = {}
+        cnt = {}
+        for line in open(log_path).readlines():
+            for field in line.split():
+                if "=" not in field:
+                    continue
+                key, value = field.split("=", 1)
+                try:
+                    value = float(value)
+                except ValueError:
+                    continue
+                sum_value[key] = sum_value.get(key, 0.0) + value
+                cnt[key] = cnt.get(key, 0) + 1
+        for key in sum_value:
+            all_rank_average[key] = max(
+                all_rank_average.get(key, 0.0), sum_value[key] / cnt[key]
+            )
+    return all_rank_average
+
+
+if __name__ == "__main__":
+    # usage: python examples/benchmark/analyze_timers.py <expe_folder_a> <expe_folder_b> ... [--keys k1 k2 ...]
+    # e.g. --keys sync_gradients touched_fraction dense_fallback
+    argv = sys.argv[1:]
+    keys = None
+    if "--keys" in argv:
+        keys = argv[argv.index("--keys") + 1 :]
+        argv = argv[: argv.index("--keys")]
+    expe_folders = argv
+
+    # timers in ms, and the key=value stats of the training log.
+    results = {
+        folder: {
+            **get_average_stat_per_key(folder),
+            **get_average_time_per_key(folder),
+        }
+        for folder in expe_folders
+    }
+    if keys is None:
+        keys = sorted(set(k for r in results.values() for k in r))
+
+    name_width = max(len(k) for k in keys) + 2
+    header = "timer (ms) / stat".ljust(name_width) + "".join(
+        os.path.basename(os.path.normpath(f)).rjust(24) for f in expe_folders
+    )
+    print(header)
+    for key in keys:
+        row = key.ljust(name_width)
+        for folder in expe_folders:
+            if key in results[folder]:
+                row += f"{results[folder][key]:.3f}".rjust(24)
+            else:
+                row += "-".rjust(24)
+        print(row)
@@ -0,0 +1,46 @@
+if [ $# -ne 2 ]; then
+    echo "Please specify exactly two arguments: the folder to save the experiments' log and checkpoints, and the folder of the dataset."
+    exit 1
+fi
+
+expe_folder=$1
+echo "The experiments will be saved in $expe_folder"
+dataset_folder=$2
+echo "The dataset is in $dataset_folder"
+
+# Compare random batches against spatially clustered batches with distributed 3dgs (the default).
+# Throughput: end2end it/s and the all-to-all timers; convergence: per-epoch training loss and test PSNR.
+SCENE=train
+BSZ=4
+
+monitor_opts="--enable_timer \
+--end2end_time \
+--log_interval 50"
+
+for batch_sampling in random spatial; do
+    expe_name="e_${SCENE}_${batch_sampling}"
+
+    torchrun --standalone --nnodes=1 --nproc-per-node=4 train.py \
+        -s ${dataset_folder}/${SCENE} \
+        --iterations 30000 \
+        --model_path ${expe_folder}/${expe_name} \
+        --bsz $BSZ \
+        --batch_sampling $batch_sampling \
+        $monitor_opts \
+        --test_iterations 7000 15000 30000 \
+        --save_iterations 30000 \
+        --eval
+done
+
+python examples/benchmark/analyze_timers.py \
+    ${expe_folder}/e_${SCENE}_random \
+    ${expe_folder}/e_${SCENE}_spatial \
+    --keys forward_preprocess_gaussians forward_all_to_all_communication forward_render_gaussians loss backward
+
+for batch_sampling in random spatial; do
+    log=${expe_folder}/e_${SCENE}_${batch_sampling}/python_ws=4_rk=0.log
+    echo "== ${batch_sampling}"
+    grep "end2end total_time" $log | tail -n 1
+    grep "epoch .* loss" $log | awk 'NR % 10 == 0'
+    grep "Evaluating test" $log
+done
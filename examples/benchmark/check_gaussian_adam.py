@@ -0,0 +1,95 @@
+import os
+import sys
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from scene.gaussian_optimizer import GaussianAdam, adam_step_reference
+
+# Check GaussianAdam against torch.optim.Adam and adam_step_reference on cpu tensors.
+# usage: python examples/benchmark/check_gaussian_adam.py
+
+
+def make_params(generator, n=1000):
+    shapes = [(n, 3), (n, 1, 3), (n, 15, 3), (n, 1), (n, 3), (n, 4)]
+    return [torch.randn(shape, generator=generator) for shape in shapes]
+
+
+if __name__ == "__main__":
+    generator = torch.Generator().manual_seed(0)
+    init = make_params(generator)
+    lrs = [1.6e-4, 2.5e-3, 1.25e-4, 5e-2, 5e-3, 1e-3]
+    betas = (0.9**4, 0.999**4)
+    bsz = 4
+
+    def build(optimizer_cls):
+        params = [torch.nn.Parameter(tensor.clone()) for tensor in init]
+        groups = [{"params": [p], "lr": lr} for p, lr in zip(params, lrs)]
+        return params, optimizer_cls(groups, lr=0.0, betas=betas, eps=1e-15)
+
+    fused_params, fused = build(GaussianAdam)
+    torch_params, torch_adam = build(torch.optim.Adam)
+    ref_params = [tensor.clone() for tensor in init]
+    ref_exp_avgs = [torch.zeros_like(tensor) for tensor in init]
+    ref_exp_avg_sqs = [torch.zeros_like(tensor) for tensor in init]
+
+    for step in range(1, 21):
+        grads = [torch.randn(tensor.shape, generator=generator) for tensor in init]
+        for param, grad in zip(fused_params, grads):
+            param.grad = grad.clone()
+        fused.step(grad_scale=1.0 / bsz)
+        for param, grad in zip(torch_params, grads):
+            param.grad = grad / bsz
+        torch_adam.step()
+        adam_step_reference(
+            ref_params,
+            grads,
+            ref_exp_avgs,
+            ref_exp_avg_sqs,
+            [step] * len(grads),
+            lrs,
+            betas,
+            1e-15,
+            grad_scale=1.0 / bsz,
+        )
+
+    for fused_param, torch_param, ref_param in zip(
+        fused_params, torch_params, ref_params
+    ):
+        assert torch.allclose(fused_param, torch_param, rtol=1e-5, atol=1e-7)
+        assert torch.allclose(fused_param, ref_param, rtol=1e-5, atol=1e-7)
+    print("GaussianAdam matches torch.optim.Adam and adam_step_reference.")
+
+    # A sparse step over all rows is a dense step; a row skipped for some steps and then updated
+    # gets its moments decayed by beta^skipped, which catch_up() also applies.
+    sparse_params, sparse = build(GaussianAdam)
+    dense_params, dense = build(GaussianAdam)
+    n = init[0].shape[0]
+    for step in range(1, 11):
+        grads = [torch.randn(tensor.shape, generator=generator) for tensor in init]
+        visible_ids = torch.arange(n) if step <= 5 else torch.arange(n // 2)
+        for sparse_param, dense_param, grad in zip(sparse_params, dense_params, grads):
+            sparse_param.grad = grad.clone()
+            dense_param.grad = grad.clone()
+            dense_param.grad[visible_ids.shape[0] :] = 0
+        sparse.step(grad_scale=1.0 / bsz, visible_ids=visible_ids)
+        dense.step(grad_scale=1.0 / bsz)
+        if step == 5:
+            for sparse_param, dense_param in zip(sparse_params, dense_params):
+                assert torch.allclose(sparse_param, dense_param, rtol=1e-5, atol=1e-7)
+    sparse.catch_up()
+    for sparse_param, dense_param in zip(sparse_params, dense_params):
+        # moments of skipped rows match dense Adam with zero grads; only the parameters differ.
+        for key in ["exp_avg", "exp_avg_sq"]:
+            assert torch.allclose(
+                sparse.state[sparse_param][key],
+                dense.state[dense_param][key],
+                rtol=1e-5,
+                atol=1e-12,
+            )
+        assert torch.allclose(
+            sparse_param[: n // 2], dense_param[: n // 2], rtol=1e-5, atol=1e-7
+        )
+    print(
+        "sparse GaussianAdam matches dense steps on visible rows and decays skipped moments."
+    )
@@ -0,0 +1,76 @@
+import os
+import sys
+from argparse import Namespace
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+import utils.general_utils as utils
+
+# Check hierarchical_all_to_all_single against a flat all_to_all_single on cpu processes with gloo.
+# usage: python examples/benchmark/check_hierarchical_all_to_all.py [n_nodes] [n_gpu_per_node]
+
+
+def run(rank, n_nodes, n_gpu_per_node, port):
+    world_size = n_nodes * n_gpu_per_node
+    dist.init_process_group(
+        "gloo",
+        init_method=f"tcp://127.0.0.1:{port}",
+        rank=rank,
+        world_size=world_size,
+    )
+    utils.GLOBAL_RANK = rank
+    utils.WORLD_SIZE = world_size
+    utils.DEFAULT_GROUP = dist.group.WORLD
+    utils.init_node_groups(n_gpu_per_node)
+    utils.set_args(Namespace(hierarchical_all_to_all=True))
+
+    for trial in range(5):
+        # same seed on every rank, so that every rank knows the whole size matrix.
+        generator = torch.Generator().manual_seed(trial)
+        i2j_send_size = torch.randint(
+            0, 20, (world_size, world_size), generator=generator
+        ).tolist()
+        if trial == 0:
+            i2j_send_size[0] = [0] * world_size  # empty chunks
+        # every row tells its source rank, destination rank and index inside the chunk.
+        send_buffer = torch.cat(
+            [
+                torch.stack(
+                    [
+                        torch.full((size,), rank),
+                        torch.full((size,), j),
+                        torch.arange(size),
+                    ],
+                    dim=1,
+                )
+                for j, size in enumerate(i2j_send_size[rank])
+            ]
+        ).float()
+
+        flat = torch.empty(
+            (sum(row[rank] for row in i2j_send_size), 3), dtype=torch.float32
+        )
+        dist.all_to_all_single(
+            flat,
+            send_buffer,
+            output_split_sizes=[row[rank] for row in i2j_send_size],
+            input_split_sizes=i2j_send_size[rank],
+        )
+        hierarchical = utils.all_to_all_single_rows(send_buffer, i2j_send_size)
+        assert torch.equal(flat, hierarchical), f"rank {rank} trial {trial} differs."
+    if rank == 0:
+        print(f"hierarchical all-to-all matches on {n_nodes} x {n_gpu_per_node} ranks.")
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    n_gpu_per_node = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    mp.spawn(
+        run,
+        args=(n_nodes, n_gpu_per_node, 29513),
+        nprocs=n_nodes * n_gpu_per_node,
+    )
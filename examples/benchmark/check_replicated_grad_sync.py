@@ -0,0 +1,79 @@
+import os
+import sys
+from argparse import Namespace
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+import utils.general_utils as utils
+from scene.gaussian_model import (
+    sync_gradients_densely,
+    sync_gradients_fused_densely,
+    sync_gradients_fused_sparsely,
+)
+
+# Check the fused gradient synchronizations of replicated 3dgs against sync_gradients_densely on cpu
+# processes with gloo. Every rank gets grads on a random subset of rows, as when it renders a few cameras.
+# usage: python examples/benchmark/check_replicated_grad_sync.py [world_size]
+
+PARAM_NAMES = [
+    "_xyz",
+    "_features_dc",
+    "_features_rest",
+    "_opacity",
+    "_scaling",
+    "_rotation",
+]
+
+
+def make_gaussians(seed, n, touched_ratio):
+    generator = torch.Generator().manual_seed(seed)
+    shapes = [(n, 3), (n, 1, 3), (n, 15, 3), (n, 1), (n, 3), (n, 4)]
+    touched = torch.rand((n,), generator=generator) < touched_ratio
+    gaussians = Namespace()
+    for name, shape in zip(PARAM_NAMES, shapes):
+        param = torch.nn.Parameter(torch.zeros(shape))
+        param.grad = torch.randn(shape, generator=generator)
+        param.grad[~touched] = 0
+        setattr(gaussians, name, param)
+    return gaussians
+
+
+def run(rank, world_size, port):
+    dist.init_process_group(
+        "gloo",
+        init_method=f"tcp://127.0.0.1:{port}",
+        rank=rank,
+        world_size=world_size,
+    )
+    utils.GLOBAL_RANK = rank
+    utils.WORLD_SIZE = world_size
+    utils.DEFAULT_GROUP = dist.group.WORLD
+    utils.set_cur_iter(0)
+    utils.set_log_file(open(os.devnull, "w"))
+
+    # (touched ratio on every rank, sparse_grad_sync_threshold): the sparse path, the dense fallback,
+    # and ranks without any grad.
+    cases = [(0.05, 0.5), (0.05, 0.0), (0.5, 0.5), (0.0, 0.5)]
+    for trial, (touched_ratio, threshold) in enumerate(cases):
+        utils.set_args(Namespace(bsz=1, sparse_grad_sync_threshold=threshold))
+        seed = trial * world_size + rank
+        reference = make_gaussians(seed, 1000, touched_ratio)
+        sync_gradients_densely(reference, utils.DEFAULT_GROUP)
+        for sync_func in [sync_gradients_fused_densely, sync_gradients_fused_sparsely]:
+            gaussians = make_gaussians(seed, 1000, touched_ratio)
+            sync_func(gaussians, utils.DEFAULT_GROUP)
+            for name in PARAM_NAMES:
+                assert torch.allclose(
+                    getattr(gaussians, name).grad, getattr(reference, name).grad
+                ), f"rank {rank} trial {trial}: {sync_func.__name__} differs on {name}."
+    if rank == 0:
+        print(f"fused gradient synchronizations match on {world_size} ranks.")
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    world_size = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    mp.spawn(run, args=(world_size, 29514), nprocs=world_size)
@@ -0,0 +1,113 @@
+import os
+import sys
+import random
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+import utils.general_utils as utils
+from gaussian_renderer.workload_division import (
+    division_pos_heuristic,
+    adjust_division_pos_to_image_borders,
+    adjust_division_pos_to_image_borders_reference,
+    get_batched_strategies,
+    get_batched_strategies_reference,
+    get_new_heuristics,
+    get_new_heuristics_reference,
+    kd_split_tiles,
+    get_new_tile_heuristics_2d,
+    DivisionStrategyFinal2D,
+)
+
+# Check the vectorized adjust_division_pos_to_image_borders, get_batched_strategies and get_new_heuristics
+# against their loop reference implementations on random heuristics, batch sizes and world sizes.
+# The heuristics live on the gpu, as in training.
+# Also check that tile_blocks divisions cut columns where the measured per-tile cost is, not by area.
+# usage: python examples/benchmark/check_strategy_final.py [n_trials]
+
+
+if __name__ == "__main__":
+    assert torch.cuda.is_available(), "the division helpers allocate on cuda."
+    n_trials = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(0)
+    generator = torch.Generator(device="cuda").manual_seed(0)
+    utils.GLOBAL_RANK = 0
+
+    n_checked = 0
+    for trial in range(n_trials):
+        utils.TILE_Y = rng.randint(8, 136)
+        bsz = rng.randint(1, 8)
+        world_size = rng.randint(1, 16)
+        border_divpos_coeff = rng.choice([0.0, 1.0, 2.0, 4.0])
+        # skewed heuristics, so that division positions also land close to image borders.
+        heuristic = (
+            torch.rand((bsz * utils.TILE_Y,), device="cuda", generator=generator) ** 4
+            + 1e-3
+        )
+
+        division_pos = torch.tensor(
+            division_pos_heuristic(
+                heuristic, bsz * utils.TILE_Y, world_size, right=True
+            )
+        )
+        adjusted_division_pos = adjust_division_pos_to_image_borders(
+            division_pos, utils.TILE_Y, border_divpos_coeff
+        )
+        reference_division_pos = adjust_division_pos_to_image_borders_reference(
+            division_pos.tolist(), utils.TILE_Y, border_divpos_coeff
+        )
+        assert adjusted_division_pos.tolist() == reference_division_pos, trial
+        if not bool(
+            (
+                adjusted_division_pos[:-1] + border_divpos_coeff
+                < adjusted_division_pos[1:]
+            ).all()
+        ):
+            # start_strategy_final rejects such divisions too.
+            continue
+
+        batched_cameras = [None] * bsz
+        batched_strategies, gpuid2tasks = get_batched_strategies(
+            batched_cameras, adjusted_division_pos
+        )
+        reference_strategies, reference_gpuid2tasks = get_batched_strategies_reference(
+            batched_cameras, reference_division_pos
+        )
+        assert gpuid2tasks == reference_gpuid2tasks, trial
+        for strategy, reference_strategy in zip(
+            batched_strategies, reference_strategies
+        ):
+            assert strategy.gpu_ids == reference_strategy.gpu_ids, trial
+            assert strategy.division_pos == reference_strategy.division_pos, trial
+            strategy.validate(
+                strategy.world_size,
+                strategy.gpu_ids,
+                strategy.division_pos,
+                list(zip(strategy.division_pos[:-1], strategy.division_pos[1:])),
+            )
+
+        gpu_camera_running_time = [
+            [rng.uniform(1.0, 100.0) for _ in range(bsz)] for _ in range(world_size)
+        ]
+        assert torch.allclose(
+            get_new_heuristics(batched_strategies, gpu_camera_running_time),
+            get_new_heuristics_reference(batched_strategies, gpu_camera_running_time),
+        ), trial
+        n_checked += 1
+
+    assert n_checked > 0, "no trial produced a valid division."
+
+    # a wide image whose work is all in its 8 leftmost tile columns.
+    utils.TILE_Y, utils.TILE_X = 4, 64
+    tile_heuristic = torch.zeros((utils.TILE_Y, utils.TILE_X))
+    tile_heuristic[:, :8] = 1.0
+    tile_rects = kd_split_tiles(tile_heuristic, (0, utils.TILE_Y, 0, utils.TILE_X), 2)
+    assert tile_rects == [(0, 4, 0, 4), (0, 4, 4, 64)], tile_rects
+    # the measured time of each block is spread over its tiles only.
+    strategy = DivisionStrategyFinal2D(None, [0, 1], tile_rects)
+    new_tile_heuristic = get_new_tile_heuristics_2d([strategy], [[3.0], [5.0]])[0]
+    assert torch.allclose(new_tile_heuristic[:, :4].sum(), torch.tensor(3.0))
+    assert torch.allclose(new_tile_heuristic[:, 4:].sum(), torch.tensor(5.0))
+    print(
+        f"strategy_final helpers match their references on {n_checked} of {n_trials} random batches."
+    )
@@ -0,0 +1,47 @@
+if [ $# -ne 2 ]; then
+    echo "Please specify exactly two arguments: the folder to save the experiments' log and checkpoints, and the folder of the dataset."
+    exit 1
+fi
+
+expe_folder=$1
+echo "The experiments will be saved in $expe_folder"
+dataset_folder=$2
+echo "The dataset is in $dataset_folder"
+
+# PSNR parity of --mixed_precision_dtype float16/bfloat16 against float32, with distributed 3dgs (the default).
+# Throughput: end2end it/s and the loss/all-to-all timers; quality: test PSNR, which should stay within ~0.1 dB of float32.
+SCENE=train
+BSZ=4
+
+monitor_opts="--enable_timer \
+--end2end_time \
+--log_interval 50"
+
+for dtype in float32 float16 bfloat16; do
+    expe_name="e_${SCENE}_${dtype}"
+
+    torchrun --standalone --nnodes=1 --nproc-per-node=4 train.py \
+        -s ${dataset_folder}/${SCENE} \
+        --iterations 30000 \
+        --model_path ${expe_folder}/${expe_name} \
+        --bsz $BSZ \
+        --stacked_loss \
+        --mixed_precision_dtype $dtype \
+        $monitor_opts \
+        --test_iterations 7000 15000 30000 \
+        --save_iterations 30000 \
+        --eval
+done
+
+python examples/benchmark/analyze_timers.py \
+    ${expe_folder}/e_${SCENE}_float32 \
+    ${expe_folder}/e_${SCENE}_float16 \
+    ${expe_folder}/e_${SCENE}_bfloat16 \
+    --keys forward_all_to_all_communication loss_computation local_loss_computation backward
+
+for dtype in float32 float16 bfloat16; do
+    log=${expe_folder}/e_${SCENE}_${dtype}/python_ws=4_rk=0.log
+    echo "== ${dtype}"
+    grep "end2end total_time" $log | tail -n 1
+    grep "Evaluating test" $log
+done
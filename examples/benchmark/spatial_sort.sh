@@ -0,0 +1,39 @@
+
+if [ $# -ne 2 ]; then
+    echo "Please specify exactly two arguments: the folder to save the experiments' log and checkpoints, and the folder of the dataset."
+    exit 1
+fi
+
+expe_folder=$1
+echo "The experiments will be saved in $expe_folder"
+dataset_folder=$2
+echo "The dataset is in $dataset_folder"
+
+# Compare the default storage order against a morton-sorted storage order.
+# Each run logs python-side timers for preprocess, all-to-all packing and densification.
+SCENE=train
+BSZ=4
+
+monitor_opts="--enable_timer \
+--end2end_time \
+--log_interval 50"
+
+for sort_frequency in -1 1; do
+    expe_name="e_${SCENE}_sort${sort_frequency}"
+
+    torchrun --standalone --nnodes=1 --nproc-per-node=4 train.py \
+        -s ${dataset_folder}/${SCENE} \
+        --iterations 15000 \
+        --model_path ${expe_folder}/${expe_name} \
+        --bsz $BSZ \
+        --spatial_sort_gaussians_frequency $sort_frequency \
+        $monitor_opts \
+        --test_iterations 15000 \
+        --save_iterations 15000 \
+        --eval
+done
+
+python examples/benchmark/analyze_timers.py \
+    ${expe_folder}/e_${SCENE}_sort-1 \
+    ${expe_folder}/e_${SCENE}_sort1 \
+    --keys forward_preprocess_gaussians forward_all_to_all_communication densification densify_and_prune redistribute_gaussians spatial_sort_gaussians optimizer_step
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from utils.loss_utils import pixelwise_ssim_with_mask, fast_pixelwise_ssim_with_mask
+
+# Check fast_pixelwise_ssim_with_mask against pixelwise_ssim_with_mask, forward and backward,
+# and time both on local image strips of several sizes (forward + backward, as in training).
+# usage: python examples/benchmark/ssim.py [n_repeats]
+
+
+def time_ssim(ssim_fn, img1, img2, mask, n_repeats):
+    def run():
+        img1.grad = None
+        ssim_fn(img1, img2, mask).sum().backward()
+
+    run()  # warm up; also fills the window cache of the fast version.
+    if img1.is_cuda:
+        torch.cuda.synchronize()
+    start_time = time.time()
+    for _ in range(n_repeats):
+        run()
+    if img1.is_cuda:
+        torch.cuda.synchronize()
+    return (time.time() - start_time) * 1000 / n_repeats
+
+
+if __name__ == "__main__":
+    n_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    generator = torch.Generator().manual_seed(0)
+    # (H, W): full images and the strips a gpu gets when 4 or 16 gpus split them by tile rows.
+    sizes = [
+        (545, 980),
+        (1080, 1920),
+        (2160, 3840),
+        (2160 // 4, 3840),
+        (2160 // 16, 3840),
+    ]
+
+    print(f"device: {device}")
+    for h, w in sizes:
+        img1 = torch.rand((3, h, w), generator=generator).to(device).requires_grad_()
+        img2 = torch.rand((3, h, w), generator=generator).to(device)
+        mask = torch.rand((h, w), generator=generator).to(device) > 0.1
+
+        ssim = pixelwise_ssim_with_mask(img1, img2, mask)
+        ssim.sum().backward()
+        grad = img1.grad
+        img1.grad = None
+        fast_ssim = fast_pixelwise_ssim_with_mask(img1, img2, mask)
+        fast_ssim.sum().backward()
+        assert torch.allclose(ssim, fast_ssim, rtol=1e-4, atol=1e-5), f"{h}x{w}"
+        assert torch.allclose(grad, img1.grad, rtol=1e-4, atol=1e-5), f"{h}x{w}"
+
+        reference_time = time_ssim(
+            pixelwise_ssim_with_mask, img1, img2, mask, n_repeats
+        )
+        fast_time = time_ssim(
+            fast_pixelwise_ssim_with_mask, img1, img2, mask, n_repeats
+        )
+        print(
+            "{}x{}: pixelwise_ssim_with_mask {:.3f} ms, fast_pixelwise_ssim_with_mask {:.3f} ms, speedup {:.2f}x".format(
+                h, w, reference_time, fast_time, reference_time / fast_time
+            )
+        )
@@ -24,6 +24,7 @@ from gsplat import (
     rasterize_to_pixels,
 )
 from scene.gaussian_model import GaussianModel
+from gaussian_renderer.workload_division import get_tile_row_3dgs_count
 import utils.general_utils as utils
 import torch.distributed.nn.functional as dist_func
 
@@ -539,7 +540,200 @@ def get_cuda_args_final(strategy, mode="train"):
     return cuda_args
 
 
-def all_to_all_communication_final(
+SCREENSPACE_TRANSFER_DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+}
+
+
+def pack_columns_to_int16(buffer, column_layout):
+    # column_layout: list of (n_columns, dtype) segments covering buffer's columns.
+    # return: (N, *) int16 buffer; each segment is cast to its dtype and its bits are kept as int16 words.
+    packed = []
+    first_column = 0
+    for n_columns, dtype in column_layout:
+        segment = buffer[:, first_column : first_column + n_columns].to(dtype)
+        packed.append(segment.contiguous().view(torch.int16))
+        first_column += n_columns
+    return torch.cat(packed, dim=1)
+
+
+def unpack_columns_from_int16(packed, column_layout):
+    # inverse of pack_columns_to_int16; every segment is reconstructed as float32.
+    unpacked = []
+    first_word = 0
+    for n_columns, dtype in column_layout:
+        n_words = n_columns * (torch.finfo(dtype).bits // 16)
+        segment = packed[:, first_word : first_word + n_words].contiguous()
+        unpacked.append(segment.view(dtype).float())
+        first_word += n_words
+    return torch.cat(unpacked, dim=1)
+
+
+class _ScreenspaceAllToAll(torch.autograd.Function):
+    # all_to_all_single over rows of a packed float32 screen-space buffer; i2j_send_size[i][j] is the
+    # number of rows gpu i sends to gpu j.
+    # column_layout gives the transfer dtype of every segment of columns; float16/bfloat16 segments are
+    # sent as 16-bit words and reconstructed as float32 on receipt, in the forward and in the backward.
+    # If all segments are float32, the buffer skips the int16 packing.
+    # Only the first n_grad_columns columns are differentiable; the backward sends only their gradients.
+    @staticmethod
+    def forward(ctx, send_buffer, i2j_send_size, column_layout, n_grad_columns):
+        ctx.i2j_send_size = i2j_send_size
+        ctx.n_grad_columns = n_grad_columns
+        ctx.n_columns = send_buffer.shape[1]
+        ctx.grad_column_layout = []
+        n_columns_left = n_grad_columns
+        for n_columns, dtype in column_layout:
+            if n_columns_left == 0:
+                break
+            ctx.grad_column_layout.append((min(n_columns, n_columns_left), dtype))
+            n_columns_left -= ctx.grad_column_layout[-1][0]
+
+        # with every segment in float32 there is nothing to narrow, so the rows are sent as they are.
+        ctx.packed = any(dtype != torch.float32 for _, dtype in column_layout)
+        if not ctx.packed:
+            return utils.all_to_all_single_rows(send_buffer.detach(), i2j_send_size)
+        send_words = pack_columns_to_int16(send_buffer.detach(), column_layout)
+        recv_words = utils.all_to_all_single_rows(send_words, i2j_send_size)
+        return unpack_columns_from_int16(recv_words, column_layout)
+
+    @staticmethod
+    def backward(ctx, grad_recv_buffer):
+        # gradients go back the opposite way.
+        j2i_send_size = [list(sizes) for sizes in zip(*ctx.i2j_send_size)]
+        if ctx.packed:
+            grad_recv_words = pack_columns_to_int16(
+                grad_recv_buffer[:, : ctx.n_grad_columns], ctx.grad_column_layout
+            )
+            grad_send_words = utils.all_to_all_single_rows(
+                grad_recv_words, j2i_send_size
+            )
+            grad_send_buffer = unpack_columns_from_int16(
+                grad_send_words, ctx.grad_column_layout
+            )
+        else:
+            grad_send_buffer = utils.all_to_all_single_rows(
+                grad_recv_buffer[:, : ctx.n_grad_columns].contiguous(), j2i_send_size
+            )
+        grad_send_buffer = torch.nn.functional.pad(
+            grad_send_buffer, (0, ctx.n_columns - ctx.n_grad_columns)
+        )
+        return grad_send_buffer, None, None, None
+
+
+def get_recv_order_by_camera(recv_sizes):
+    # recv_sizes: (world_size, num_cameras) rows received from gpu i for camera k, stored in this order.
+    # return: ids that regroup the received rows by camera, then by source gpu.
+    world_size, num_cameras = recv_sizes.shape
+    flat_sizes = recv_sizes.reshape(-1)
+    recv_starts = (torch.cumsum(flat_sizes, dim=0) - flat_sizes).view(
+        world_size, num_cameras
+    )
+    sizes_by_camera = recv_sizes.t().reshape(-1)
+    starts_by_camera = recv_starts.t().reshape(-1)
+    offsets = torch.repeat_interleave(
+        starts_by_camera - (torch.cumsum(sizes_by_camera, dim=0) - sizes_by_camera),
+        sizes_by_camera,
+    )
+    return torch.arange(offsets.shape[0]) + offsets
+
+
+def fused_all_to_all_communication_final(
+    batched_screenspace_params, local_to_gpuj_camk_send_ids, gpui_to_gpuj_imgk_size
+):
+    # One all_to_all_single for all cameras and all screen-space states.
+    # Every row is [means2D, rgb, conic_opacity, radii bit-cast to float32, depths], and the first three
+    # fields are sent in the precision set by args.screenspace_*_dtype;
+    # send and receive orders are computed once per batch from the exchanged sizes.
+    num_cameras = len(batched_screenspace_params)
+    world_size = utils.DEFAULT_GROUP.size()
+    rank = utils.DEFAULT_GROUP.rank()
+
+    batched_packed_states = []
+    camera_offsets = [0]
+    for k in range(num_cameras):
+        means2D, rgb, conic_opacity, radii, depths = batched_screenspace_params[k]
+        if k == 0:
+            dims = [means2D.shape[1], rgb.shape[1], conic_opacity.shape[1]]
+        batched_packed_states.append(
+            torch.cat(
+                [
+                    means2D,
+                    rgb,
+                    conic_opacity,
+                    radii.int().view(torch.float32).unsqueeze(1),
+                    depths.unsqueeze(1),
+                ],
+                dim=1,
+            )
+        )
+        camera_offsets.append(camera_offsets[-1] + means2D.shape[0])
+    packed_states = torch.cat(batched_packed_states, dim=0)
+
+    # rows to send, ordered by destination gpu then camera.
+    send_ids = torch.cat(
+        [
+            local_to_gpuj_camk_send_ids[j][k].view(-1).to(packed_states.device)
+            + camera_offsets[k]
+            for j in range(world_size)
+            for k in range(num_cameras)
+        ]
+    )
+    i2j_send_size = [
+        [sum(gpui_to_gpuj_imgk_size[i][j]) for j in range(world_size)]
+        for i in range(world_size)
+    ]
+
+    # radii are bit-cast, so they and depths always go as float32.
+    args = utils.get_args()
+    column_layout = [
+        (dims[0], SCREENSPACE_TRANSFER_DTYPES[args.screenspace_means2D_dtype]),
+        (dims[1], SCREENSPACE_TRANSFER_DTYPES[args.screenspace_rgb_dtype]),
+        (dims[2], SCREENSPACE_TRANSFER_DTYPES[args.screenspace_conic_opacity_dtype]),
+        (2, torch.float32),
+    ]
+    recv_buffer = _ScreenspaceAllToAll.apply(
+        packed_states[send_ids], i2j_send_size, column_layout, sum(dims)
+    )
+
+    recv_sizes = torch.tensor(
+        [gpui_to_gpuj_imgk_size[i][rank] for i in range(world_size)], dtype=torch.long
+    )
+    recv_order = get_recv_order_by_camera(recv_sizes).to(recv_buffer.device)
+    batched_recv_states = recv_buffer[recv_order].split(
+        recv_sizes.sum(dim=0).tolist(), dim=0
+    )
+
+    batched_means2D_redistributed = []
+    batched_rgb_redistributed = []
+    batched_conic_opacity_redistributed = []
+    batched_radii_redistributed = []
+    batched_depths_redistributed = []
+    for recv_states in batched_recv_states:
+        means2D, rgb, conic_opacity, radii, depths = torch.split(
+            recv_states, dims + [1, 1], dim=1
+        )
+        batched_means2D_redistributed.append(means2D)
+        batched_rgb_redistributed.append(rgb)
+        batched_conic_opacity_redistributed.append(conic_opacity)
+        batched_radii_redistributed.append(
+            radii.detach().contiguous().view(torch.int32).squeeze(1)
+        )
+        batched_depths_redistributed.append(depths.detach().contiguous().squeeze(1))
+
+    return (
+        batched_means2D_redistributed,
+        batched_rgb_redistributed,
+        batched_conic_opacity_redistributed,
+        batched_radii_redistributed,
+        batched_depths_redistributed,
+        gpui_to_gpuj_imgk_size,
+    )
+
+
+def get_local_to_gpuj_camk_send_ids_final(
     batched_rasterizers,
     batched_screenspace_params,
     batched_cuda_args,
@@ -569,6 +763,12 @@ def all_to_all_communication_final(
                     torch.empty((0, 1), dtype=torch.int64)
                 )
 
+    return local_to_gpuj_camk_size, local_to_gpuj_camk_send_ids
+
+
+def all_gather_gpui_to_gpuj_imgk_size(local_to_gpuj_camk_size):
+    # return: (world_size, world_size, num_cameras) int tensor on the gpu; not copied to the host yet.
+    num_cameras = len(local_to_gpuj_camk_size[0])
     gpui_to_gpuj_imgk_size = torch.zeros(
         (utils.DEFAULT_GROUP.size(), utils.DEFAULT_GROUP.size(), num_cameras),
         dtype=torch.int,
@@ -582,7 +782,42 @@ def all_to_all_communication_final(
         local_to_gpuj_camk_size_tensor,
         group=utils.DEFAULT_GROUP,
     )
-    gpui_to_gpuj_imgk_size = gpui_to_gpuj_imgk_size.cpu().numpy().tolist()
+    return gpui_to_gpuj_imgk_size
+
+
+def all_to_all_communication_final(
+    batched_rasterizers,
+    batched_screenspace_params,
+    batched_cuda_args,
+    batched_strategies,
+    send_ids_and_sizes=None,
+):
+    num_cameras = len(batched_rasterizers)
+    if send_ids_and_sizes is None:
+        local_to_gpuj_camk_size, local_to_gpuj_camk_send_ids = (
+            get_local_to_gpuj_camk_send_ids_final(
+                batched_rasterizers,
+                batched_screenspace_params,
+                batched_cuda_args,
+                batched_strategies,
+            )
+        )
+        gpui_to_gpuj_imgk_size = (
+            all_gather_gpui_to_gpuj_imgk_size(local_to_gpuj_camk_size)
+            .cpu()
+            .numpy()
+            .tolist()
+        )
+    else:
+        # already exchanged by start_size_exchange_on_side_stream.
+        local_to_gpuj_camk_send_ids, gpui_to_gpuj_imgk_size = send_ids_and_sizes
+
+    if utils.get_args().fused_screenspace_all_to_all:
+        return fused_all_to_all_communication_final(
+            batched_screenspace_params,
+            local_to_gpuj_camk_send_ids,
+            gpui_to_gpuj_imgk_size,
+        )
 
     def one_all_to_all(batched_tensors, use_function_version=False):
         tensor_to_rki = []
@@ -875,6 +1110,92 @@ def gsplat_all_to_all_communication_final(
     )
 
 
+ALL_TO_ALL_STREAM = None
+
+
+def get_all_to_all_stream():
+    global ALL_TO_ALL_STREAM
+    if ALL_TO_ALL_STREAM is None:
+        ALL_TO_ALL_STREAM = torch.cuda.Stream()
+    return ALL_TO_ALL_STREAM
+
+
+def start_size_exchange_on_side_stream(
+    batched_rasterizers,
+    batched_screenspace_params,
+    batched_cuda_args,
+    batched_strategies,
+):
+    # Find the local 3dgs to send to every gpu for a chunk of cameras, and all-gather the send sizes on the
+    # all-to-all stream into pinned host memory, without blocking the host on the copy.
+    # return: the send ids, the sizes on the host, and an event recorded once they have been copied.
+    local_to_gpuj_camk_size, local_to_gpuj_camk_send_ids = (
+        get_local_to_gpuj_camk_send_ids_final(
+            batched_rasterizers,
+            batched_screenspace_params,
+            batched_cuda_args,
+            batched_strategies,
+        )
+    )
+    main_stream = torch.cuda.current_stream()
+    comm_stream = get_all_to_all_stream()
+    comm_stream.wait_stream(main_stream)
+    for screenspace_params in batched_screenspace_params:
+        for tensor in screenspace_params:
+            tensor.record_stream(comm_stream)
+    for send_ids in local_to_gpuj_camk_send_ids:
+        for tensor in send_ids:
+            if tensor.is_cuda:
+                tensor.record_stream(comm_stream)
+    with torch.cuda.stream(comm_stream):
+        gpui_to_gpuj_imgk_size = all_gather_gpui_to_gpuj_imgk_size(
+            local_to_gpuj_camk_size
+        )
+        sizes_on_host = torch.empty(
+            gpui_to_gpuj_imgk_size.shape, dtype=torch.int, pin_memory=True
+        )
+        sizes_on_host.copy_(gpui_to_gpuj_imgk_size, non_blocking=True)
+        copied = torch.cuda.Event()
+        copied.record(comm_stream)
+    return local_to_gpuj_camk_send_ids, sizes_on_host, copied
+
+
+def all_to_all_communication_final_on_side_stream(
+    batched_rasterizers,
+    batched_screenspace_params,
+    batched_cuda_args,
+    batched_strategies,
+    exchanged_sizes,
+):
+    # Launch all_to_all_communication_final for a chunk of cameras on the all-to-all stream, so that the
+    # default stream can go on preprocessing the next chunk. Autograd runs the backward of these ops on
+    # the same stream. exchanged_sizes: the return of start_size_exchange_on_side_stream for this chunk,
+    # which already made the all-to-all stream wait for its preprocessing.
+    # return: the redistributed states, and an event recorded once they have arrived.
+    main_stream = torch.cuda.current_stream()
+    comm_stream = get_all_to_all_stream()
+    local_to_gpuj_camk_send_ids, sizes_on_host, copied = exchanged_sizes
+    copied.synchronize()
+    with torch.cuda.stream(comm_stream):
+        results = all_to_all_communication_final(
+            batched_rasterizers,
+            batched_screenspace_params,
+            batched_cuda_args,
+            batched_strategies,
+            send_ids_and_sizes=(
+                local_to_gpuj_camk_send_ids,
+                sizes_on_host.numpy().tolist(),
+            ),
+        )
+        arrived = torch.cuda.Event()
+        arrived.record(comm_stream)
+    # the received tensors are consumed on the default stream.
+    for batched_tensors in results[:5]:
+        for tensor in batched_tensors:
+            tensor.record_stream(main_stream)
+    return results, arrived
+
+
 def distributed_preprocess3dgs_and_all2all_final(
     batched_viewpoint_cameras,
     pc: GaussianModel,
@@ -904,18 +1225,47 @@ def distributed_preprocess3dgs_and_all2all_final(
     scales = pc.get_scaling
     rotations = pc.get_rotation
     shs = pc.get_features
+    if args.frustum_culling:
+        visibility_cache = pc.get_visibility_cache()
     if timers is not None:
         timers.stop("forward_prepare_gaussians")
     utils.check_initial_gpu_memory_usage("after forward_prepare_gaussians")
     ########## [END] Prepare Gaussians for rendering ##########
 
+    # With args.all_to_all_chunk_size > 0, the all-to-all of every chunk of cameras is launched on a
+    # side stream as soon as the chunk is preprocessed, and render_final waits for each camera's chunk only.
+    pipelined = args.all_to_all_chunk_size > 0 and utils.DEFAULT_GROUP.size() > 1
     if timers is not None:
-        timers.start("forward_preprocess_gaussians")
+        timers.start(
+            "forward_preprocess_and_all_to_all"
+            if pipelined
+            else "forward_preprocess_gaussians"
+        )
     batched_rasterizers = []  # One rasterizer for each picture in a batch
     batched_cuda_args = []  # Per picture in a batch
     batched_screenspace_params = []  # Per picture in a batch
     batched_means2D = []
     batched_radii = []
+    # ids of the local 3dgs that were preprocessed; None means all of them.
+    batched_local_ids = []
+    # all_to_all_communication_final results of each chunk of cameras
+    batched_chunk_results = []
+    batched_arrived_events = []  # per camera, event recorded once its chunk has arrived
+    # chunks whose sizes are being exchanged, and whose all-to-all has not been launched yet.
+    pending_chunks = []
+    chunk_end = 0
+
+    def launch_chunk_all_to_all(chunk, exchanged_sizes):
+        chunk_results, arrived = all_to_all_communication_final_on_side_stream(
+            batched_rasterizers[chunk],
+            batched_screenspace_params[chunk],
+            batched_cuda_args[chunk],
+            batched_strategies[chunk],
+            exchanged_sizes,
+        )
+        batched_chunk_results.append(chunk_results)
+        batched_arrived_events.extend([arrived] * (chunk.stop - chunk.start))
+
     for i, (viewpoint_camera, strategy) in enumerate(
         zip(batched_viewpoint_cameras, batched_strategies)
     ):
@@ -946,14 +1296,31 @@ def distributed_preprocess3dgs_and_all2all_final(
         ########## [END] Prepare CUDA Rasterization Settings ##########
 
         # [3DGS-wise preprocess]
-        means2D, rgb, conic_opacity, radii, depths = rasterizer.preprocess_gaussians(
-            means3D=means3D,
-            scales=scales,
-            rotations=rotations,
-            shs=shs,
-            opacities=opacity,
-            cuda_args=cuda_args,
-        )
+        if args.frustum_culling:
+            # only preprocess the 3dgs in chunks that intersect this camera's frustum.
+            local_ids = visibility_cache.get_visible_ids(viewpoint_camera)
+            means2D, rgb, conic_opacity, radii, depths = (
+                rasterizer.preprocess_gaussians(
+                    means3D=means3D[local_ids],
+                    scales=scales[local_ids],
+                    rotations=rotations[local_ids],
+                    shs=shs[local_ids],
+                    opacities=opacity[local_ids],
+                    cuda_args=cuda_args,
+                )
+            )
+        else:
+            local_ids = None
+            means2D, rgb, conic_opacity, radii, depths = (
+                rasterizer.preprocess_gaussians(
+                    means3D=means3D,
+                    scales=scales,
+                    rotations=rotations,
+                    shs=shs,
+                    opacities=opacity,
+                    cuda_args=cuda_args,
+                )
+            )
         if mode == "train":
             means2D.retain_grad()
         batched_means2D.append(means2D)
@@ -961,9 +1328,38 @@ def distributed_preprocess3dgs_and_all2all_final(
         batched_rasterizers.append(rasterizer)
         batched_screenspace_params.append(screenspace_params)
         batched_radii.append(radii)
+        batched_local_ids.append(local_ids)
+
+        if pipelined and (
+            (i + 1) % args.all_to_all_chunk_size == 0
+            or i + 1 == len(batched_viewpoint_cameras)
+        ):
+            chunk = slice(chunk_end, i + 1)
+            chunk_end = i + 1
+            # start the size exchange of this chunk, then launch the all-to-all of the previous chunk, whose
+            # sizes reached the host while this chunk was preprocessed.
+            pending_chunks.append(
+                (
+                    chunk,
+                    start_size_exchange_on_side_stream(
+                        batched_rasterizers[chunk],
+                        batched_screenspace_params[chunk],
+                        batched_cuda_args[chunk],
+                        batched_strategies[chunk],
+                    ),
+                )
+            )
+            if len(pending_chunks) > 1:
+                launch_chunk_all_to_all(*pending_chunks.pop(0))
+    for pending_chunk in pending_chunks:
+        launch_chunk_all_to_all(*pending_chunk)
     utils.check_initial_gpu_memory_usage("after forward_preprocess_gaussians")
     if timers is not None:
-        timers.stop("forward_preprocess_gaussians")
+        timers.stop(
+            "forward_preprocess_and_all_to_all"
+            if pipelined
+            else "forward_preprocess_gaussians"
+        )
 
     if utils.DEFAULT_GROUP.size() == 1:
         batched_screenspace_pkg = {
@@ -972,6 +1368,7 @@ def distributed_preprocess3dgs_and_all2all_final(
                 radii > 0 for radii in batched_radii
             ],
             "batched_locally_preprocessed_radii": batched_radii,
+            "batched_locally_preprocessed_ids": batched_local_ids,
             "batched_rasterizers": batched_rasterizers,
             "batched_cuda_args": batched_cuda_args,
             "batched_means2D_redistributed": [
@@ -1000,24 +1397,52 @@ def distributed_preprocess3dgs_and_all2all_final(
         }
         return batched_screenspace_pkg
 
-    if timers is not None:
-        timers.start("forward_all_to_all_communication")
-    (
-        batched_means2D_redistributed,
-        batched_rgb_redistributed,
-        batched_conic_opacity_redistributed,
-        batched_radii_redistributed,
-        batched_depths_redistributed,
-        gpui_to_gpuj_imgk_size,
-    ) = all_to_all_communication_final(
-        batched_rasterizers,
-        batched_screenspace_params,
-        batched_cuda_args,
-        batched_strategies,
-    )
+    if pipelined:
+        # concatenate the chunks along the camera dimension.
+        (
+            batched_means2D_redistributed,
+            batched_rgb_redistributed,
+            batched_conic_opacity_redistributed,
+            batched_radii_redistributed,
+            batched_depths_redistributed,
+        ) = [
+            [
+                tensor
+                for chunk_results in batched_chunk_results
+                for tensor in chunk_results[field]
+            ]
+            for field in range(5)
+        ]
+        gpui_to_gpuj_imgk_size = [
+            [
+                [
+                    size
+                    for chunk_results in batched_chunk_results
+                    for size in chunk_results[5][i][j]
+                ]
+                for j in range(utils.DEFAULT_GROUP.size())
+            ]
+            for i in range(utils.DEFAULT_GROUP.size())
+        ]
+    else:
+        if timers is not None:
+            timers.start("forward_all_to_all_communication")
+        (
+            batched_means2D_redistributed,
+            batched_rgb_redistributed,
+            batched_conic_opacity_redistributed,
+            batched_radii_redistributed,
+            batched_depths_redistributed,
+            gpui_to_gpuj_imgk_size,
+        ) = all_to_all_communication_final(
+            batched_rasterizers,
+            batched_screenspace_params,
+            batched_cuda_args,
+            batched_strategies,
+        )
+        if timers is not None:
+            timers.stop("forward_all_to_all_communication")
     utils.check_initial_gpu_memory_usage("after forward_all_to_all_communication")
-    if timers is not None:
-        timers.stop("forward_all_to_all_communication")
 
     batched_screenspace_pkg = {
         "batched_locally_preprocessed_mean2D": batched_means2D,
@@ -1025,6 +1450,7 @@ def distributed_preprocess3dgs_and_all2all_final(
             radii > 0 for radii in batched_radii
         ],
         "batched_locally_preprocessed_radii": batched_radii,
+        "batched_locally_preprocessed_ids": batched_local_ids,
         "batched_rasterizers": batched_rasterizers,
         "batched_cuda_args": batched_cuda_args,
         "batched_means2D_redistributed": batched_means2D_redistributed,
@@ -1034,6 +1460,8 @@ def distributed_preprocess3dgs_and_all2all_final(
         "batched_depths_redistributed": batched_depths_redistributed,
         "gpui_to_gpuj_imgk_size": gpui_to_gpuj_imgk_size,
     }
+    if pipelined:
+        batched_screenspace_pkg["batched_arrived_events"] = batched_arrived_events
     return batched_screenspace_pkg
 
 
@@ -1219,6 +1647,7 @@ def render_final(batched_screenspace_pkg, batched_strategies, tile_size=16):
     Render the scene.
     """
     timers = utils.get_timers()
+    args = utils.get_args()
 
     batched_rendered_image = []
     batched_compute_locally = []
@@ -1238,6 +1667,11 @@ def render_final(batched_screenspace_pkg, batched_strategies, tile_size=16):
         if timers is not None:
             timers.stop("forward_compute_locally")
 
+        if "batched_arrived_events" in batched_screenspace_pkg:
+            # pipelined all-to-all: only wait for the chunk of this camera.
+            torch.cuda.current_stream().wait_event(
+                batched_screenspace_pkg["batched_arrived_events"][cam_id]
+            )
         rasterizer = batched_screenspace_pkg["batched_rasterizers"][cam_id]
         cuda_args = batched_screenspace_pkg["batched_cuda_args"][cam_id]
         means2D_redistributed = batched_screenspace_pkg[
@@ -1280,6 +1714,16 @@ def render_final(batched_screenspace_pkg, batched_strategies, tile_size=16):
                     cuda_args=cuda_args,
                 )
             )
+        if args.workload_cost_model and strategy.division_pos is not None:
+            # 3dgs count of the local tile rows, as the feature of the workload cost model.
+            cuda_args["stats_collector"]["tile_row_3dgs_count"] = (
+                get_tile_row_3dgs_count(
+                    means2D_redistributed,
+                    radii_redistributed,
+                    strategy.division_pos[strategy.rank],
+                    strategy.division_pos[strategy.rank + 1],
+                )
+            )
         batched_rendered_image.append(rendered_image)
         batched_compute_locally.append(compute_locally)
 
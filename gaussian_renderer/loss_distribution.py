@@ -1,7 +1,14 @@
 import torch
 import utils.general_utils as utils
 import torch.distributed as dist
-from utils.loss_utils import pixelwise_l1_with_mask, pixelwise_ssim_with_mask
+from utils.loss_utils import (
+    pixelwise_l1_with_mask,
+    pixelwise_ssim_with_mask,
+    fast_pixelwise_ssim_with_mask,
+    normalize_gt_image,
+    scale_gradient,
+    LOSS_DTYPES,
+)
 import time
 import diff_gaussian_rasterization
 
@@ -2330,6 +2337,22 @@ def get_coverage_y_max(tile_ids_r):
     return min(tile_ids_r * utils.BLOCK_Y, utils.IMG_H)
 
 
+def get_coverage_x_min_max(tile_ids_l, tile_ids_r):
+    return tile_ids_l * utils.BLOCK_X, min(tile_ids_r * utils.BLOCK_X, utils.IMG_W)
+
+
+def get_task_coverage(task):
+    # task: (camera_id, tile_y_l, tile_y_r) for tile-row divisions,
+    # or (camera_id, tile_y_l, tile_y_r, tile_x_l, tile_x_r) for tile-block divisions.
+    # return: pixel range (min_y, max_y, min_x, max_x) of the task.
+    coverage_min_y, coverage_max_y = get_coverage_y_min_max(task[1], task[2])
+    if len(task) == 5:
+        coverage_min_x, coverage_max_x = get_coverage_x_min_max(task[3], task[4])
+    else:
+        coverage_min_x, coverage_max_x = 0, utils.IMG_W
+    return coverage_min_y, coverage_max_y, coverage_min_x, coverage_max_x
+
+
 def load_camera_from_cpu_to_all_gpu_for_eval(
     batched_cameras, batched_strategies, gpuid2tasks
 ):
@@ -2399,42 +2422,74 @@ def load_camera_from_cpu_to_all_gpu(batched_cameras, batched_strategies, gpuid2t
     # Asynchronously load ground-truth image to GPU
     timers.start("load_gt_image_to_gpu")
 
-    def load_camera_from_cpu_to_gpu(first_task, last_task):
+    def load_camera_from_cpu_to_gpu(tasks):
+        # load, for each camera, the full-width band of rows covered by the tasks.
         coverage_min_max_y = {}
-        coverage_min_y_first_task = get_coverage_y_min(first_task[1])
-        coverage_max_y_last_task = get_coverage_y_max(last_task[2])
-        for camera_id_in_batch in range(first_task[0], last_task[0] + 1):
-            coverage_min_y = 0
-            if camera_id_in_batch == first_task[0]:
-                coverage_min_y = coverage_min_y_first_task
-            coverage_max_y = utils.IMG_H
-            if camera_id_in_batch == last_task[0]:
-                coverage_max_y = coverage_max_y_last_task
-
+        for task in tasks:
+            coverage_min_y, coverage_max_y, _, _ = get_task_coverage(task)
+            if task[0] in coverage_min_max_y:
+                coverage_min_y = min(coverage_min_y, coverage_min_max_y[task[0]][0])
+                coverage_max_y = max(coverage_max_y, coverage_min_max_y[task[0]][1])
+            coverage_min_max_y[task[0]] = (coverage_min_y, coverage_max_y)
+        for camera_id_in_batch, (coverage_min_y, coverage_max_y) in sorted(
+            coverage_min_max_y.items()
+        ):
             batched_cameras[camera_id_in_batch].original_image = (
                 batched_cameras[camera_id_in_batch]
                 .original_image_backup[:, coverage_min_y:coverage_max_y, :]
                 .cuda()
             )
-            coverage_min_max_y[camera_id_in_batch] = (coverage_min_y, coverage_max_y)
         return coverage_min_max_y
 
+    def slice_task_from_band(task, coverage_min_max_y):
+        # the part of the loaded band of rows that task needs.
+        coverage_min_y, coverage_max_y, coverage_min_x, coverage_max_x = (
+            get_task_coverage(task)
+        )
+        band_min_y, band_max_y = coverage_min_max_y[task[0]]
+        if (
+            coverage_min_y == band_min_y
+            and coverage_max_y == band_max_y
+            and coverage_min_x == 0
+            and coverage_max_x == utils.IMG_W
+        ):
+            # less memory copy
+            return batched_cameras[task[0]].original_image.contiguous()
+        return (
+            batched_cameras[task[0]]
+            .original_image[
+                :,
+                coverage_min_y - band_min_y : coverage_max_y - band_min_y,
+                coverage_min_x:coverage_max_x,
+            ]
+            .contiguous()
+        )
+
     if args.distributed_dataset_storage:
         if args.local_sampling:
             # TODO: may preloaded
-            first_task = gpuid2tasks[utils.GLOBAL_RANK][0]
-            last_task = gpuid2tasks[utils.GLOBAL_RANK][-1]
-            _ = load_camera_from_cpu_to_gpu(first_task, last_task)
+            coverage_min_max_y = load_camera_from_cpu_to_gpu(
+                gpuid2tasks[utils.GLOBAL_RANK]
+            )
         elif utils.IN_NODE_GROUP.rank() == 0:
             in_node_first_rank = utils.GLOBAL_RANK
             in_node_last_rank = in_node_first_rank + utils.IN_NODE_GROUP.size() - 1
-            first_task = gpuid2tasks[in_node_first_rank][0]
-            last_task = gpuid2tasks[in_node_last_rank][-1]
-            coverage_min_max_y_gpu0 = load_camera_from_cpu_to_gpu(first_task, last_task)
+            coverage_min_max_y_gpu0 = load_camera_from_cpu_to_gpu(
+                [
+                    task
+                    for rank in range(in_node_first_rank, in_node_last_rank + 1)
+                    for task in gpuid2tasks[rank]
+                ]
+            )
     else:
-        first_task = gpuid2tasks[utils.GLOBAL_RANK][0]
-        last_task = gpuid2tasks[utils.GLOBAL_RANK][-1]
-        _ = load_camera_from_cpu_to_gpu(first_task, last_task)
+        coverage_min_max_y = load_camera_from_cpu_to_gpu(gpuid2tasks[utils.GLOBAL_RANK])
+
+    if not args.distributed_dataset_storage or args.local_sampling:
+        # only keep the pixels of the local tasks, e.g. the columns of a block of tiles.
+        for task in gpuid2tasks[utils.GLOBAL_RANK]:
+            batched_cameras[task[0]].original_image = slice_task_from_band(
+                task, coverage_min_max_y
+            )
 
     timers.stop("load_gt_image_to_gpu")
 
@@ -2452,36 +2507,8 @@ def load_camera_from_cpu_to_all_gpu(batched_cameras, batched_strategies, gpuid2t
                 if rank == utils.GLOBAL_RANK:
                     continue
                 for task in gpuid2tasks[rank]:
-                    camera_id = task[0]
-                    coverage_min_y = get_coverage_y_min(task[1])
-                    coverage_max_y = get_coverage_y_max(task[2])
-
-                    coverage_min_y_gpu0, coverage_max_y_gpu0 = coverage_min_max_y_gpu0[
-                        camera_id
-                    ]
-                    if (
-                        coverage_min_y == coverage_min_y_gpu0
-                        and coverage_max_y == coverage_max_y_gpu0
-                    ):
-                        # less memory copy
-                        op = torch.distributed.P2POp(
-                            dist.isend,
-                            batched_cameras[camera_id].original_image.contiguous(),
-                            rank,
-                        )
-                    else:
-                        send_tensor = (
-                            batched_cameras[camera_id]
-                            .original_image[
-                                :,
-                                coverage_min_y
-                                - coverage_min_y_gpu0 : coverage_max_y
-                                - coverage_min_y_gpu0,
-                                :,
-                            ]
-                            .contiguous()
-                        )
-                        op = torch.distributed.P2POp(dist.isend, send_tensor, rank)
+                    send_tensor = slice_task_from_band(task, coverage_min_max_y_gpu0)
+                    op = torch.distributed.P2POp(dist.isend, send_tensor, rank)
                     comm_ops.append(op)
 
             reqs = torch.distributed.batch_isend_irecv(comm_ops)
@@ -2489,31 +2516,22 @@ def load_camera_from_cpu_to_all_gpu(batched_cameras, batched_strategies, gpuid2t
                 req.wait()
 
             for task in gpuid2tasks[utils.GLOBAL_RANK]:
-                camera_id = task[0]
-                coverage_min_y_gpu0, coverage_max_y_gpu0 = coverage_min_max_y_gpu0[
-                    camera_id
-                ]
-                coverage_min_y = get_coverage_y_min(task[1])
-                coverage_max_y = get_coverage_y_max(task[2])
-                batched_cameras[camera_id].original_image = (
-                    batched_cameras[camera_id]
-                    .original_image[
-                        :,
-                        coverage_min_y
-                        - coverage_min_y_gpu0 : coverage_max_y
-                        - coverage_min_y_gpu0,
-                        :,
-                    ]
-                    .contiguous()
+                batched_cameras[task[0]].original_image = slice_task_from_band(
+                    task, coverage_min_max_y_gpu0
                 )
         else:
             in_node_first_rank = utils.get_first_rank_on_cur_node()
             recv_buffer_list = []
             for task in gpuid2tasks[utils.GLOBAL_RANK]:
-                coverage_min_y = get_coverage_y_min(task[1])
-                coverage_max_y = get_coverage_y_max(task[2])
+                coverage_min_y, coverage_max_y, coverage_min_x, coverage_max_x = (
+                    get_task_coverage(task)
+                )
                 recv_buffer = torch.zeros(
-                    (3, coverage_max_y - coverage_min_y, utils.IMG_W),
+                    (
+                        3,
+                        coverage_max_y - coverage_min_y,
+                        coverage_max_x - coverage_min_x,
+                    ),
                     dtype=torch.uint8,
                     device="cuda",
                 )
@@ -2533,6 +2551,27 @@ def load_camera_from_cpu_to_all_gpu(batched_cameras, batched_strategies, gpuid2t
     timers.stop("scatter_gt_image")
 
 
+def get_local_image_rect(image, strategy):
+    # return: (3, H, W) view of the pixels of image this gpu computes the loss of.
+    assert (
+        utils.GLOBAL_RANK in strategy.gpu_ids
+    ), "The current gpu must be used to render this camera."
+    tile_y_l, tile_y_r, tile_x_l, tile_x_r = strategy.get_local_tile_rect()
+    coverage_min_y, coverage_max_y = get_coverage_y_min_max(tile_y_l, tile_y_r)
+    coverage_min_x, coverage_max_x = get_coverage_x_min_max(tile_x_l, tile_x_r)
+    return image[:, coverage_min_y:coverage_max_y, coverage_min_x:coverage_max_x]
+
+
+def get_loss_scale(loss_dtype):
+    # The per-pixel gradients of the normalized losses are about 1 / (3 * num_pixels), which is subnormal or
+    # zero in float16. Inside the float16 part of the loss, the gradient of the unnormalized sum is
+    # backpropagated instead, and it is unscaled in float32 on the rendered image. bfloat16 has the
+    # exponent range of float32 and needs no scaling.
+    if loss_dtype == torch.float16:
+        return utils.get_num_pixels() * 3.0
+    return 1.0
+
+
 def final_system_loss_computation(
     image, viewpoint_cam, compute_locally, strategy, statistic_collector
 ):
@@ -2540,25 +2579,20 @@ def final_system_loss_computation(
     args = utils.get_args()
 
     timers.start("prepare_image_rect_and_mask")
-    assert (
-        utils.GLOBAL_RANK in strategy.gpu_ids
-    ), "The current gpu must be used to render this camera."
-    rank = strategy.gpu_ids.index(utils.GLOBAL_RANK)
-    tile_ids_l, tile_ids_r = (
-        strategy.division_pos[rank],
-        strategy.division_pos[rank + 1],
-    )
-    coverage_min_y, coverage_max_y = get_coverage_y_min_max(tile_ids_l, tile_ids_r)
-
-    local_image_rect = image[:, coverage_min_y:coverage_max_y, :].contiguous()
-    local_image_rect_pixels_compute_locally = torch.ones(
-        (coverage_max_y - coverage_min_y, utils.IMG_W), dtype=torch.bool, device="cuda"
+    loss_dtype = LOSS_DTYPES[args.mixed_precision_dtype]
+    loss_scale = get_loss_scale(loss_dtype)
+    local_image_rect = (
+        scale_gradient(get_local_image_rect(image, strategy), 1.0 / loss_scale)
+        .to(loss_dtype)
+        .contiguous()
     )
+    # every pixel of the local rect is computed locally, so no mask is applied.
+    local_image_rect_pixels_compute_locally = None
     timers.stop("prepare_image_rect_and_mask")
 
     # Move partial image_gt which is needed to GPU.
     timers.start("prepare_gt_image")
-    local_image_rect_gt = torch.clamp(viewpoint_cam.original_image / 255.0, 0.0, 1.0)
+    local_image_rect_gt = normalize_gt_image(viewpoint_cam.original_image, loss_dtype)
     timers.stop("prepare_gt_image")
 
     # Loss computation
@@ -2568,12 +2602,20 @@ def final_system_loss_computation(
     pixelwise_Ll1 = pixelwise_l1_with_mask(
         local_image_rect, local_image_rect_gt, local_image_rect_pixels_compute_locally
     )
-    Ll1 = pixelwise_Ll1.sum() / (utils.get_num_pixels() * 3)
+    # accumulate in float32, also when the pixelwise losses are in half precision.
+    Ll1 = scale_gradient(pixelwise_Ll1.sum(dtype=torch.float32), loss_scale) / (
+        utils.get_num_pixels() * 3
+    )
     # utils.check_initial_gpu_memory_usage("after l1_loss")
-    pixelwise_ssim_loss = pixelwise_ssim_with_mask(
+    pixelwise_ssim_fn = (
+        fast_pixelwise_ssim_with_mask if args.fast_ssim else pixelwise_ssim_with_mask
+    )
+    pixelwise_ssim_loss = pixelwise_ssim_fn(
         local_image_rect, local_image_rect_gt, local_image_rect_pixels_compute_locally
     )
-    ssim_loss = pixelwise_ssim_loss.sum() / (utils.get_num_pixels() * 3)
+    ssim_loss = scale_gradient(
+        pixelwise_ssim_loss.sum(dtype=torch.float32), loss_scale
+    ) / (utils.get_num_pixels() * 3)
 
     torch.cuda.synchronize()
     statistic_collector["forward_loss_time"] = (time.time() - start_time) * 1000
@@ -2585,6 +2627,87 @@ def final_system_loss_computation(
     return Ll1, ssim_loss
 
 
+def stacked_loss_computation(
+    batched_local_image_rect, batched_cameras, batched_statistic_collector
+):
+    # L1 and ssim of all local image strips of the batch in one batched launch.
+    # Strips are zero-padded to the largest one: the ssim window sees zeros outside a strip either way,
+    # and the padded pixels are masked out, so the per-camera losses equal final_system_loss_computation's.
+    # forward_loss_time is measured with cuda events without a host sync; it is read in
+    # collect_forward_loss_time and split among the cameras by their number of pixels.
+    timers = utils.get_timers()
+    args = utils.get_args()
+
+    timers.start("prepare_image_rect_and_mask")
+    loss_dtype = LOSS_DTYPES[args.mixed_precision_dtype]
+    loss_scale = get_loss_scale(loss_dtype)
+    heights = [rect.shape[1] for rect in batched_local_image_rect]
+    widths = [rect.shape[2] for rect in batched_local_image_rect]
+    shape = (len(batched_local_image_rect), 3, max(heights), max(widths))
+    stacked_image = torch.zeros(shape, dtype=loss_dtype, device="cuda")
+    stacked_image_gt = torch.zeros(shape, dtype=loss_dtype, device="cuda")
+    # strips of the same size need no padding, hence no mask.
+    padded = len(set(heights)) > 1 or len(set(widths)) > 1
+    stacked_pixel_mask = (
+        torch.zeros((shape[0], shape[2], shape[3]), dtype=torch.bool, device="cuda")
+        if padded
+        else None
+    )
+    for idx, (rect, camera, h, w) in enumerate(
+        zip(batched_local_image_rect, batched_cameras, heights, widths)
+    ):
+        stacked_image[idx, :, :h, :w] = scale_gradient(rect, 1.0 / loss_scale)
+        stacked_image_gt[idx, :, :h, :w] = camera.original_image
+        if padded:
+            stacked_pixel_mask[idx, :h, :w] = True
+    timers.stop("prepare_image_rect_and_mask")
+
+    timers.start("prepare_gt_image")
+    # the uint8 gt was converted while being copied into the stack; values in [0, 255] need no clamp.
+    stacked_image_gt.div_(255.0)
+    timers.stop("prepare_gt_image")
+
+    timers.start("local_loss_computation")
+    start_event = torch.cuda.Event(enable_timing=True)
+    end_event = torch.cuda.Event(enable_timing=True)
+    start_event.record()
+    pixelwise_Ll1 = pixelwise_l1_with_mask(
+        stacked_image, stacked_image_gt, stacked_pixel_mask
+    )
+    pixelwise_ssim_loss = fast_pixelwise_ssim_with_mask(
+        stacked_image, stacked_image_gt, stacked_pixel_mask
+    )
+    batched_Ll1 = scale_gradient(
+        pixelwise_Ll1.sum(dim=(1, 2, 3), dtype=torch.float32), loss_scale
+    ) / (utils.get_num_pixels() * 3)
+    batched_ssim_loss = scale_gradient(
+        pixelwise_ssim_loss.sum(dim=(1, 2, 3), dtype=torch.float32), loss_scale
+    ) / (utils.get_num_pixels() * 3)
+    end_event.record()
+    n_pixels = [h * w for h, w in zip(heights, widths)]
+    for statistic_collector, n in zip(batched_statistic_collector, n_pixels):
+        statistic_collector["forward_loss_events"] = (
+            start_event,
+            end_event,
+            n / sum(n_pixels),
+        )
+    timers.stop("local_loss_computation")
+
+    return batched_Ll1, batched_ssim_loss
+
+
+def collect_forward_loss_time(batched_statistic_collector):
+    # turn the cuda events of stacked_loss_computation into forward_loss_time, once per iteration.
+    for statistic_collector in batched_statistic_collector:
+        if "forward_loss_events" not in statistic_collector:
+            continue
+        start_event, end_event, share = statistic_collector.pop("forward_loss_events")
+        end_event.synchronize()
+        statistic_collector["forward_loss_time"] = (
+            start_event.elapsed_time(end_event) * share
+        )
+
+
 def batched_loss_computation(
     batched_image,
     batched_cameras,
@@ -2595,6 +2718,41 @@ def batched_loss_computation(
     args = utils.get_args()
     timers = utils.get_timers()
 
+    if args.stacked_loss:
+        timers.start("loss_computation")
+        local_ids = [
+            idx
+            for idx, image in enumerate(batched_image)
+            if image is not None and len(image.shape) > 0
+        ]
+        if len(local_ids) > 0:
+            batched_Ll1, batched_ssim_loss = stacked_loss_computation(
+                [
+                    get_local_image_rect(batched_image[idx], batched_strategies[idx])
+                    for idx in local_ids
+                ],
+                [batched_cameras[idx] for idx in local_ids],
+                [batched_statistic_collector[idx] for idx in local_ids],
+            )
+            loss_sum = (
+                (1.0 - args.lambda_dssim) * batched_Ll1
+                + args.lambda_dssim * (1.0 - batched_ssim_loss)
+            ).sum()
+        else:
+            loss_sum = 0
+        batched_losses = [[0.0, 0.0] for _ in batched_image]
+        for idx, image in enumerate(batched_image):
+            if image is not None and len(image.shape) == 0:
+                # This image is not rendered locally.
+                loss_sum += image * 0
+                batched_losses[idx] = [image * 0, 0.0]
+        for i, idx in enumerate(local_ids):
+            batched_losses[idx] = [batched_Ll1[i], batched_ssim_loss[i]]
+
+        assert loss_sum.dim() == 0, "The loss_sum must be a scalar tensor."
+        timers.stop("loss_computation")
+        return loss_sum * args.lr_scale_loss, batched_losses
+
     # Loss computation
     timers.start("loss_computation")
     batched_losses = []
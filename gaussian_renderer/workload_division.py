@@ -4,6 +4,7 @@ import torch
 import time
 import utils.general_utils as utils
 import diff_gaussian_rasterization
+from gaussian_renderer.loss_distribution import collect_forward_loss_time
 
 ########################## Utility Functions ##########################
 
@@ -94,6 +95,59 @@ def division_pos_heuristic(heuristic, tile_num, world_size, right=False):
     return division_pos
 
 
+def get_tile_row_3dgs_count(means2D, radii, tile_l, tile_r):
+    # return: (TILE_Y,) number of 3dgs whose screen-space rect touches each tile row in [tile_l, tile_r), zero elsewhere.
+    # The rect follows getRect() of the rasterizer.
+    visible = radii > 0
+    y = means2D.detach()[visible, 1]
+    r = radii[visible].float()
+    row_min = ((y - r) / utils.BLOCK_Y).long().clamp(tile_l, tile_r)
+    row_max = ((y + r + utils.BLOCK_Y - 1) / utils.BLOCK_Y).long().clamp(tile_l, tile_r)
+    count = torch.zeros((utils.TILE_Y + 1,), dtype=torch.float32, device=means2D.device)
+    ones = torch.ones_like(y)
+    count.index_add_(0, row_min, ones)
+    count.index_add_(0, row_max, -ones)
+    return torch.cumsum(count, dim=0)[: utils.TILE_Y]
+
+
+class TileRowCostModel:
+    """
+    Linear model of the running time of a tile row: a * (number of 3dgs touching the row) + b.
+
+    Fitted online by least squares over (camera, gpu) samples, older samples decay geometrically.
+    """
+
+    def __init__(self, decay=0.99):
+        self.decay = decay
+        # decayed sums over samples of count*count, count*rows, rows*rows, count*time, rows*time.
+        self.s_cc = self.s_cr = self.s_rr = self.s_ct = self.s_rt = 0.0
+        self.a = 1.0
+        self.b = 1.0
+
+    def add_sample(self, n_3dgs, n_rows, running_time):
+        # n_3dgs: sum of the tile row 3dgs counts of the rows rendered by one gpu for one camera.
+        self.s_cc = self.s_cc * self.decay + n_3dgs * n_3dgs
+        self.s_cr = self.s_cr * self.decay + n_3dgs * n_rows
+        self.s_rr = self.s_rr * self.decay + n_rows * n_rows
+        self.s_ct = self.s_ct * self.decay + n_3dgs * running_time
+        self.s_rt = self.s_rt * self.decay + n_rows * running_time
+
+    def fit(self):
+        det = self.s_cc * self.s_rr - self.s_cr * self.s_cr
+        if det > 1e-9 * self.s_cc * self.s_rr:
+            a = (self.s_ct * self.s_rr - self.s_cr * self.s_rt) / det
+            b = (self.s_cc * self.s_rt - self.s_cr * self.s_ct) / det
+            if a > 0 and b >= 0:
+                self.a, self.b = a, b
+                return
+        # degenerate or negative fit: only keep the per-3dgs cost.
+        if self.s_cc > 0 and self.s_ct > 0:
+            self.a, self.b = self.s_ct / self.s_cc, 0.0
+
+    def predict(self, tile_row_3dgs_count):
+        return tile_row_3dgs_count * self.a + self.b
+
+
 def get_local_running_time_by_modes(stats_collector):
     args = utils.get_args()
     local_running_time = 0
@@ -684,8 +738,30 @@ def get_division_strategy_history(
 class DivisionStrategyFinal:
 
     def __init__(
-        self, camera, world_size, gpu_ids, division_pos, gpu_for_this_camera_tilelr
+        self,
+        camera,
+        world_size,
+        gpu_ids,
+        division_pos,
+        gpu_for_this_camera_tilelr,
+        validate=True,
     ):
+        # validate=False skips the per-position checks, for callers that already checked the whole batch.
+        if validate:
+            self.validate(world_size, gpu_ids, division_pos, gpu_for_this_camera_tilelr)
+
+        self.camera = camera
+        self.world_size = world_size
+        self.gpu_ids = gpu_ids
+        if utils.GLOBAL_RANK in gpu_ids:
+            self.rank = gpu_ids.index(utils.GLOBAL_RANK)
+        else:
+            self.rank = -1
+
+        self.division_pos = division_pos
+
+    @staticmethod
+    def validate(world_size, gpu_ids, division_pos, gpu_for_this_camera_tilelr):
         assert world_size > 0, "The world_size must be greater than 0."
         assert (
             len(gpu_ids) == world_size
@@ -708,16 +784,6 @@ class DivisionStrategyFinal:
                 and gpu_for_this_camera_tilelr[idx][1] == division_pos[idx + 1]
             ), "The division_pos must be consistent with gpu_for_this_camera_tilelr."
 
-        self.camera = camera
-        self.world_size = world_size
-        self.gpu_ids = gpu_ids
-        if utils.GLOBAL_RANK in gpu_ids:
-            self.rank = gpu_ids.index(utils.GLOBAL_RANK)
-        else:
-            self.rank = -1
-
-        self.division_pos = division_pos
-
     def get_local2j_ids(self, means2D, radii, raster_settings, cuda_args):
         dist_global_strategy_tensor = (
             torch.tensor(self.division_pos, dtype=torch.int, device=means2D.device)
@@ -770,6 +836,15 @@ class DivisionStrategyFinal:
 
         return local2j_ids, local2j_ids_bool
 
+    def get_local_tile_rect(self):
+        # return: (tile_y_l, tile_y_r, tile_x_l, tile_x_r) of the tiles rendered by this gpu.
+        return (
+            self.division_pos[self.rank],
+            self.division_pos[self.rank + 1],
+            0,
+            utils.TILE_X,
+        )
+
     def get_compute_locally(self):
         if utils.GLOBAL_RANK not in self.gpu_ids:
             return None
@@ -803,18 +878,305 @@ class DivisionStrategyFinal:
         return None
 
 
+class DivisionStrategyFinal2D:
+    """
+    Division of one camera's image into one rectangular block of tiles per gpu.
+
+    Compared with tile rows, blocks have a smaller perimeter when many gpus render one image,
+    so fewer 3dgs straddle a boundary and get sent to several gpus.
+    """
+
+    def __init__(self, camera, gpu_ids, tile_rects):
+        # tile_rects[i]: (tile_y_l, tile_y_r, tile_x_l, tile_x_r) rendered by gpu_ids[i].
+        assert len(gpu_ids) == len(
+            tile_rects
+        ), "Each gpu must render exactly one block of tiles."
+        self.camera = camera
+        self.world_size = len(gpu_ids)
+        self.gpu_ids = gpu_ids
+        if utils.GLOBAL_RANK in gpu_ids:
+            self.rank = gpu_ids.index(utils.GLOBAL_RANK)
+        else:
+            self.rank = -1
+
+        self.tile_rects = tile_rects
+        self.division_pos = None  # only defined for tile-row divisions.
+
+    def get_local2j_ids(self, means2D, radii, raster_settings, cuda_args):
+        return get_local2j_ids_by_tile_rects(means2D, radii, self.tile_rects)
+
+    def gsplat_get_local2j_ids(
+        self, means2D, radii, image_height, image_width, cuda_args
+    ):
+        return get_local2j_ids_by_tile_rects(means2D, radii, self.tile_rects)
+
+    def get_local_tile_rect(self):
+        return self.tile_rects[self.rank]
+
+    def get_compute_locally(self):
+        if utils.GLOBAL_RANK not in self.gpu_ids:
+            return None
+        tile_y_l, tile_y_r, tile_x_l, tile_x_r = self.get_local_tile_rect()
+        compute_locally = torch.zeros(
+            (utils.TILE_Y, utils.TILE_X), dtype=torch.bool, device="cuda"
+        )
+        compute_locally[tile_y_l:tile_y_r, tile_x_l:tile_x_r] = True
+        return compute_locally
+
+    def get_compute_locally_all(self):
+        if utils.GLOBAL_RANK not in self.gpu_ids:
+            return None
+        return torch.ones((utils.TILE_Y, utils.TILE_X), dtype=torch.bool, device="cuda")
+
+    def get_extended_compute_locally(self):
+        return None
+
+
+def get_local2j_ids_by_tile_rects(means2D, radii, tile_rects):
+    # Same result layout as diff_gaussian_rasterization._C.get_local2j_ids_bool, for blocks of tiles.
+    # A 3dgs is sent to every gpu whose block overlaps its screen-space rect (getRect() of the rasterizer).
+    rects = torch.tensor(tile_rects, dtype=torch.long, device=means2D.device)
+    x = means2D.detach()[:, 0].unsqueeze(1)
+    y = means2D.detach()[:, 1].unsqueeze(1)
+    r = radii.float().unsqueeze(1)
+    rect_min_x = ((x - r) / utils.BLOCK_X).long().clamp(0, utils.TILE_X)
+    rect_max_x = (
+        ((x + r + utils.BLOCK_X - 1) / utils.BLOCK_X).long().clamp(0, utils.TILE_X)
+    )
+    rect_min_y = ((y - r) / utils.BLOCK_Y).long().clamp(0, utils.TILE_Y)
+    rect_max_y = (
+        ((y + r + utils.BLOCK_Y - 1) / utils.BLOCK_Y).long().clamp(0, utils.TILE_Y)
+    )
+    local2j_ids_bool = (
+        (radii > 0).unsqueeze(1)
+        & (rect_min_y < rects[:, 1])
+        & (rect_max_y > rects[:, 0])
+        & (rect_min_x < rects[:, 3])
+        & (rect_max_x > rects[:, 2])
+    )
+
+    local2j_ids = []
+    for rk in range(len(tile_rects)):
+        local2j_ids.append(local2j_ids_bool[:, rk].nonzero())
+
+    return local2j_ids, local2j_ids_bool
+
+
+def kd_split_tiles(heuristic, tile_rect, n_parts):
+    # heuristic: (TILE_Y, TILE_X) cpu tensor of per-tile cost.
+    # return: n_parts tile rects (tile_y_l, tile_y_r, tile_x_l, tile_x_r) of about equal cost,
+    # obtained by recursively cutting the longer side (in pixels) of tile_rect.
+    tile_y_l, tile_y_r, tile_x_l, tile_x_r = tile_rect
+    if n_parts == 1:
+        return [tile_rect]
+    assert (tile_y_r - tile_y_l) * (
+        tile_x_r - tile_x_l
+    ) >= n_parts, "Not enough tiles to give each gpu a block."
+
+    n_parts_l = n_parts // 2
+    block = heuristic[tile_y_l:tile_y_r, tile_x_l:tile_x_r]
+    cut_rows = (tile_y_r - tile_y_l) * utils.BLOCK_Y >= (
+        tile_x_r - tile_x_l
+    ) * utils.BLOCK_X
+    if tile_y_r - tile_y_l == 1:
+        cut_rows = False
+    elif tile_x_r - tile_x_l == 1:
+        cut_rows = True
+    prefix_sum = torch.cumsum(block.sum(dim=1 if cut_rows else 0), dim=0)
+    length = prefix_sum.shape[0]
+    other_length = (tile_x_r - tile_x_l) if cut_rows else (tile_y_r - tile_y_l)
+    target = prefix_sum[-1] * n_parts_l / n_parts
+    cut = int(torch.searchsorted(prefix_sum, target).item()) + 1
+    # both sides need at least one tile per part.
+    cut_min = (n_parts_l + other_length - 1) // other_length
+    cut_max = length - (n_parts - n_parts_l + other_length - 1) // other_length
+    cut = min(max(cut, cut_min), cut_max)
+
+    if cut_rows:
+        rect_l = (tile_y_l, tile_y_l + cut, tile_x_l, tile_x_r)
+        rect_r = (tile_y_l + cut, tile_y_r, tile_x_l, tile_x_r)
+    else:
+        rect_l = (tile_y_l, tile_y_r, tile_x_l, tile_x_l + cut)
+        rect_r = (tile_y_l, tile_y_r, tile_x_l + cut, tile_x_r)
+    return kd_split_tiles(heuristic, rect_l, n_parts_l) + kd_split_tiles(
+        heuristic, rect_r, n_parts - n_parts_l
+    )
+
+
+def get_batched_strategies_2d(
+    batched_cameras,
+    batched_heuristic,
+    world_size,
+    affinity=None,
+    batched_tile_heuristic=None,
+):
+    # batched_heuristic: (batch_size, TILE_Y) per tile row cost; requires world_size >= batch_size.
+    # batched_tile_heuristic: optional list of (TILE_Y, TILE_X) per tile cost, None for cameras without one;
+    # the blocks are cut along it, so that column cuts also follow where the work is.
+    # Give every camera a number of gpus proportional to its cost, then kd-split its tiles among them.
+    # affinity: optional (batch_size, world_size) fraction of each camera's visible 3dgs stored on each gpu;
+    # if given, the most expensive cameras pick the free gpus they have the highest affinity with.
+    assert world_size >= len(
+        batched_cameras
+    ), "tile_blocks division needs at least one gpu per camera."
+    batched_heuristic = batched_heuristic.float().cpu()
+    camera_cost = batched_heuristic.sum(dim=1).tolist()
+    n_gpus = [1 for _ in batched_cameras]
+    for _ in range(world_size - len(batched_cameras)):
+        # next gpu goes to the camera with the highest cost per gpu.
+        idx = max(range(len(n_gpus)), key=lambda i: camera_cost[i] / n_gpus[i])
+        n_gpus[idx] += 1
+
+    batched_strategies = []
+    gpuid2tasks = [
+        [] for _ in range(world_size)
+    ]  # map from gpuid to a list of tasks (camera_id, tile_y_l, tile_y_r, tile_x_l, tile_x_r).
+    batched_gpu_ids = []
+    first_gpu = 0
+    for idx in range(len(batched_cameras)):
+        batched_gpu_ids.append(list(range(first_gpu, first_gpu + n_gpus[idx])))
+        first_gpu += n_gpus[idx]
+    if affinity is not None:
+        free_gpus = set(range(world_size))
+        for idx in sorted(
+            range(len(batched_cameras)), key=lambda i: camera_cost[i], reverse=True
+        ):
+            chosen = sorted(free_gpus, key=lambda g: affinity[idx][g], reverse=True)[
+                : n_gpus[idx]
+            ]
+            free_gpus -= set(chosen)
+            batched_gpu_ids[idx] = sorted(chosen)
+
+    for idx, camera in enumerate(batched_cameras):
+        if (
+            batched_tile_heuristic is not None
+            and batched_tile_heuristic[idx] is not None
+        ):
+            heuristic = batched_tile_heuristic[idx]
+        else:
+            # not measured with tile blocks yet: spread each row's cost evenly over its tiles.
+            heuristic = (
+                batched_heuristic[idx].unsqueeze(1).expand(-1, utils.TILE_X)
+                / utils.TILE_X
+            )
+        tile_rects = kd_split_tiles(
+            heuristic, (0, utils.TILE_Y, 0, utils.TILE_X), n_gpus[idx]
+        )
+        gpu_for_this_camera = batched_gpu_ids[idx]
+        for gpu_id, tile_rect in zip(gpu_for_this_camera, tile_rects):
+            gpuid2tasks[gpu_id].append((idx,) + tuple(tile_rect))
+        batched_strategies.append(
+            DivisionStrategyFinal2D(camera, gpu_for_this_camera, tile_rects)
+        )
+    return batched_strategies, gpuid2tasks
+
+
 class DivisionStrategyHistoryFinal:
     def __init__(self, dataset, world_size, rank):
         self.world_size = world_size
         self.rank = rank
-        self.accum_heuristic = {}
-        for camera in dataset.cameras:
-            self.accum_heuristic[camera.uid] = torch.ones(
-                (utils.TILE_Y,), dtype=torch.float32, device="cuda", requires_grad=False
-            )
+        args = utils.get_args()
+        self.heuristic_dtype = {
+            "float32": torch.float32,
+            "float16": torch.float16,
+            "bfloat16": torch.bfloat16,
+        }[args.heuristic_dtype]
+        # one row of accum_heuristic per camera; use get_heuristics/set_heuristics to access it by uid.
+        self.uid_to_row = {
+            camera.uid: row for row, camera in enumerate(dataset.cameras)
+        }
+        self.accum_heuristic = torch.ones(
+            (len(dataset.cameras), utils.TILE_Y),
+            dtype=self.heuristic_dtype,
+            device="cuda",
+            requires_grad=False,
+        )
+
+        # cameras whose accum_heuristic comes from measured running time rather than an estimate.
+        self.measured_uids = set()
+        # uid -> (TILE_Y,) visibility-based workload estimate used for the camera in the current batch.
+        self.estimated_workload = {}
+        # running time per unit of estimated workload, fitted on the batches that have estimates.
+        self.estimated_workload_sum = 0.0
+        self.estimated_workload_time_sum = 0.0
+        # uid -> (TILE_Y,) number of 3dgs touching each tile row when the camera was last rendered.
+        self.tile_row_3dgs_count = {}
+        # uid -> (TILE_Y, TILE_X) cpu per-tile heuristic of the cameras measured with tile_blocks divisions.
+        self.tile_heuristics = {}
+        self.cost_model = TileRowCostModel()
 
         self.history = []
 
+    def get_rows(self, batched_uids):
+        return torch.tensor(
+            [self.uid_to_row[uid] for uid in batched_uids],
+            dtype=torch.long,
+            device="cuda",
+        )
+
+    def get_heuristics(self, batched_uids):
+        # return: (len(batched_uids), TILE_Y) float32 heuristics.
+        return self.accum_heuristic[self.get_rows(batched_uids)].float()
+
+    def set_heuristics(self, batched_uids, heuristics):
+        # heuristics: (len(batched_uids), TILE_Y); written with one scatter.
+        if self.heuristic_dtype == torch.float16:
+            # e.g. visibility estimates count 3dgs, which may exceed the float16 range.
+            heuristics = torch.clamp_max(heuristics, torch.finfo(torch.float16).max)
+        self.accum_heuristic.index_copy_(
+            0, self.get_rows(batched_uids), heuristics.to(self.heuristic_dtype)
+        )
+
+    def get_tile_heuristics(self, batched_uids):
+        # return: list of (TILE_Y, TILE_X) cpu per-tile heuristics, None for cameras without one.
+        return [self.tile_heuristics.get(uid, None) for uid in batched_uids]
+
+    def state_dict(self):
+        return {
+            "uids": list(self.uid_to_row.keys()),
+            "accum_heuristic": self.accum_heuristic.float().cpu(),
+            "measured_uids": list(self.measured_uids),
+            "estimated_workload_sum": self.estimated_workload_sum,
+            "estimated_workload_time_sum": self.estimated_workload_time_sum,
+            "tile_row_3dgs_count": {
+                uid: count.cpu() for uid, count in self.tile_row_3dgs_count.items()
+            },
+            "tile_heuristics": self.tile_heuristics.copy(),
+            "cost_model": vars(self.cost_model).copy(),
+        }
+
+    def load_state_dict(self, state_dict):
+        # cameras are matched by uid; cameras unknown to the checkpoint keep their current state.
+        saved_rows = [
+            (self.uid_to_row[uid], saved_row)
+            for saved_row, uid in enumerate(state_dict["uids"])
+            if uid in self.uid_to_row
+        ]
+        if len(saved_rows) > 0:
+            rows, saved_rows = zip(*saved_rows)
+            self.accum_heuristic[list(rows)] = (
+                state_dict["accum_heuristic"][list(saved_rows)]
+                .to(self.heuristic_dtype)
+                .cuda()
+            )
+        self.measured_uids = set(
+            uid for uid in state_dict["measured_uids"] if uid in self.uid_to_row
+        )
+        self.estimated_workload_sum = state_dict["estimated_workload_sum"]
+        self.estimated_workload_time_sum = state_dict["estimated_workload_time_sum"]
+        self.tile_row_3dgs_count = {
+            uid: count.cuda()
+            for uid, count in state_dict["tile_row_3dgs_count"].items()
+            if uid in self.uid_to_row
+        }
+        self.tile_heuristics = {
+            uid: tile_heuristic
+            for uid, tile_heuristic in state_dict["tile_heuristics"].items()
+            if uid in self.uid_to_row
+        }
+        for key, value in state_dict["cost_model"].items():
+            setattr(self.cost_model, key, value)
+
     def store_stats(self, batched_cameras, gpu_camera_running_time, batched_strategies):
         batched_camera_info = []
         all_camera_running_time = [0 for _ in range(len(batched_cameras))]
@@ -833,6 +1195,9 @@ class DivisionStrategyHistoryFinal:
                     "camera_id": camera.uid,
                     "gpu_ids": batched_strategies[camera_id].gpu_ids,
                     "division_pos": batched_strategies[camera_id].division_pos,
+                    "tile_rects": getattr(
+                        batched_strategies[camera_id], "tile_rects", None
+                    ),
                     "each_gpu_running_time": each_gpu_running_time,
                 }
             )
@@ -849,11 +1214,355 @@ class DivisionStrategyHistoryFinal:
         return self.history
 
 
-def start_strategy_final(batched_cameras, strategy_history):
+def estimate_heuristics_by_visibility(batched_cameras, strategy_history, gaussians):
+    # Seed accum_heuristic of the cameras without measured running time with the number of 3dgs
+    # that project onto each tile row, counted from the visibility cache of the local 3dgs.
+    args = utils.get_args()
+    unmeasured_cameras = [
+        camera
+        for camera in batched_cameras
+        if camera.uid not in strategy_history.measured_uids
+    ]
+    if len(unmeasured_cameras) == 0:
+        return
+
+    visibility_cache = gaussians.get_visibility_cache()
+    estimated_workload = torch.stack(
+        [
+            visibility_cache.get_tile_row_workload(camera).cuda()
+            for camera in unmeasured_cameras
+        ]
+    )
+    if args.gaussians_distribution and utils.DEFAULT_GROUP.size() > 1:
+        # every rank only sees its own shard of 3dgs.
+        torch.distributed.all_reduce(
+            estimated_workload,
+            op=torch.distributed.ReduceOp.SUM,
+            group=utils.DEFAULT_GROUP,
+        )
+    # every tile row costs at least about one 3dgs, e.g. for the loss.
+    estimated_workload = torch.clamp_min(estimated_workload, 1.0)
+
+    if strategy_history.estimated_workload_sum > 0:
+        time_per_workload = (
+            strategy_history.estimated_workload_time_sum
+            / strategy_history.estimated_workload_sum
+        )
+    else:
+        time_per_workload = 1.0
+    for camera, workload in zip(unmeasured_cameras, estimated_workload):
+        strategy_history.estimated_workload[camera.uid] = workload
+    if args.workload_cost_model:
+        estimated_heuristic = strategy_history.cost_model.predict(estimated_workload)
+    else:
+        estimated_heuristic = estimated_workload * time_per_workload
+    strategy_history.set_heuristics(
+        [camera.uid for camera in unmeasured_cameras], estimated_heuristic
+    )
+
+
+def predict_heuristics_by_cost_model(batched_cameras, strategy_history):
+    # Refresh accum_heuristic of the cameras rendered before, but without a measured heuristic yet
+    # (e.g. during warm-up), with the latest fit of the cost model.
+    batched_uids = [
+        camera.uid
+        for camera in batched_cameras
+        if camera.uid in strategy_history.tile_row_3dgs_count
+        and camera.uid not in strategy_history.measured_uids
+    ]
+    if len(batched_uids) == 0:
+        return
+    strategy_history.set_heuristics(
+        batched_uids,
+        strategy_history.cost_model.predict(
+            torch.stack(
+                [strategy_history.tile_row_3dgs_count[uid] for uid in batched_uids]
+            )
+        ),
+    )
+
+
+def update_cost_model(
+    batched_cameras,
+    strategy_history,
+    batched_strategies,
+    batched_statistic_collector,
+    gpu_camera_running_time,
+):
+    # Every gpu only counted the 3dgs of its own tile rows; sum them up into full images.
+    tile_row_3dgs_count = torch.zeros(
+        (len(batched_cameras), utils.TILE_Y), dtype=torch.float32, device="cuda"
+    )
+    for camera_id, stats_collector in enumerate(batched_statistic_collector):
+        if "tile_row_3dgs_count" in stats_collector:
+            tile_row_3dgs_count[camera_id] += stats_collector["tile_row_3dgs_count"]
+    if utils.DEFAULT_GROUP.size() > 1:
+        dist.all_reduce(
+            tile_row_3dgs_count, op=dist.ReduceOp.SUM, group=utils.DEFAULT_GROUP
+        )
+    prefix_sum = torch.nn.functional.pad(
+        torch.cumsum(tile_row_3dgs_count, dim=1), (1, 0)
+    ).tolist()
+
+    for camera_id, (camera, strategy) in enumerate(
+        zip(batched_cameras, batched_strategies)
+    ):
+        for local_id, gpu_id in enumerate(strategy.gpu_ids):
+            tile_ids_l, tile_ids_r = (
+                strategy.division_pos[local_id],
+                strategy.division_pos[local_id + 1],
+            )
+            strategy_history.cost_model.add_sample(
+                prefix_sum[camera_id][tile_ids_r] - prefix_sum[camera_id][tile_ids_l],
+                tile_ids_r - tile_ids_l,
+                gpu_camera_running_time[gpu_id][camera_id],
+            )
+        strategy_history.tile_row_3dgs_count[camera.uid] = tile_row_3dgs_count[
+            camera_id
+        ]
+    strategy_history.cost_model.fit()
+
+
+def adjust_division_pos_to_image_borders_reference(
+    division_pos, n_tiles_per_image, border_divpos_coeff
+):
+    # Loop implementation of adjust_division_pos_to_image_borders, kept as its reference.
+    division_pos = list(division_pos)
+    for i in range(1, len(division_pos) - 1):
+        if (
+            division_pos[i] % n_tiles_per_image + border_divpos_coeff
+            >= n_tiles_per_image
+        ):
+            division_pos[i] = (
+                division_pos[i] // n_tiles_per_image * n_tiles_per_image
+                + n_tiles_per_image
+            )
+        elif division_pos[i] % n_tiles_per_image - border_divpos_coeff <= 0:
+            division_pos[i] = division_pos[i] // n_tiles_per_image * n_tiles_per_image
+    return division_pos
+
+
+def adjust_division_pos_to_image_borders(
+    division_pos, n_tiles_per_image, border_divpos_coeff
+):
+    # division_pos: (world_size+1,) long tensor over the concatenated tile rows of a batch.
+    # Snap inner division positions that are close to an image border onto that border.
+    inner = division_pos[1:-1]
+    pos_in_image = inner % n_tiles_per_image
+    image_start = inner - pos_in_image
+    inner = torch.where(
+        pos_in_image + border_divpos_coeff >= n_tiles_per_image,
+        image_start + n_tiles_per_image,
+        torch.where(pos_in_image - border_divpos_coeff <= 0, image_start, inner),
+    )
+    return torch.cat([division_pos[:1], inner, division_pos[-1:]])
+
+
+def get_batched_strategies_reference(batched_cameras, division_pos):
+    # Loop implementation of get_batched_strategies, kept as its reference.
+    n_tiles_per_image = utils.TILE_Y
+    world_size = len(division_pos) - 1
+    batched_strategies = []
+    gpuid2tasks = [
+        [] for _ in range(world_size)
+    ]  # map from gpuid to a list of tasks (camera_id, tile_l, tile_r) it should do.
+    for idx, camera in enumerate(batched_cameras):
+        offset = idx * n_tiles_per_image
+
+        gpu_for_this_camera = []
+        gpu_for_this_camera_tilelr = []
+        for gpu_id in range(world_size):
+            gpu_tile_l, gpu_tile_r = division_pos[gpu_id], division_pos[gpu_id + 1]
+            if gpu_tile_r <= offset or offset + n_tiles_per_image <= gpu_tile_l:
+                continue
+            gpu_for_this_camera.append(gpu_id)
+            local_tile_l, local_tile_r = (
+                max(gpu_tile_l, offset) - offset,
+                min(gpu_tile_r, offset + n_tiles_per_image) - offset,
+            )
+            gpu_for_this_camera_tilelr.append((local_tile_l, local_tile_r))
+            gpuid2tasks[gpu_id].append((idx, local_tile_l, local_tile_r))
+
+        ws_for_this_camera = len(gpu_for_this_camera)
+        division_pos_for_this_viewpoint = [0] + [
+            tilelr[1] for tilelr in gpu_for_this_camera_tilelr
+        ]
+        strategy = DivisionStrategyFinal(
+            camera,
+            ws_for_this_camera,
+            gpu_for_this_camera,
+            division_pos_for_this_viewpoint,
+            gpu_for_this_camera_tilelr,
+        )
+        batched_strategies.append(strategy)
+    return batched_strategies, gpuid2tasks
+
+
+def get_batched_strategies(batched_cameras, division_pos):
+    # division_pos: (world_size+1,) long cpu tensor over the concatenated tile rows of the batch, already validated.
+    n_tiles_per_image = utils.TILE_Y
+    world_size = division_pos.shape[0] - 1
+    image_tile_l = torch.arange(len(batched_cameras)) * n_tiles_per_image
+    # the division is contiguous, so each camera is rendered by gpus [first_gpu, last_gpu].
+    first_gpu = (
+        torch.searchsorted(division_pos, image_tile_l, right=True) - 1
+    ).tolist()
+    last_gpu = (
+        torch.searchsorted(division_pos, image_tile_l + n_tiles_per_image) - 1
+    ).tolist()
+    division_pos = division_pos.tolist()
+
+    batched_strategies = []
+    gpuid2tasks = [
+        [] for _ in range(world_size)
+    ]  # map from gpuid to a list of tasks (camera_id, tile_l, tile_r) it should do.
+    for idx, camera in enumerate(batched_cameras):
+        offset = idx * n_tiles_per_image
+        gpu_for_this_camera = list(range(first_gpu[idx], last_gpu[idx] + 1))
+        division_pos_for_this_viewpoint = [0] + [
+            min(division_pos[gpu_id + 1] - offset, n_tiles_per_image)
+            for gpu_id in gpu_for_this_camera
+        ]
+        gpu_for_this_camera_tilelr = list(
+            zip(
+                division_pos_for_this_viewpoint[:-1],
+                division_pos_for_this_viewpoint[1:],
+            )
+        )
+        for gpu_id, (local_tile_l, local_tile_r) in zip(
+            gpu_for_this_camera, gpu_for_this_camera_tilelr
+        ):
+            gpuid2tasks[gpu_id].append((idx, local_tile_l, local_tile_r))
+
+        strategy = DivisionStrategyFinal(
+            camera,
+            len(gpu_for_this_camera),
+            gpu_for_this_camera,
+            division_pos_for_this_viewpoint,
+            gpu_for_this_camera_tilelr,
+            validate=False,
+        )
+        batched_strategies.append(strategy)
+    return batched_strategies, gpuid2tasks
+
+
+def get_new_heuristics_reference(batched_strategies, gpu_camera_running_time):
+    # Loop implementation of get_new_heuristics, kept as its reference.
+    batched_new_heuristic = []
+    for camera_id, strategy in enumerate(batched_strategies):
+        new_heuristic = torch.zeros((utils.TILE_Y,), dtype=torch.float32, device="cuda")
+        for local_id, gpu_id in enumerate(strategy.gpu_ids):
+            tile_ids_l, tile_ids_r = (
+                strategy.division_pos[local_id],
+                strategy.division_pos[local_id + 1],
+            )
+            new_heuristic[tile_ids_l:tile_ids_r] = gpu_camera_running_time[gpu_id][
+                camera_id
+            ] / (tile_ids_r - tile_ids_l)
+        batched_new_heuristic.append(new_heuristic)
+    return torch.stack(batched_new_heuristic)
+
+
+def get_new_tile_heuristics_2d(batched_strategies, gpu_camera_running_time):
+    # return: (batch_size, TILE_Y, TILE_X) cpu heuristics; each gpu's running time on a camera is spread evenly
+    # over the tiles of its block. Summed over columns, they are the per tile row heuristics.
+    new_heuristic = torch.zeros(
+        (len(batched_strategies), utils.TILE_Y + 1, utils.TILE_X + 1),
+        dtype=torch.float32,
+    )
+    for camera_id, strategy in enumerate(batched_strategies):
+        for gpu_id, (tile_y_l, tile_y_r, tile_x_l, tile_x_r) in zip(
+            strategy.gpu_ids, strategy.tile_rects
+        ):
+            time_per_tile = gpu_camera_running_time[gpu_id][camera_id] / (
+                (tile_y_r - tile_y_l) * (tile_x_r - tile_x_l)
+            )
+            new_heuristic[camera_id, tile_y_l, tile_x_l] += time_per_tile
+            new_heuristic[camera_id, tile_y_l, tile_x_r] -= time_per_tile
+            new_heuristic[camera_id, tile_y_r, tile_x_l] -= time_per_tile
+            new_heuristic[camera_id, tile_y_r, tile_x_r] += time_per_tile
+    new_heuristic = torch.cumsum(torch.cumsum(new_heuristic, dim=1), dim=2)
+    return new_heuristic[:, : utils.TILE_Y, : utils.TILE_X]
+
+
+def get_new_heuristics(batched_strategies, gpu_camera_running_time):
+    # return: (batch_size, TILE_Y) heuristics; each gpu's running time on a camera is spread evenly over its tile rows.
+    segment_time = []
+    segment_n_tiles = []
+    for camera_id, strategy in enumerate(batched_strategies):
+        for local_id, gpu_id in enumerate(strategy.gpu_ids):
+            n_tiles = (
+                strategy.division_pos[local_id + 1] - strategy.division_pos[local_id]
+            )
+            segment_time.append(gpu_camera_running_time[gpu_id][camera_id] / n_tiles)
+            segment_n_tiles.append(n_tiles)
+    segment_time = torch.tensor(segment_time, dtype=torch.float32, device="cuda")
+    segment_n_tiles = torch.tensor(segment_n_tiles, dtype=torch.long, device="cuda")
+    return torch.repeat_interleave(
+        segment_time,
+        segment_n_tiles,
+        output_size=len(batched_strategies) * utils.TILE_Y,
+    ).view(-1, utils.TILE_Y)
+
+
+def get_camera_gpu_affinity(batched_cameras, gaussians):
+    # return: (batch_size, world_size) list; fraction of the 3dgs visible from each camera that each gpu stores.
+    visibility_cache = gaussians.get_visibility_cache()
+    local_visible_cnt = visibility_cache.batched_count_visible(batched_cameras)
+    all_visible_cnt = torch.zeros(
+        (utils.DEFAULT_GROUP.size(), len(batched_cameras)),
+        dtype=torch.float32,
+        device="cuda",
+    )
+    torch.distributed.all_gather_into_tensor(
+        all_visible_cnt, local_visible_cnt, group=utils.DEFAULT_GROUP
+    )
+    affinity = all_visible_cnt.t()
+    affinity = affinity / torch.clamp_min(affinity.sum(dim=1, keepdim=True), 1.0)
+    return affinity.tolist()
+
+
+def reorder_cameras_by_locality(batched_cameras, batched_cost, affinity):
+    # Order the cameras so that the prefix-sum division gives each gpu the cameras whose visible 3dgs it mostly stores.
+    # gpus are filled in rank order, each one with its cost share, always taking the remaining camera of highest affinity.
+    world_size = len(affinity[0])
+    cost_per_gpu = sum(batched_cost) / world_size
+    remaining = list(range(len(batched_cameras)))
+    order = []
+    filled_cost = 0.0
+    for gpu_id in range(world_size):
+        while len(remaining) > 0 and filled_cost < cost_per_gpu * (gpu_id + 0.999):
+            camera_id = max(remaining, key=lambda i: affinity[i][gpu_id])
+            remaining.remove(camera_id)
+            order.append(camera_id)
+            filled_cost += batched_cost[camera_id]
+    order += remaining
+    return order
+
+
+def start_strategy_final(batched_cameras, strategy_history, gaussians=None):
+    # With args.locality_aware_assignment, batched_cameras is reordered in place,
+    # so that the returned strategies and gpuid2tasks follow the order callers see.
     args = utils.get_args()
 
+    if (
+        gaussians is not None
+        and args.visibility_workload_estimate
+        and not args.local_sampling
+    ):
+        estimate_heuristics_by_visibility(batched_cameras, strategy_history, gaussians)
+    if args.workload_cost_model and not args.local_sampling:
+        predict_heuristics_by_cost_model(batched_cameras, strategy_history)
+
     n_tiles_per_image = utils.TILE_Y
     total_tiles = n_tiles_per_image * len(batched_cameras)
+    # the affinity needs the visibility cache and only matters if 3dgs are distributed.
+    use_locality = (
+        args.locality_aware_assignment
+        and gaussians is not None
+        and args.gaussians_distribution
+        and utils.DEFAULT_GROUP.size() > 1
+    )
 
     if args.local_sampling:
         batched_strategies = []
@@ -875,75 +1584,85 @@ def start_strategy_final(batched_cameras, strategy_history):
                 gpu_for_this_camera_tilelr,
             )
             batched_strategies.append(strategy)
+    elif args.division_mode == "tile_blocks" and utils.DEFAULT_GROUP.size() > len(
+        batched_cameras
+    ):
+        batched_strategies, gpuid2tasks = get_batched_strategies_2d(
+            batched_cameras,
+            strategy_history.get_heuristics([camera.uid for camera in batched_cameras]),
+            utils.DEFAULT_GROUP.size(),
+            affinity=(
+                get_camera_gpu_affinity(batched_cameras, gaussians)
+                if use_locality
+                else None
+            ),
+            batched_tile_heuristic=strategy_history.get_tile_heuristics(
+                [camera.uid for camera in batched_cameras]
+            ),
+        )
     else:
-        batched_accum_heuristic = [
-            strategy_history.accum_heuristic[camera.uid] for camera in batched_cameras
-        ]  # batch_size * tile_y
-        catted_accum_heuristic = torch.cat(
-            batched_accum_heuristic, dim=0
-        )  # batch_size * tile_y
-
-        division_pos = division_pos_heuristic(
-            catted_accum_heuristic, total_tiles, utils.DEFAULT_GROUP.size(), right=True
+        if use_locality:
+            order = reorder_cameras_by_locality(
+                batched_cameras,
+                strategy_history.get_heuristics(
+                    [camera.uid for camera in batched_cameras]
+                )
+                .sum(dim=1)
+                .tolist(),
+                get_camera_gpu_affinity(batched_cameras, gaussians),
+            )
+            batched_cameras[:] = [batched_cameras[i] for i in order]
+        # batch_size * tile_y
+        catted_accum_heuristic = strategy_history.get_heuristics(
+            [camera.uid for camera in batched_cameras]
+        ).view(-1)
+
+        division_pos = torch.tensor(
+            division_pos_heuristic(
+                catted_accum_heuristic,
+                total_tiles,
+                utils.DEFAULT_GROUP.size(),
+                right=True,
+            )
         )
         # slightly adjust the division_pos to avoid redundant kernel launch overheads.
-        for i in range(1, len(division_pos) - 1):
-            if (
-                division_pos[i] % n_tiles_per_image + args.border_divpos_coeff
-                >= n_tiles_per_image
-            ):
-                division_pos[i] = (
-                    division_pos[i] // n_tiles_per_image * n_tiles_per_image
-                    + n_tiles_per_image
-                )
-            elif division_pos[i] % n_tiles_per_image - args.border_divpos_coeff <= 0:
-                division_pos[i] = (
-                    division_pos[i] // n_tiles_per_image * n_tiles_per_image
-                )
-        for i in range(0, len(division_pos) - 1):
-            assert (
-                division_pos[i] + args.border_divpos_coeff < division_pos[i + 1]
-            ), "Each part between division_pos must be large enough."
+        adjusted_division_pos = adjust_division_pos_to_image_borders(
+            division_pos, n_tiles_per_image, args.border_divpos_coeff
+        )
+        assert bool(
+            (
+                adjusted_division_pos[:-1] + args.border_divpos_coeff
+                < adjusted_division_pos[1:]
+            ).all()
+        ), "Each part between division_pos must be large enough."
+
+        batched_strategies, gpuid2tasks = get_batched_strategies(
+            batched_cameras, adjusted_division_pos
+        )
 
-        batched_strategies = []
-        gpuid2tasks = [
-            [] for _ in range(utils.DEFAULT_GROUP.size())
-        ]  # map from gpuid to a list of tasks (camera_id, tile_l, tile_r) it should do.
-        for idx, camera in enumerate(batched_cameras):
-            offset = idx * n_tiles_per_image
-
-            gpu_for_this_camera = []
-            gpu_for_this_camera_tilelr = []
-            for gpu_id in range(utils.DEFAULT_GROUP.size()):
-                gpu_tile_l, gpu_tile_r = division_pos[gpu_id], division_pos[gpu_id + 1]
-                if gpu_tile_r <= offset or offset + n_tiles_per_image <= gpu_tile_l:
-                    continue
-                gpu_for_this_camera.append(gpu_id)
-                local_tile_l, local_tile_r = (
-                    max(gpu_tile_l, offset) - offset,
-                    min(gpu_tile_r, offset + n_tiles_per_image) - offset,
+        if args.check_strategy_final:
+            reference_division_pos = adjust_division_pos_to_image_borders_reference(
+                division_pos.tolist(), n_tiles_per_image, args.border_divpos_coeff
+            )
+            assert reference_division_pos == adjusted_division_pos.tolist()
+            reference_strategies, reference_gpuid2tasks = (
+                get_batched_strategies_reference(
+                    batched_cameras, reference_division_pos
                 )
-                gpu_for_this_camera_tilelr.append((local_tile_l, local_tile_r))
-                gpuid2tasks[gpu_id].append((idx, local_tile_l, local_tile_r))
-
-            ws_for_this_camera = len(gpu_for_this_camera)
-            division_pos_for_this_viewpoint = [0] + [
-                tilelr[1] for tilelr in gpu_for_this_camera_tilelr
-            ]
-            strategy = DivisionStrategyFinal(
-                camera,
-                ws_for_this_camera,
-                gpu_for_this_camera,
-                division_pos_for_this_viewpoint,
-                gpu_for_this_camera_tilelr,
             )
-            batched_strategies.append(strategy)
+            assert reference_gpuid2tasks == gpuid2tasks
+            for strategy, reference_strategy in zip(
+                batched_strategies, reference_strategies
+            ):
+                assert strategy.gpu_ids == reference_strategy.gpu_ids
+                assert strategy.division_pos == reference_strategy.division_pos
     return batched_strategies, gpuid2tasks
 
 
 def finish_strategy_final(
     batched_cameras, strategy_history, batched_strategies, batched_statistic_collector
 ):
+    collect_forward_loss_time(batched_statistic_collector)
     batched_running_time = []
     for idx, strategy in enumerate(batched_strategies):
         if utils.GLOBAL_RANK not in strategy.gpu_ids:
@@ -963,36 +1682,93 @@ def finish_strategy_final(
         batched_cameras, gpu_camera_running_time, batched_strategies
     )
 
+    # fit running time per unit of estimated workload, also during warm-up.
+    estimated_workload = [
+        strategy_history.estimated_workload.pop(camera.uid, None)
+        for camera in batched_cameras
+    ]
+    if any(workload is not None for workload in estimated_workload):
+        for camera_id, (workload, strategy) in enumerate(
+            zip(estimated_workload, batched_strategies)
+        ):
+            if workload is None:
+                continue
+            strategy_history.estimated_workload_sum += workload.sum().item()
+            strategy_history.estimated_workload_time_sum += sum(
+                gpu_camera_running_time[gpu_id][camera_id]
+                for gpu_id in strategy.gpu_ids
+            )
+
     args = utils.get_args()
 
+    if (
+        args.workload_cost_model
+        and utils.DEFAULT_GROUP.size() > 1
+        and not args.no_heuristics_update
+        and batched_strategies[0].division_pos is not None
+    ):
+        # the cost model needs no warm-up: start_strategy_final predicts the heuristics of the cameras
+        # that have no measured heuristic below yet. It is only fitted on tile-row divisions.
+        update_cost_model(
+            batched_cameras,
+            strategy_history,
+            batched_strategies,
+            batched_statistic_collector,
+            gpu_camera_running_time,
+        )
+
     if (
         (utils.get_cur_iter() <= args.adjust_strategy_warmp_iterations)
         or (utils.DEFAULT_GROUP.size() == 1)
         or (args.no_heuristics_update)
         or (
-            args.bsz >= utils.DEFAULT_GROUP.size()
+            # with micro-batches, the strategies only cover the cameras of this micro-batch.
+            (len(batched_cameras) if args.micro_bsz > 0 else args.bsz)
+            >= utils.DEFAULT_GROUP.size()
             and (utils.get_img_height() <= 1080 or utils.get_img_width() <= 1920)
         )
         or (utils.get_img_height() <= 600 or utils.get_img_width() <= 1000)
     ):
         return
 
-    for camera_id, (camera, strategy) in enumerate(
-        zip(batched_cameras, batched_strategies)
-    ):
-        new_heuristic = torch.zeros((utils.TILE_Y,), dtype=torch.float32, device="cuda")
-        for local_id, gpu_id in enumerate(strategy.gpu_ids):
-            tile_ids_l, tile_ids_r = (
-                strategy.division_pos[local_id],
-                strategy.division_pos[local_id + 1],
-            )
-            new_heuristic[tile_ids_l:tile_ids_r] = gpu_camera_running_time[gpu_id][
-                camera_id
-            ] / (tile_ids_r - tile_ids_l)
-        if args.heuristic_decay == 0:
-            strategy_history.accum_heuristic[camera.uid] = new_heuristic
-        else:
-            strategy_history.accum_heuristic[camera.uid] = (
-                strategy_history.accum_heuristic[camera.uid] * args.heuristic_decay
-                + new_heuristic * (1 - args.heuristic_decay)
-            )
+    if isinstance(batched_strategies[0], DivisionStrategyFinal2D):
+        batched_new_tile_heuristic = get_new_tile_heuristics_2d(
+            batched_strategies, gpu_camera_running_time
+        )
+        batched_new_heuristic = batched_new_tile_heuristic.sum(dim=2).cuda()
+    else:
+        batched_new_heuristic = get_new_heuristics(
+            batched_strategies, gpu_camera_running_time
+        )
+    if args.check_strategy_final and batched_strategies[0].division_pos is not None:
+        assert torch.allclose(
+            batched_new_heuristic,
+            get_new_heuristics_reference(batched_strategies, gpu_camera_running_time),
+        )
+
+    batched_uids = [camera.uid for camera in batched_cameras]
+    strategy_history.measured_uids.update(batched_uids)
+    if isinstance(batched_strategies[0], DivisionStrategyFinal2D):
+        # keep the per-tile heuristics, so that the next kd-split also cuts columns by cost.
+        for uid, new_tile_heuristic, accum_heuristic in zip(
+            batched_uids,
+            batched_new_tile_heuristic,
+            strategy_history.get_heuristics(batched_uids).cpu(),
+        ):
+            if args.heuristic_decay != 0:
+                accum_tile_heuristic = strategy_history.tile_heuristics.get(uid, None)
+                if accum_tile_heuristic is None:
+                    accum_tile_heuristic = (
+                        accum_heuristic.unsqueeze(1).expand(-1, utils.TILE_X)
+                        / utils.TILE_X
+                    )
+                new_tile_heuristic = accum_tile_heuristic * args.heuristic_decay + (
+                    new_tile_heuristic * (1 - args.heuristic_decay)
+                )
+            strategy_history.tile_heuristics[uid] = new_tile_heuristic.clone()
+    if args.heuristic_decay != 0:
+        batched_accum_heuristic = strategy_history.get_heuristics(batched_uids)
+        batched_new_heuristic = batched_accum_heuristic * args.heuristic_decay + (
+            batched_new_heuristic * (1 - args.heuristic_decay)
+        )
+    strategy_history.set_heuristics(batched_uids, batched_new_heuristic)
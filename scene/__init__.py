@@ -223,6 +223,9 @@ class SceneDataset:
         self.epoch_time = []
         self.epoch_n_sample = []
 
+        # (camera_size, 6) features for spatially clustered sampling.
+        self.camera_features = None
+
     @property
     def cur_epoch(self):
         return len(self.epoch_loss)
@@ -240,8 +243,16 @@ class SceneDataset:
             else:
                 self.cur_epoch_cameras = list(range(self.camera_size))
             # random.shuffle(self.cur_epoch_cameras)
-            indices = torch.randperm(len(self.cur_epoch_cameras))
-            self.cur_epoch_cameras = [self.cur_epoch_cameras[i] for i in indices]
+            if args.batch_sampling == "spatial":
+                self.cur_epoch_cameras = self.get_spatially_clustered_order(
+                    self.cur_epoch_cameras, args.bsz
+                )
+            else:
+                assert (
+                    args.batch_sampling == "random"
+                ), "batch_sampling should be 'random' or 'spatial'."
+                indices = torch.randperm(len(self.cur_epoch_cameras))
+                self.cur_epoch_cameras = [self.cur_epoch_cameras[i] for i in indices]
 
         self.cur_iteration += 1
 
@@ -252,6 +263,43 @@ class SceneDataset:
         viewpoint_cam = self.cameras[camera_idx]
         return camera_idx, viewpoint_cam
 
+    def get_camera_features(self):
+        # camera center normalized by the spread of all centers, and the weighted viewing direction.
+        if self.camera_features is None:
+            centers = torch.stack(
+                [camera.camera_center.detach().cpu().float() for camera in self.cameras]
+            )
+            centers = centers - centers.mean(dim=0)
+            centers = centers / torch.clamp_min(centers.norm(dim=1).max(), 1e-6)
+            # camera.R is the camera-to-world rotation; its third column is the viewing direction.
+            directions = torch.stack(
+                [torch.tensor(camera.R[:, 2]).float() for camera in self.cameras]
+            )
+            self.camera_features = torch.cat(
+                [centers, directions * self.args.batch_sampling_direction_weight], dim=1
+            )
+        return self.camera_features
+
+    def get_spatially_clustered_order(self, camera_idx, batch_size):
+        # Order camera_idx so that every batch_size consecutive cameras are close to each other.
+        # Each cluster starts from a random remaining camera and takes its nearest remaining cameras,
+        # so every camera is still visited exactly once per epoch, and the epoch order stays random.
+        features = self.get_camera_features()
+        remaining = torch.tensor(camera_idx, dtype=torch.long)[
+            torch.randperm(len(camera_idx))
+        ]
+        order = []
+        while remaining.shape[0] > 0:
+            distance = (features[remaining] - features[remaining[0]]).norm(dim=1)
+            nearest = torch.topk(
+                distance, min(batch_size, remaining.shape[0]), largest=False
+            ).indices
+            order += remaining[nearest].tolist()
+            keep = torch.ones(remaining.shape[0], dtype=torch.bool)
+            keep[nearest] = False
+            remaining = remaining[keep]
+        return order
+
     def get_batched_cameras(self, batch_size):
         assert (
             batch_size <= self.camera_size
@@ -18,8 +18,11 @@ from utils.system_utils import mkdir_p
 from plyfile import PlyData, PlyElement
 from utils.sh_utils import RGB2SH
 from simple_knn._C import distCUDA2
-from utils.graphics_utils import BasicPointCloud
+from utils.graphics_utils import BasicPointCloud, morton_code_3d
 from utils.general_utils import strip_symmetric, build_scaling_rotation
+from scene.spatial_index import GaussianSpatialIndex
+from scene.visibility_cache import CameraVisibilityCache
+from scene.gaussian_optimizer import GaussianAdam, like_optimizer_state
 import utils.general_utils as utils
 import torch.distributed as dist
 
@@ -65,9 +68,12 @@ class GaussianModel:
         self.optimizer = None
         self.percent_dense = 0
         self.spatial_lr_scale = 0
+        self.spatial_index = None
+        self.visibility_cache = CameraVisibilityCache()
         self.setup_functions()
 
     def capture(self):
+        self.catch_up_optimizer()
         return (
             self.active_sh_degree,
             self._xyz,
@@ -289,7 +295,26 @@ class GaussianModel:
             },
         ]
 
-        self.optimizer = torch.optim.Adam(l, lr=0.0, eps=1e-15)
+        if training_args.offload_optimizer_state != "none":
+            assert training_args.offload_optimizer_state in [
+                "f_rest",
+                "all",
+            ], "offload_optimizer_state should be none, f_rest or all."
+            self.optimizer = GaussianAdam(
+                l,
+                lr=0.0,
+                eps=1e-15,
+                offload_groups=(
+                    [group["name"] for group in l]
+                    if training_args.offload_optimizer_state == "all"
+                    else ["f_rest"]
+                ),
+                offload_chunk_size=training_args.offload_chunk_size,
+            )
+        elif training_args.fused_adam or training_args.sparse_adam:
+            self.optimizer = GaussianAdam(l, lr=0.0, eps=1e-15)
+        else:
+            self.optimizer = torch.optim.Adam(l, lr=0.0, eps=1e-15)
         # self.optimizer = torch.optim.SGD(l, lr=0.0, momentum=0.1)
 
         bsz = utils.get_args().bsz
@@ -366,12 +391,22 @@ class GaussianModel:
 
         if "visible_count" in args.grad_normalization_mode:
             # allgather visibility filder from all dp workers, so that each worker contains the visibility filter of all data points.
-            batched_locally_preprocessed_visibility_filter_int = [
-                x.int()
-                for x in batched_screenspace_pkg[
+            batched_locally_preprocessed_visibility_filter_int = []
+            for x, local_ids in zip(
+                batched_screenspace_pkg[
                     "batched_locally_preprocessed_visibility_filter"
-                ]
-            ]
+                ],
+                batched_screenspace_pkg["batched_locally_preprocessed_ids"],
+            ):
+                if local_ids is not None:
+                    # frustum culling: scatter the filter of the preprocessed subset back to all local 3dgs.
+                    full = torch.zeros(
+                        (self.get_xyz.shape[0],), dtype=torch.int, device=x.device
+                    )
+                    full[local_ids] = x.int()
+                    batched_locally_preprocessed_visibility_filter_int.append(full)
+                else:
+                    batched_locally_preprocessed_visibility_filter_int.append(x.int())
             sum_batched_locally_preprocessed_visibility_filter_int = torch.sum(
                 torch.stack(batched_locally_preprocessed_visibility_filter_int), dim=0
             )
@@ -393,6 +428,36 @@ class GaussianModel:
         if not args.gaussians_distribution and utils.DEFAULT_GROUP.size() > 1:
             sync_func(self, utils.DEFAULT_GROUP)
 
+    def catch_up_optimizer(self):
+        # apply the decay lazy Adam still owes to skipped rows, before the rows change or get saved.
+        if isinstance(self.optimizer, GaussianAdam):
+            self.optimizer.catch_up()
+
+    def get_batch_visible_ids(self, batched_screenspace_pkg):
+        # return: ids of the local 3dgs visible from any camera of the batch (on any rank if replicated).
+        visible_mask = torch.zeros(
+            (self._xyz.shape[0],), dtype=torch.uint8, device="cuda"
+        )
+        batched_visibility_filter = batched_screenspace_pkg[
+            "batched_locally_preprocessed_visibility_filter"
+        ]
+        batched_local_ids = batched_screenspace_pkg.get(
+            "batched_locally_preprocessed_ids", [None] * len(batched_visibility_filter)
+        )
+        for visibility_filter, local_ids in zip(
+            batched_visibility_filter, batched_local_ids
+        ):
+            if local_ids is None:
+                visible_mask[visibility_filter] = 1
+            else:
+                visible_mask[local_ids[visibility_filter]] = 1
+        args = utils.get_args()
+        if not args.gaussians_distribution and utils.DEFAULT_GROUP.size() > 1:
+            dist.all_reduce(
+                visible_mask, op=dist.ReduceOp.MAX, group=utils.DEFAULT_GROUP
+            )
+        return visible_mask.nonzero().squeeze(1)
+
     def update_learning_rate(self, iteration):
         """Learning rate scheduling per step"""
         for param_group in self.optimizer.param_groups:
@@ -769,6 +834,7 @@ class GaussianModel:
             self.distributed_load_ply(path)
 
     def replace_tensor_to_optimizer(self, tensor, name):
+        self.catch_up_optimizer()
         optimizable_tensors = {}
         for group in self.optimizer.param_groups:
             if group["name"] == name:
@@ -776,8 +842,13 @@ class GaussianModel:
                 if "exp_avg" not in stored_state:
                     stored_state["momentum_buffer"] = torch.zeros_like(tensor)
                 else:
-                    stored_state["exp_avg"] = torch.zeros_like(tensor)
-                    stored_state["exp_avg_sq"] = torch.zeros_like(tensor)
+                    # offloaded moments stay in host memory.
+                    stored_state["exp_avg"] = like_optimizer_state(
+                        torch.zeros_like(tensor), stored_state["exp_avg"]
+                    )
+                    stored_state["exp_avg_sq"] = like_optimizer_state(
+                        torch.zeros_like(tensor), stored_state["exp_avg_sq"]
+                    )
 
                 del self.optimizer.state[group["params"][0]]
                 group["params"][0] = nn.Parameter(tensor.requires_grad_(True))
@@ -787,6 +858,7 @@ class GaussianModel:
         return optimizable_tensors
 
     def _prune_optimizer(self, mask):
+        self.catch_up_optimizer()
         optimizable_tensors = {}
         for group in self.optimizer.param_groups:
             stored_state = self.optimizer.state.get(group["params"][0], None)
@@ -796,8 +868,11 @@ class GaussianModel:
                         mask
                     ]
                 else:
-                    stored_state["exp_avg"] = stored_state["exp_avg"][mask]
-                    stored_state["exp_avg_sq"] = stored_state["exp_avg_sq"][mask]
+                    for key in ["exp_avg", "exp_avg_sq"]:
+                        stored_state[key] = like_optimizer_state(
+                            stored_state[key][mask.to(stored_state[key].device)],
+                            stored_state[key],
+                        )
 
                 del self.optimizer.state[group["params"][0]]
                 group["params"][0] = nn.Parameter(
@@ -833,8 +908,66 @@ class GaussianModel:
         self.sum_visible_count_in_one_batch = self.sum_visible_count_in_one_batch[
             valid_points_mask
         ]
+        self.spatial_index = None
+
+    def reorder_points(self, order):
+        # order: (N,) permutation of [0, N). Indexing with it permutes rows just like pruning masks them.
+        optimizable_tensors = self._prune_optimizer(order)
+
+        self._xyz = optimizable_tensors["xyz"]
+        self._features_dc = optimizable_tensors["f_dc"]
+        self._features_rest = optimizable_tensors["f_rest"]
+        self._opacity = optimizable_tensors["opacity"]
+        self._scaling = optimizable_tensors["scaling"]
+        self._rotation = optimizable_tensors["rotation"]
+
+        self.xyz_gradient_accum = self.xyz_gradient_accum[order]
+        self.send_to_gpui_cnt = self.send_to_gpui_cnt[order]
+        self.denom = self.denom[order]
+        self.max_radii2D = self.max_radii2D[order]
+        self.sum_visible_count_in_one_batch = self.sum_visible_count_in_one_batch[order]
+        self.spatial_index = None
+
+    def spatially_sort_gaussians(self):
+        # Reorder all per-3dgs tensors along a morton curve of xyz, so that gaussians close in space are close in memory.
+        codes = morton_code_3d(self._xyz.detach())
+        # stable sort: replicated storage must end up with the same order on every rank.
+        order = torch.argsort(codes, stable=True)
+        self.reorder_points(order)
+
+    def get_spatial_index(self):
+        # Rebuild the chunk grid when the local 3dgs changed (densify, prune, redistribute, reorder)
+        # or when they may have drifted out of their chunk boxes since the last densification interval.
+        args = utils.get_args()
+        iteration = utils.get_cur_iter()
+        if (
+            self.spatial_index is None
+            or self.spatial_index.n_points != self._xyz.shape[0]
+            or iteration - self.spatial_index.build_iteration
+            >= args.densification_interval
+        ):
+            with torch.no_grad():
+                extents = 3 * self.get_scaling.max(dim=1).values
+                self.spatial_index = GaussianSpatialIndex(
+                    self._xyz, extents, grid_size=args.frustum_culling_grid_size
+                )
+            self.spatial_index.build_iteration = iteration
+        return self.spatial_index
+
+    def get_visibility_cache(self):
+        # cached per-camera visible chunks; they are recomputed lazily once the spatial index is rebuilt.
+        self.visibility_cache.bind(self.get_spatial_index())
+        return self.visibility_cache
+
+    def prune_by_visible_cameras(self, cameras, min_visible_cameras):
+        # prune the 3dgs whose chunk is inside the frustum of fewer than min_visible_cameras cameras.
+        visible_cameras_cnt = self.get_visibility_cache().count_visible_cameras(cameras)
+        prune_mask = visible_cameras_cnt < min_visible_cameras
+        self.prune_points(prune_mask)
+        return int(prune_mask.sum().item())
 
     def cat_tensors_to_optimizer(self, tensors_dict):
+        self.catch_up_optimizer()
         optimizable_tensors = {}
         for group in self.optimizer.param_groups:
             assert len(group["params"]) == 1
@@ -850,17 +983,19 @@ class GaussianModel:
                         dim=0,
                     )
                 else:
-                    stored_state["exp_avg"] = torch.cat(
-                        (stored_state["exp_avg"], torch.zeros_like(extension_tensor)),
-                        dim=0,
-                    )
-                    stored_state["exp_avg_sq"] = torch.cat(
-                        (
-                            stored_state["exp_avg_sq"],
-                            torch.zeros_like(extension_tensor),
-                        ),
-                        dim=0,
-                    )
+                    for key in ["exp_avg", "exp_avg_sq"]:
+                        stored_state[key] = like_optimizer_state(
+                            torch.cat(
+                                (
+                                    stored_state[key],
+                                    torch.zeros_like(extension_tensor).to(
+                                        stored_state[key].device
+                                    ),
+                                ),
+                                dim=0,
+                            ),
+                            stored_state[key],
+                        )
 
                 del self.optimizer.state[group["params"][0]]
                 group["params"][0] = nn.Parameter(
@@ -918,6 +1053,7 @@ class GaussianModel:
         self.send_to_gpui_cnt = torch.cat(
             (self.send_to_gpui_cnt, new_send_to_gpui_cnt), dim=0
         )
+        self.spatial_index = None
 
     def densify_and_split(self, grads, grad_threshold, scene_extent, N=2):
         n_init_points = self.get_xyz.shape[0]
@@ -1044,12 +1180,15 @@ class GaussianModel:
         torch.cuda.empty_cache()
 
     def add_densification_stats(
-        self, viewspace_point_tensor, update_filter
+        self, viewspace_point_tensor, update_filter, update_ids=None
     ):  # the :2] is a weird implementation. It is because viewspace_point_tensor is (N, 3) tensor.
-        self.xyz_gradient_accum[update_filter] += torch.norm(
+        # update_ids: the local 3dgs that update_filter selects, if viewspace_point_tensor only covers a subset of them.
+        if update_ids is None:
+            update_ids = update_filter
+        self.xyz_gradient_accum[update_ids] += torch.norm(
             viewspace_point_tensor.grad[update_filter, :2], dim=-1, keepdim=True
         )
-        self.denom[update_filter] += 1
+        self.denom[update_ids] += 1
 
     def gsplat_add_densification_stats(
         self, viewspace_point_tensor_grad, update_filter, width, height
@@ -1109,12 +1248,14 @@ class GaussianModel:
                         stored_state["momentum_buffer"], destination, i2j_send_size
                     )
                 else:
-                    stored_state["exp_avg"] = self.all2all_gaussian_state(
-                        stored_state["exp_avg"], destination, i2j_send_size
-                    )
-                    stored_state["exp_avg_sq"] = self.all2all_gaussian_state(
-                        stored_state["exp_avg_sq"], destination, i2j_send_size
-                    )
+                    # offloaded moments go through the gpu one tensor at a time.
+                    for key in ["exp_avg", "exp_avg_sq"]:
+                        stored_state[key] = like_optimizer_state(
+                            self.all2all_gaussian_state(
+                                stored_state[key].cuda(), destination, i2j_send_size
+                            ),
+                            stored_state[key],
+                        )
 
                 del self.optimizer.state[group["params"][0]]
                 group["params"][0] = nn.Parameter(
@@ -1147,10 +1288,11 @@ class GaussianModel:
                     all_tensors.append(stored_state["momentum_buffer"])
                     all_shapes.append(stored_state["momentum_buffer"].shape)
                 else:
-                    all_tensors.append(stored_state["exp_avg"])
+                    # offloaded moments are copied to the gpu for the fused all2all.
+                    all_tensors.append(stored_state["exp_avg"].cuda())
                     all_shapes.append(stored_state["exp_avg"].shape)
 
-                    all_tensors.append(stored_state["exp_avg_sq"])
+                    all_tensors.append(stored_state["exp_avg_sq"].cuda())
                     all_shapes.append(stored_state["exp_avg_sq"].shape)
 
                 all_tensors.append(group["params"][0])
@@ -1180,8 +1322,10 @@ class GaussianModel:
                         0
                     ).contiguous()
                 else:
-                    stored_state["exp_avg"] = updated_tensors.pop(0).contiguous()
-                    stored_state["exp_avg_sq"] = updated_tensors.pop(0).contiguous()
+                    for key in ["exp_avg", "exp_avg_sq"]:
+                        stored_state[key] = like_optimizer_state(
+                            updated_tensors.pop(0).contiguous(), stored_state[key]
+                        )
 
                 del self.optimizer.state[group["params"][0]]
                 group["params"][0] = nn.Parameter(
@@ -1232,17 +1376,105 @@ class GaussianModel:
 
         return optimizable_tensors
 
+    def all2all_tensors_in_optimizer_implementation_3(self, destination, i2j_send_size):
+        # One gather and one all_to_all_single for all parameters and optimizer states.
+        comm_group = self.group_for_redistribution()
+        rank = comm_group.rank()
+
+        all_tensors, all_shapes = self.get_all_optimizer_states()
+        all_dim1 = [shape[1:].numel() for shape in all_shapes]
+
+        # Sort once by destination; stable sort keeps the same order as the masked version in implementation_1.
+        order = torch.argsort(destination, stable=True)
+        send_buffer = torch.empty(
+            (destination.shape[0], sum(all_dim1)), dtype=torch.float32, device="cuda"
+        )
+        offset = 0
+        for tensor, dim1 in zip(all_tensors, all_dim1):
+            send_buffer[:, offset : offset + dim1] = tensor.detach().flatten(
+                start_dim=1
+            )[order]
+            offset += dim1
+        order = None
+        all_tensors = None  # release memory
+
+        # split sizes come from the all-gathered matrix, so that every rank agrees.
+        assert (
+            sum(int(size) for size in i2j_send_size[rank]) == send_buffer.shape[0]
+        ), "i2j_send_size is inconsistent with destination."
+        recv_buffer = utils.all_to_all_single_rows(
+            send_buffer, i2j_send_size, group=comm_group
+        )
+        send_buffer = None  # release memory
+
+        all_remote_tensors = [
+            tensor.reshape(tensor.shape[:1] + shape[1:])
+            for tensor, shape in zip(
+                torch.split(recv_buffer, all_dim1, dim=1), all_shapes
+            )
+        ]
+        recv_buffer = None
+
+        # update_all_optimizer_states makes every split contiguous, i.e. a separate copy per tensor.
+        optimizable_tensors = self.update_all_optimizer_states(all_remote_tensors)
+        return optimizable_tensors
+
     def all2all_tensors_in_optimizer(self, destination, i2j_send_size):
+        args = utils.get_args()
+        if args.fused_redistribute_gaussians:
+            return self.all2all_tensors_in_optimizer_implementation_3(
+                destination, i2j_send_size
+            )
         return self.all2all_tensors_in_optimizer_implementation_1(
             destination, i2j_send_size
         )
         # return self.all2all_tensors_in_optimizer_implementation_2(destination, i2j_send_size)
         # when cross node all2all on perl, implementation_2 will get stuck at 1600 iterations, I do not know the reason.
+        # implementation_3 replaces the list-based all_to_all of implementation_2 with a single all_to_all_single.
 
     def get_destination_1(self, world_size):
         # norm p=0
         return torch.randint(0, world_size, (self.get_xyz.shape[0],), device="cuda")
 
+    def get_destination_2(self, group):
+        # Minimal movement: only the surplus gaussians on overloaded ranks leave their current GPU.
+        local_n_3dgs = torch.tensor(
+            [self.get_xyz.shape[0]], dtype=torch.int, device="cuda"
+        )
+        all_local_n_3dgs = torch.zeros((group.size(),), dtype=torch.int, device="cuda")
+        torch.distributed.all_gather_into_tensor(
+            all_local_n_3dgs, local_n_3dgs, group=group
+        )
+        all_local_n_3dgs = all_local_n_3dgs.cpu().numpy().tolist()
+
+        send_plan = get_minimal_movement_send_plan(all_local_n_3dgs)
+
+        destination = torch.full(
+            (self.get_xyz.shape[0],), group.rank(), dtype=torch.int64, device="cuda"
+        )
+        # Pick the gaussians to move at random, so that the moved ones do not all come from one region of the storage.
+        perm = torch.randperm(self.get_xyz.shape[0], device="cuda")
+        offset = 0
+        for j in range(group.size()):
+            n_send = send_plan[group.rank()][j]
+            if j == group.rank() or n_send == 0:
+                continue
+            destination[perm[offset : offset + n_send]] = j
+            offset += n_send
+
+        n_moved_3dgs = sum(
+            send_plan[i][j]
+            for i in range(group.size())
+            for j in range(group.size())
+            if i != j
+        )
+        utils.get_log_file().write(
+            "minimal_redistribute: moving {} out of {} 3dgs across GPUs. send_plan: {}\n".format(
+                n_moved_3dgs, sum(all_local_n_3dgs), send_plan
+            )
+        )
+        return destination
+
     def need_redistribute_gaussians(self, group):
         args = utils.get_args()
         if group.size() == 1:
@@ -1267,11 +1499,15 @@ class GaussianModel:
         comm_group_for_redistribution = self.group_for_redistribution()
         if not self.need_redistribute_gaussians(comm_group_for_redistribution):
             return
+        self.catch_up_optimizer()
 
         # Get each 3dgs' destination GPU.
         if args.redistribute_gaussians_mode == "random_redistribute":
             # random redistribution to balance the number of gaussians on each GPU.
             destination = self.get_destination_1(comm_group_for_redistribution.size())
+        elif args.redistribute_gaussians_mode == "minimal_redistribute":
+            # only move the surplus gaussians from overloaded GPUs to underloaded GPUs.
+            destination = self.get_destination_2(comm_group_for_redistribution)
         else:
             raise ValueError(
                 "Invalid redistribute_gaussians_mode: "
@@ -1325,10 +1561,39 @@ class GaussianModel:
             dtype=torch.int,
             device="cuda",
         )
+        self.spatial_index = None
 
         torch.cuda.empty_cache()
 
 
+def get_minimal_movement_send_plan(all_local_n_3dgs):
+    # all_local_n_3dgs: number of 3dgs on each rank, identical on all ranks.
+    # return: send_plan[i][j] is the number of 3dgs rank i sends to rank j; send_plan[i][i] is the number it keeps.
+    # Every rank computes the same plan, so no extra communication is needed to agree on it.
+    world_size = len(all_local_n_3dgs)
+    total_n_3dgs = sum(all_local_n_3dgs)
+    target = [
+        total_n_3dgs // world_size + (1 if i < total_n_3dgs % world_size else 0)
+        for i in range(world_size)
+    ]
+    surplus = [max(all_local_n_3dgs[i] - target[i], 0) for i in range(world_size)]
+    deficit = [max(target[i] - all_local_n_3dgs[i], 0) for i in range(world_size)]
+
+    send_plan = [[0 for _ in range(world_size)] for _ in range(world_size)]
+    j = 0
+    for i in range(world_size):
+        while surplus[i] > 0:
+            while deficit[j] == 0:
+                j += 1
+            n_send = min(surplus[i], deficit[j])
+            send_plan[i][j] += n_send
+            surplus[i] -= n_send
+            deficit[j] -= n_send
+    for i in range(world_size):
+        send_plan[i][i] = all_local_n_3dgs[i] - sum(send_plan[i])
+    return send_plan
+
+
 def get_sparse_ids(tensors):
     sparse_ids = None
     with torch.no_grad():
@@ -1412,8 +1677,9 @@ def sync_gradients_fused_densely(gaussians, group):
         # 1. cat all parameters' grad to a single tensor
         # 2. allreduce
         # 3. split the allreduced tensor to each parameter's grad
+        # flatten() of the contiguous grads are views, so copy_ below writes into the grads.
         all_params_grads = [
-            param.grad.data
+            param.grad.data.flatten(start_dim=1)
             for param in [
                 gaussians._xyz,
                 gaussians._features_dc,
@@ -1436,4 +1702,61 @@ def sync_gradients_fused_densely(gaussians, group):
 
 
 def sync_gradients_fused_sparsely(gaussians, group):
-    raise NotImplementedError("Fused sparse sync gradients is not implemented yet.")
+    # 1. allreduce the mask of rows with a non-zero grad on any rank
+    # 2. pack the touched rows of all parameters' grads into a single tensor and allreduce it
+    # 3. scatter it back to each parameter's grad
+    # If the touched fraction exceeds args.sparse_grad_sync_threshold, the packing does not pay off
+    # and sync_gradients_fused_densely is used instead.
+    args = utils.get_args()
+    with torch.no_grad():
+        all_params_grads = [
+            param.grad.data.flatten(start_dim=1)
+            for param in [
+                gaussians._xyz,
+                gaussians._features_dc,
+                gaussians._features_rest,
+                gaussians._opacity,
+                gaussians._scaling,
+                gaussians._rotation,
+            ]
+        ]
+        all_params_grads_dim1 = [param_grad.shape[1] for param_grad in all_params_grads]
+
+        touched_mask = torch.zeros(
+            (gaussians._xyz.shape[0],), dtype=torch.uint8, device=gaussians._xyz.device
+        )
+        for param_grad in all_params_grads:
+            touched_mask |= (param_grad != 0).any(dim=1).to(torch.uint8)
+        torch.distributed.all_reduce(touched_mask, op=dist.ReduceOp.MAX, group=group)
+        touched_ids = touched_mask.nonzero().squeeze(1)
+        touched_cnt = touched_ids.shape[0]
+        total_cnt = touched_mask.shape[0]
+        touched_ratio = touched_cnt / max(total_cnt, 1)
+
+        if touched_ratio > args.sparse_grad_sync_threshold:
+            sync_gradients_fused_densely(gaussians, group)
+        else:
+            catted_touched_grads = torch.cat(
+                [param_grad[touched_ids] for param_grad in all_params_grads], dim=1
+            ).contiguous()
+            torch.distributed.all_reduce(
+                catted_touched_grads, op=dist.ReduceOp.SUM, group=group
+            )
+            for param_grad, touched_grad in zip(
+                all_params_grads,
+                torch.split(catted_touched_grads, all_params_grads_dim1, dim=1),
+            ):
+                param_grad[touched_ids] = touched_grad
+
+    log_file = utils.get_log_file()
+    # key=value fields, averaged by examples/benchmark/analyze_timers.py.
+    log_file.write(
+        "iterations: [{}, {}) sync_gradients_fused_sparsely touched_cnt={} total_cnt={} touched_fraction={:.6f} dense_fallback={}\n".format(
+            utils.get_cur_iter(),
+            utils.get_cur_iter() + args.bsz,
+            touched_cnt,
+            total_cnt,
+            touched_ratio,
+            int(touched_ratio > args.sparse_grad_sync_threshold),
+        )
+    )
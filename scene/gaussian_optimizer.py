@@ -0,0 +1,255 @@
+import math
+import torch
+
+
+def like_optimizer_state(tensor, state_tensor):
+    # move tensor to where state_tensor lives; offloaded states stay in pinned host memory.
+    if state_tensor.is_cuda:
+        return tensor.to(state_tensor.device)
+    tensor = tensor.cpu()
+    return tensor.pin_memory() if state_tensor.is_pinned() else tensor
+
+
+def adam_step_reference(
+    params, grads, exp_avgs, exp_avg_sqs, steps, lrs, betas, eps, grad_scale=1.0
+):
+    # Plain per-tensor Adam, used to check GaussianAdam; works on cpu tensors.
+    # steps: step count of every param after this update; grads are multiplied by grad_scale first.
+    beta1, beta2 = betas
+    for param, grad, exp_avg, exp_avg_sq, step, lr in zip(
+        params, grads, exp_avgs, exp_avg_sqs, steps, lrs
+    ):
+        grad = grad * grad_scale
+        exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+        bias_correction1 = 1 - beta1**step
+        bias_correction2 = 1 - beta2**step
+        denom = (exp_avg_sq.sqrt() / math.sqrt(bias_correction2)).add_(eps)
+        param.data.addcdiv_(exp_avg, denom, value=-lr / bias_correction1)
+
+
+class GaussianAdam(torch.optim.Adam):
+    """
+    Adam over the gaussian parameter groups with one multi-tensor pass per step.
+
+    The state layout ("step", "exp_avg", "exp_avg_sq") is the one of torch.optim.Adam, so densification,
+    pruning, redistribution and checkpoints handle it unchanged. step() folds in the scaling of the grads
+    by grad_scale (e.g. 1 / bsz), each group's lr (the xyz group follows xyz_scheduler_args through
+    update_learning_rate) and the bias correction; all groups must share betas and eps.
+
+    step(visible_ids=...) only updates the given rows of every parameter (lazy Adam). The moments of a
+    row skipped for k - 1 steps are decayed by beta^k at its next update, and row_last_step remembers the
+    last update of each row. catch_up() applies the pending decay to all rows; it must be called before
+    rows are added, removed, reordered or saved, after which row_last_step restarts from scratch.
+
+    The moments of the groups named in offload_groups live in pinned host memory. Their update streams
+    chunks of offload_chunk_size rows to the gpu on a copy stream, one chunk ahead of the computation, and
+    writes them back asynchronously, so the write-back of the last chunks overlaps the next forward.
+    """
+
+    def __init__(self, *args, offload_groups=(), offload_chunk_size=1 << 20, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (N,) step of the last update of every row in sparse steps.
+        self.row_last_step = None
+        self.offload_groups = set(offload_groups)
+        self.offload_chunk_size = offload_chunk_size
+        self.copy_stream = None
+
+    def is_offloaded(self, group):
+        return group.get("name", None) in self.offload_groups
+
+    def synchronize_offload(self):
+        # wait for the asynchronous write-back of offloaded moments, before they are read on the host.
+        if self.copy_stream is not None:
+            self.copy_stream.synchronize()
+
+    @torch.no_grad()
+    def catch_up(self):
+        self.synchronize_offload()
+        if self.row_last_step is None:
+            return
+        beta1, beta2 = self.param_groups[0]["betas"]
+        for group in self.param_groups:
+            for param in group["params"]:
+                state = self.state.get(param, None)
+                if state is None or len(state) == 0:
+                    continue
+                skipped = (state["step"].item() - self.row_last_step).view(
+                    (-1,) + (1,) * (param.dim() - 1)
+                )
+                state["exp_avg"].mul_(torch.pow(beta1, skipped))
+                state["exp_avg_sq"].mul_(torch.pow(beta2, skipped))
+        self.row_last_step = None
+
+    @torch.no_grad()
+    def step(self, closure=None, grad_scale=1.0, visible_ids=None):
+        assert closure is None, "GaussianAdam does not support closures."
+        if visible_ids is not None:
+            return self.sparse_step(visible_ids, grad_scale)
+        self.catch_up()
+        params, grads, exp_avgs, exp_avg_sqs, lrs, steps = [], [], [], [], [], []
+        betas, eps = self.param_groups[0]["betas"], self.param_groups[0]["eps"]
+        for group in self.param_groups:
+            assert (
+                tuple(group["betas"]) == tuple(betas) and group["eps"] == eps
+            ), "GaussianAdam needs the same betas and eps in all param groups."
+            for param in group["params"]:
+                if param.grad is None:
+                    continue
+                state = self.state[param]
+                if len(state) == 0:
+                    state["step"] = torch.tensor(0.0)
+                    state["exp_avg"] = torch.zeros_like(
+                        param, memory_format=torch.preserve_format
+                    )
+                    state["exp_avg_sq"] = torch.zeros_like(
+                        param, memory_format=torch.preserve_format
+                    )
+                state["step"] += 1
+                if self.is_offloaded(group):
+                    self.offloaded_step(param, state, group["lr"], grad_scale)
+                    continue
+                params.append(param)
+                grads.append(param.grad)
+                exp_avgs.append(state["exp_avg"])
+                exp_avg_sqs.append(state["exp_avg_sq"])
+                lrs.append(group["lr"])
+                steps.append(state["step"].item())
+        if len(params) == 0:
+            return
+
+        beta1, beta2 = betas
+        # exp_avg = beta1 * exp_avg + (1 - beta1) * grad_scale * grad
+        torch._foreach_mul_(exp_avgs, beta1)
+        torch._foreach_add_(exp_avgs, grads, alpha=(1 - beta1) * grad_scale)
+        # exp_avg_sq = beta2 * exp_avg_sq + (1 - beta2) * (grad_scale * grad)^2
+        torch._foreach_mul_(exp_avg_sqs, beta2)
+        torch._foreach_addcmul_(
+            exp_avg_sqs, grads, grads, value=(1 - beta2) * grad_scale * grad_scale
+        )
+        # param -= lr / bias_correction1 * exp_avg / (sqrt(exp_avg_sq / bias_correction2) + eps)
+        denoms = torch._foreach_sqrt(exp_avg_sqs)
+        torch._foreach_div_(denoms, [math.sqrt(1 - beta2**step) for step in steps])
+        torch._foreach_add_(denoms, eps)
+        torch._foreach_addcdiv_(
+            params,
+            exp_avgs,
+            denoms,
+            [-lr / (1 - beta1**step) for lr, step in zip(lrs, steps)],
+        )
+
+    @torch.no_grad()
+    def offloaded_step(self, param, state, lr, grad_scale=1.0):
+        # Adam update of one parameter whose moments are in host memory, streamed in chunks of rows.
+        beta1, beta2 = self.param_groups[0]["betas"]
+        eps = self.param_groups[0]["eps"]
+        step = state["step"].item()
+        for key in ["exp_avg", "exp_avg_sq"]:
+            if state[key].is_cuda:
+                # e.g. right after load_state_dict, which puts the state next to the parameter.
+                state[key] = state[key].cpu().pin_memory()
+        if self.copy_stream is None:
+            self.copy_stream = torch.cuda.Stream()
+        main_stream = torch.cuda.current_stream()
+
+        def prefetch(start, end):
+            with torch.cuda.stream(self.copy_stream):
+                chunk = [
+                    state[key][start:end].to(param.device, non_blocking=True)
+                    for key in ["exp_avg", "exp_avg_sq"]
+                ]
+                arrived = torch.cuda.Event()
+                arrived.record(self.copy_stream)
+            for tensor in chunk:
+                tensor.record_stream(main_stream)
+            return chunk, arrived
+
+        chunk_bounds = [
+            (start, min(start + self.offload_chunk_size, param.shape[0]))
+            for start in range(0, param.shape[0], self.offload_chunk_size)
+        ]
+        next_chunk = prefetch(*chunk_bounds[0]) if len(chunk_bounds) > 0 else None
+        for i, (start, end) in enumerate(chunk_bounds):
+            (exp_avg, exp_avg_sq), arrived = next_chunk
+            if i + 1 < len(chunk_bounds):
+                next_chunk = prefetch(*chunk_bounds[i + 1])
+            main_stream.wait_event(arrived)
+            grad = param.grad[start:end]
+            exp_avg.mul_(beta1).add_(grad, alpha=(1 - beta1) * grad_scale)
+            exp_avg_sq.mul_(beta2).addcmul_(
+                grad, grad, value=(1 - beta2) * grad_scale * grad_scale
+            )
+            denom = (exp_avg_sq.sqrt() / math.sqrt(1 - beta2**step)).add_(eps)
+            param.data[start:end].addcdiv_(
+                exp_avg, denom, value=-lr / (1 - beta1**step)
+            )
+            # write back on the copy stream once the update is done.
+            self.copy_stream.wait_stream(main_stream)
+            with torch.cuda.stream(self.copy_stream):
+                state["exp_avg"][start:end].copy_(exp_avg, non_blocking=True)
+                state["exp_avg_sq"][start:end].copy_(exp_avg_sq, non_blocking=True)
+
+    @torch.no_grad()
+    def sparse_step(self, visible_ids, grad_scale=1.0):
+        # Same update as step() on the rows in visible_ids only, gathered into one multi-tensor pass.
+        assert (
+            len(self.offload_groups) == 0
+        ), "sparse steps do not support offloaded optimizer states."
+        params, grads, exp_avgs, exp_avg_sqs, lrs, states = [], [], [], [], [], []
+        betas, eps = self.param_groups[0]["betas"], self.param_groups[0]["eps"]
+        for group in self.param_groups:
+            assert (
+                tuple(group["betas"]) == tuple(betas) and group["eps"] == eps
+            ), "GaussianAdam needs the same betas and eps in all param groups."
+            for param in group["params"]:
+                if param.grad is None:
+                    continue
+                state = self.state[param]
+                if len(state) == 0:
+                    state["step"] = torch.tensor(0.0)
+                    state["exp_avg"] = torch.zeros_like(param)
+                    state["exp_avg_sq"] = torch.zeros_like(param)
+                params.append(param)
+                grads.append(param.grad[visible_ids])
+                exp_avgs.append(state["exp_avg"][visible_ids])
+                exp_avg_sqs.append(state["exp_avg_sq"][visible_ids])
+                lrs.append(group["lr"])
+                states.append(state)
+        if len(params) == 0:
+            return
+
+        # all parameters share rows, so their step counts move together.
+        last_step = max(state["step"].item() for state in states)
+        for state in states:
+            state["step"].fill_(last_step + 1)
+        step = last_step + 1
+        if self.row_last_step is None:
+            self.row_last_step = torch.full(
+                (params[0].shape[0],), last_step, device=params[0].device
+            )
+
+        beta1, beta2 = betas
+        skipped = step - self.row_last_step[visible_ids]  # >= 1
+        decay1, decay2 = torch.pow(beta1, skipped), torch.pow(beta2, skipped)
+        # exp_avg = beta1^skipped * exp_avg + (1 - beta1) * grad_scale * grad, same for exp_avg_sq.
+        for exp_avg, exp_avg_sq in zip(exp_avgs, exp_avg_sqs):
+            shape = (-1,) + (1,) * (exp_avg.dim() - 1)
+            exp_avg.mul_(decay1.view(shape))
+            exp_avg_sq.mul_(decay2.view(shape))
+        torch._foreach_add_(exp_avgs, grads, alpha=(1 - beta1) * grad_scale)
+        torch._foreach_addcmul_(
+            exp_avg_sqs, grads, grads, value=(1 - beta2) * grad_scale * grad_scale
+        )
+        denoms = torch._foreach_sqrt(exp_avg_sqs)
+        torch._foreach_div_(denoms, math.sqrt(1 - beta2**step))
+        torch._foreach_add_(denoms, eps)
+        updates = torch._foreach_div(exp_avgs, denoms)
+        torch._foreach_mul_(updates, [-lr / (1 - beta1**step) for lr in lrs])
+
+        for param, state, exp_avg, exp_avg_sq, update in zip(
+            params, states, exp_avgs, exp_avg_sqs, updates
+        ):
+            state["exp_avg"][visible_ids] = exp_avg
+            state["exp_avg_sq"][visible_ids] = exp_avg_sq
+            param.data.index_add_(0, visible_ids, update)
+        self.row_last_step[visible_ids] = step
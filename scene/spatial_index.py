@@ -0,0 +1,124 @@
+import torch
+
+
+class GaussianSpatialIndex:
+    """
+    Coarse uniform grid over the centers of the local 3dgs.
+
+    Every non-empty grid cell is a chunk: its gaussians are stored contiguously in `sorted_ids`
+    and its bounding box is grown by the extent of its gaussians, so that a chunk whose box is
+    outside a camera frustum contains no gaussian that can touch that camera's image.
+    All tensors live on the device of `xyz`, so the index also works on cpu tensors.
+    """
+
+    def __init__(self, xyz, extents, grid_size=32, margin=0.0):
+        # xyz: (N, 3) centers; extents: (N,) radius of each gaussian in world space (e.g. 3 * max scale).
+        assert grid_size > 0, "grid_size should be positive."
+        self.n_points = xyz.shape[0]
+        self.grid_size = grid_size
+        self.device = xyz.device
+
+        xyz = xyz.detach().float()
+        extents = extents.detach().float().reshape(-1) + margin
+        if self.n_points == 0:
+            self.sorted_ids = torch.zeros((0,), dtype=torch.long, device=self.device)
+            self.chunk_starts = torch.zeros((0,), dtype=torch.long, device=self.device)
+            self.chunk_sizes = torch.zeros((0,), dtype=torch.long, device=self.device)
+            self.chunk_min = torch.zeros((0, 3), device=self.device)
+            self.chunk_max = torch.zeros((0, 3), device=self.device)
+            return
+
+        min_xyz = xyz.min(dim=0).values
+        max_xyz = xyz.max(dim=0).values
+        cell_size = torch.clamp_min((max_xyz - min_xyz) / grid_size, 1e-12)
+        cell_xyz = ((xyz - min_xyz) / cell_size).long().clamp_(0, grid_size - 1)
+        cell_ids = (
+            cell_xyz[:, 0] * grid_size * grid_size
+            + cell_xyz[:, 1] * grid_size
+            + cell_xyz[:, 2]
+        )
+
+        self.sorted_ids = torch.argsort(cell_ids)
+        occupied_cells, self.chunk_sizes = torch.unique_consecutive(
+            cell_ids[self.sorted_ids], return_counts=True
+        )
+        self.chunk_starts = torch.cumsum(self.chunk_sizes, dim=0) - self.chunk_sizes
+
+        # chunk id of each gaussian, in sorted order.
+        chunk_of_sorted = torch.repeat_interleave(
+            torch.arange(len(occupied_cells), device=self.device), self.chunk_sizes
+        )
+        sorted_xyz = xyz[self.sorted_ids]
+        sorted_extents = extents[self.sorted_ids].unsqueeze(1)
+        n_chunks = len(occupied_cells)
+        self.chunk_min = torch.full((n_chunks, 3), float("inf"), device=self.device)
+        self.chunk_max = torch.full((n_chunks, 3), float("-inf"), device=self.device)
+        index = chunk_of_sorted.unsqueeze(1).expand(-1, 3)
+        self.chunk_min.scatter_reduce_(
+            0, index, sorted_xyz - sorted_extents, reduce="amin"
+        )
+        self.chunk_max.scatter_reduce_(
+            0, index, sorted_xyz + sorted_extents, reduce="amax"
+        )
+
+    @property
+    def n_chunks(self):
+        return self.chunk_sizes.shape[0]
+
+    def chunk_corners(self, chunks=None):
+        # chunks: optional bool mask or ids of the chunks to use; all chunks by default.
+        # return: (n_chunks, 8, 4) homogeneous corners of every chunk's bounding box.
+        chunk_min, chunk_max = self.chunk_min, self.chunk_max
+        if chunks is not None:
+            chunk_min, chunk_max = chunk_min[chunks], chunk_max[chunks]
+        corners = []
+        for x in (chunk_min[:, 0], chunk_max[:, 0]):
+            for y in (chunk_min[:, 1], chunk_max[:, 1]):
+                for z in (chunk_min[:, 2], chunk_max[:, 2]):
+                    corners.append(torch.stack([x, y, z, torch.ones_like(x)], dim=1))
+        return torch.stack(corners, dim=1)
+
+    def visible_chunks(self, full_proj_transform, znear=0.2):
+        # full_proj_transform: (4, 4) world to clip transform, row-vector convention as in Camera.
+        # return: (n_chunks,) bool mask of chunks that may intersect the frustum.
+        # A box is culled only if all its corners are on the outer side of one clip plane; clip planes are
+        # linear in world space, so this is conservative. The near plane mirrors the rasterizer's in_frustum test.
+        clip = self.chunk_corners() @ full_proj_transform.to(self.device).float()
+        x, y, w = clip[..., 0], clip[..., 1], clip[..., 3]
+        outside = (
+            (x < -w).all(dim=1)
+            | (x > w).all(dim=1)
+            | (y < -w).all(dim=1)
+            | (y > w).all(dim=1)
+            | (w <= znear).all(dim=1)
+        )
+        return ~outside
+
+    def ids_of_chunks(self, chunks):
+        # chunks: bool mask or ids of the selected chunks.
+        # return: (M,) ids of all gaussians in the selected chunks, grouped by chunk.
+        sizes = self.chunk_sizes[chunks]
+        starts = self.chunk_starts[chunks]
+        total = int(sizes.sum().item()) if sizes.numel() > 0 else 0
+        if total == 0:
+            return torch.zeros((0,), dtype=torch.long, device=self.device)
+        # position inside the selected chunks -> position inside sorted_ids.
+        offsets = torch.repeat_interleave(
+            starts - (torch.cumsum(sizes, dim=0) - sizes), sizes
+        )
+        return self.sorted_ids[torch.arange(total, device=self.device) + offsets]
+
+    def query(self, full_proj_transform, znear=0.2):
+        # return: (M,) ids of the gaussians that may be visible from the camera.
+        return self.ids_of_chunks(self.visible_chunks(full_proj_transform, znear))
+
+    def chunk_values_to_points(self, chunk_values):
+        # chunk_values: (n_chunks,) one value per chunk.
+        # return: (N,) the value of the chunk of every gaussian, in the original gaussian order.
+        point_values = torch.empty(
+            (self.n_points,), dtype=chunk_values.dtype, device=self.device
+        )
+        point_values[self.sorted_ids] = torch.repeat_interleave(
+            chunk_values, self.chunk_sizes
+        )
+        return point_values
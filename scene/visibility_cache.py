@@ -0,0 +1,122 @@
+import torch
+import utils.general_utils as utils
+
+
+def pack_bool_mask(mask):
+    # mask: (n,) bool tensor. return: (ceil(n/8),) uint8 bitmap.
+    n = mask.shape[0]
+    padded = torch.zeros(((n + 7) // 8 * 8,), dtype=torch.uint8, device=mask.device)
+    padded[:n] = mask
+    weights = 2 ** torch.arange(8, dtype=torch.uint8, device=mask.device)
+    return (padded.view(-1, 8) * weights).sum(dim=1).to(torch.uint8)
+
+
+def unpack_bool_mask(bitmap, n):
+    # inverse of pack_bool_mask.
+    shifts = torch.arange(8, dtype=torch.uint8, device=bitmap.device)
+    return ((bitmap.unsqueeze(1) >> shifts) & 1).view(-1)[:n].bool()
+
+
+class CameraVisibilityCache:
+    """
+    Which chunks of a GaussianSpatialIndex each camera can see.
+
+    Entries are computed lazily per camera and dropped together when the cache is bound to a new
+    index, i.e. whenever the local 3dgs change. They are keyed by image name, because train and test
+    cameras share uids. Each entry is stored either as a chunk-id list or as a bitmap over chunks,
+    whichever is smaller.
+    """
+
+    def __init__(self):
+        self.spatial_index = None
+        self.entries = {}  # image name -> int32 chunk ids or uint8 bitmap
+        self.tile_row_workloads = (
+            {}
+        )  # image name -> (TILE_Y,) estimated number of 3dgs per tile row
+
+    def bind(self, spatial_index):
+        if spatial_index is not self.spatial_index:
+            self.spatial_index = spatial_index
+            self.entries = {}
+            self.tile_row_workloads = {}
+
+    def get_entry(self, camera):
+        # Picking the smaller representation syncs with the host, but only the first time a camera is seen.
+        n_chunks = self.spatial_index.n_chunks
+        if camera.image_name not in self.entries:
+            mask = self.spatial_index.visible_chunks(camera.full_proj_transform)
+            chunk_ids = mask.nonzero().squeeze(1)
+            if chunk_ids.shape[0] * 32 <= n_chunks:
+                self.entries[camera.image_name] = chunk_ids.int()
+            else:
+                self.entries[camera.image_name] = pack_bool_mask(mask)
+        return self.entries[camera.image_name]
+
+    def get_visible_chunks(self, camera):
+        # return: (M,) long ids of the chunks that may be visible from camera.
+        entry = self.get_entry(camera)
+        if entry.dtype == torch.uint8:
+            return self.get_visible_chunk_mask(camera).nonzero().squeeze(1)
+        return entry.long()
+
+    def get_visible_chunk_mask(self, camera):
+        # return: (n_chunks,) bool mask of the chunks that may be visible from camera.
+        entry = self.get_entry(camera)
+        n_chunks = self.spatial_index.n_chunks
+        if entry.dtype == torch.uint8:
+            return unpack_bool_mask(entry, n_chunks)
+        mask = torch.zeros((n_chunks,), dtype=torch.bool, device=entry.device)
+        mask[entry.long()] = True
+        return mask
+
+    def get_visible_ids(self, camera):
+        # return: (M,) ids of the local 3dgs that may be visible from camera.
+        return self.spatial_index.ids_of_chunks(self.get_visible_chunks(camera))
+
+    def batched_count_visible(self, batched_cameras):
+        # return: (batch_size,) float32 number of local 3dgs in the chunks visible from each camera.
+        # One reduction over the stacked masks, left on the device.
+        batched_mask = torch.stack(
+            [self.get_visible_chunk_mask(camera) for camera in batched_cameras]
+        )
+        return batched_mask.float() @ self.spatial_index.chunk_sizes.float()
+
+    def get_tile_row_workload(self, camera):
+        # return: (TILE_Y,) estimated number of local 3dgs touching each tile row of camera's image.
+        # Every visible chunk spreads its gaussian count evenly over the tile rows its projected box covers.
+        if camera.image_name in self.tile_row_workloads:
+            return self.tile_row_workloads[camera.image_name]
+
+        index = self.spatial_index
+        chunk_ids = self.get_visible_chunks(camera)
+        tile_y = utils.TILE_Y
+        workload = torch.zeros((tile_y + 1,), dtype=torch.float32, device=index.device)
+        if chunk_ids.shape[0] > 0:
+            clip = (
+                index.chunk_corners(chunk_ids)
+                @ camera.full_proj_transform.to(index.device).float()
+            )
+            y, w = clip[..., 1], clip[..., 3]
+            behind = (w <= 0.2).any(dim=1)
+            w = torch.where(w > 0.2, w, torch.ones_like(w))
+            pixel_y = ((y / w + 1.0) * camera.image_height - 1.0) * 0.5
+            rows = torch.floor(pixel_y / utils.BLOCK_Y).long()
+            row_l = rows.min(dim=1).values.clamp(0, tile_y - 1)
+            row_r = rows.max(dim=1).values.clamp(0, tile_y - 1)
+            # a box crossing the near plane may project anywhere.
+            row_l[behind] = 0
+            row_r[behind] = tile_y - 1
+            count = index.chunk_sizes[chunk_ids].float() / (row_r - row_l + 1).float()
+            workload.index_add_(0, row_l, count)
+            workload.index_add_(0, row_r + 1, -count)
+        workload = torch.cumsum(workload, dim=0)[:tile_y]
+        self.tile_row_workloads[camera.image_name] = workload
+        return workload
+
+    def count_visible_cameras(self, cameras):
+        # return: (N,) number of cameras whose frustum intersects the chunk of each local 3dgs.
+        index = self.spatial_index
+        chunk_cnt = torch.zeros((index.n_chunks,), dtype=torch.int, device=index.device)
+        for camera in cameras:
+            chunk_cnt[self.get_visible_chunks(camera)] += 1
+        return index.chunk_values_to_points(chunk_cnt)
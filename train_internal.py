@@ -26,7 +26,12 @@ from utils.timer import Timer, End2endTimer
 from tqdm import tqdm
 from utils.image_utils import psnr
 import torch.distributed as dist
-from densification import densification, gsplat_densification
+from densification import (
+    densification,
+    gsplat_densification,
+    update_densification_stats,
+    gsplat_update_densification_stats,
+)
 
 
 def training(dataset_args, opt_args, pipe_args, args, log_file):
@@ -69,6 +74,12 @@ def training(dataset_args, opt_args, pipe_args, args, log_file):
     strategy_history = DivisionStrategyHistoryFinal(
         train_dataset, utils.DEFAULT_GROUP.size(), utils.DEFAULT_GROUP.rank()
     )
+    if args.start_checkpoint != "" and os.path.exists(
+        os.path.join(args.start_checkpoint, "strategy_history.pth")
+    ):
+        strategy_history.load_state_dict(
+            torch.load(os.path.join(args.start_checkpoint, "strategy_history.pth"))
+        )
 
     # Init background
     background = None
@@ -133,81 +144,142 @@ def training(dataset_args, opt_args, pipe_args, args, log_file):
         else:
             batched_cameras = train_dataset.get_batched_cameras(args.bsz)
 
-        with torch.no_grad():
-            # Prepare Workload division strategy
-            timers.start("prepare_strategies")
-            batched_strategies, gpuid2tasks = start_strategy_final(
-                batched_cameras, strategy_history
-            )
-            timers.stop("prepare_strategies")
-
-            # Load ground-truth images to GPU
-            timers.start("load_cameras")
-            load_camera_from_cpu_to_all_gpu(
-                batched_cameras, batched_strategies, gpuid2tasks
-            )
-            timers.stop("load_cameras")
+        # With micro_bsz, the batch is processed micro_bsz cameras at a time: gradients accumulate over the
+        # backward of every micro-batch, so that only one micro-batch's screen-space states are alive at once.
+        micro_bsz = args.micro_bsz if args.micro_bsz > 0 else args.bsz
+        micro_batches = [
+            batched_cameras[i : i + micro_bsz]
+            for i in range(0, len(batched_cameras), micro_bsz)
+        ]
+        batched_losses = []
+        # the visibility of all micro-batches, for gradient sync and sparse Adam.
+        visibility_pkg = {
+            "batched_locally_preprocessed_visibility_filter": [],
+            "batched_locally_preprocessed_ids": [],
+        }
+        for micro_batch_id, batched_cameras in enumerate(micro_batches):
+            with torch.no_grad():
+                # Prepare Workload division strategy
+                timers.start("prepare_strategies")
+                # NOTE: may reorder batched_cameras in place.
+                batched_strategies, gpuid2tasks = start_strategy_final(
+                    batched_cameras, strategy_history, gaussians
+                )
+                timers.stop("prepare_strategies")
 
-        if args.backend == "gsplat":
-            batched_screenspace_pkg = (
-                gsplat_distributed_preprocess3dgs_and_all2all_final(
-                    batched_cameras,
-                    gaussians,
-                    pipe_args,
-                    background,
-                    batched_strategies=batched_strategies,
-                    mode="train",
+                # Load ground-truth images to GPU
+                timers.start("load_cameras")
+                load_camera_from_cpu_to_all_gpu(
+                    batched_cameras, batched_strategies, gpuid2tasks
                 )
-            )
-            batched_image, batched_compute_locally = gsplat_render_final(
-                batched_screenspace_pkg, batched_strategies
-            )
-            batch_statistic_collector = [
-                cuda_args["stats_collector"]
-                for cuda_args in batched_screenspace_pkg["batched_cuda_args"]
-            ]
-        else:
-            batched_screenspace_pkg = distributed_preprocess3dgs_and_all2all_final(
-                batched_cameras,
-                gaussians,
-                pipe_args,
-                background,
-                batched_strategies=batched_strategies,
-                mode="train",
-            )
-            batched_image, batched_compute_locally = render_final(
-                batched_screenspace_pkg, batched_strategies
-            )
-            batch_statistic_collector = [
-                cuda_args["stats_collector"]
-                for cuda_args in batched_screenspace_pkg["batched_cuda_args"]
-            ]
-
-        loss_sum, batched_losses = batched_loss_computation(
-            batched_image,
-            batched_cameras,
-            batched_compute_locally,
-            batched_strategies,
-            batch_statistic_collector,
-        )
+                timers.stop("load_cameras")
 
-        timers.start("backward")
-        loss_sum.backward()
-        timers.stop("backward")
-        utils.check_initial_gpu_memory_usage("after backward")
+            if args.backend == "gsplat":
+                micro_batched_screenspace_pkg = (
+                    gsplat_distributed_preprocess3dgs_and_all2all_final(
+                        batched_cameras,
+                        gaussians,
+                        pipe_args,
+                        background,
+                        batched_strategies=batched_strategies,
+                        mode="train",
+                    )
+                )
+                batched_image, batched_compute_locally = gsplat_render_final(
+                    micro_batched_screenspace_pkg, batched_strategies
+                )
+                batch_statistic_collector = [
+                    cuda_args["stats_collector"]
+                    for cuda_args in micro_batched_screenspace_pkg["batched_cuda_args"]
+                ]
+            else:
+                micro_batched_screenspace_pkg = (
+                    distributed_preprocess3dgs_and_all2all_final(
+                        batched_cameras,
+                        gaussians,
+                        pipe_args,
+                        background,
+                        batched_strategies=batched_strategies,
+                        mode="train",
+                    )
+                )
+                batched_image, batched_compute_locally = render_final(
+                    micro_batched_screenspace_pkg, batched_strategies
+                )
+                batch_statistic_collector = [
+                    cuda_args["stats_collector"]
+                    for cuda_args in micro_batched_screenspace_pkg["batched_cuda_args"]
+                ]
 
-        with torch.no_grad():
-            # Adjust workload division strategy.
-            globally_sync_for_timer()
-            timers.start("finish_strategy_final")
-            finish_strategy_final(
+            loss_sum, micro_batched_losses = batched_loss_computation(
+                batched_image,
                 batched_cameras,
-                strategy_history,
+                batched_compute_locally,
                 batched_strategies,
                 batch_statistic_collector,
             )
-            timers.stop("finish_strategy_final")
 
+            timers.start("backward")
+            loss_sum.backward()
+            timers.stop("backward")
+            utils.check_initial_gpu_memory_usage("after backward")
+
+            with torch.no_grad():
+                # Adjust workload division strategy.
+                globally_sync_for_timer()
+                timers.start("finish_strategy_final")
+                finish_strategy_final(
+                    batched_cameras,
+                    strategy_history,
+                    batched_strategies,
+                    batch_statistic_collector,
+                )
+                timers.stop("finish_strategy_final")
+
+            batched_losses += micro_batched_losses
+            if len(micro_batches) > 1:
+                micro_batched_visibility_filter = micro_batched_screenspace_pkg[
+                    "batched_locally_preprocessed_visibility_filter"
+                ]
+                visibility_pkg[
+                    "batched_locally_preprocessed_visibility_filter"
+                ] += micro_batched_visibility_filter
+                visibility_pkg[
+                    "batched_locally_preprocessed_ids"
+                ] += micro_batched_screenspace_pkg.get(
+                    "batched_locally_preprocessed_ids",
+                    [None] * len(micro_batched_visibility_filter),
+                )
+                if (
+                    not args.disable_auto_densification
+                    and iteration <= args.densify_until_iter
+                ):
+                    # under the parent timer, as when densification() adds the stats of the whole batch.
+                    timers.start("densification")
+                    if args.backend == "gsplat":
+                        gsplat_update_densification_stats(
+                            iteration, gaussians, micro_batched_screenspace_pkg
+                        )
+                    else:
+                        update_densification_stats(
+                            iteration, gaussians, micro_batched_screenspace_pkg
+                        )
+                    timers.stop("densification")
+                for viewpoint_cam in batched_cameras:
+                    viewpoint_cam.original_image = None
+                # free this micro-batch's screen-space states before the next one.
+                del micro_batched_screenspace_pkg, batched_image, loss_sum
+        # micro-batches may have been reordered in place by start_strategy_final.
+        batched_cameras = [camera for cameras in micro_batches for camera in cameras]
+        if len(micro_batches) > 1:
+            # densification stats were already added after every micro-batch.
+            batched_screenspace_pkg = visibility_pkg
+            densification_pkg = None
+        else:
+            batched_screenspace_pkg = micro_batched_screenspace_pkg
+            densification_pkg = batched_screenspace_pkg
+
+        with torch.no_grad():
             # Sync losses in the batch
             timers.start("sync_loss_and_log")
             batched_losses = torch.tensor(batched_losses, device="cuda")
@@ -252,11 +324,9 @@ def training(dataset_args, opt_args, pipe_args, args, log_file):
 
             # Densification
             if args.backend == "gsplat":
-                gsplat_densification(
-                    iteration, scene, gaussians, batched_screenspace_pkg
-                )
+                gsplat_densification(iteration, scene, gaussians, densification_pkg)
             else:
-                densification(iteration, scene, gaussians, batched_screenspace_pkg)
+                densification(iteration, scene, gaussians, densification_pkg)
 
             # Save Gaussians
             if any(
@@ -310,21 +380,40 @@ def training(dataset_args, opt_args, pipe_args, args, log_file):
                     + str(utils.GLOBAL_RANK)
                     + ".pth",
                 )
+                # division heuristics are the same on all ranks.
+                if utils.DEFAULT_GROUP.rank() == 0:
+                    torch.save(
+                        strategy_history.state_dict(),
+                        save_folder + "/strategy_history.pth",
+                    )
                 end2end_timers.start()
 
             # Optimizer step
             if iteration < opt_args.iterations:
                 timers.start("optimizer_step")
 
-                if (
-                    args.lr_scale_mode != "accumu"
-                ):  # we scale the learning rate rather than accumulate the gradients.
-                    for param in gaussians.all_parameters():
-                        if param.grad is not None:
-                            param.grad /= args.bsz
-
-                if not args.stop_update_param:
-                    gaussians.optimizer.step()
+                # we scale the learning rate rather than accumulate the gradients.
+                grad_scale = 1.0 if args.lr_scale_mode == "accumu" else 1.0 / args.bsz
+                if args.sparse_adam:
+                    # densification replaces the parameters and drops their grads; then the filters are stale.
+                    if not args.stop_update_param and gaussians._xyz.grad is not None:
+                        gaussians.optimizer.step(
+                            grad_scale=grad_scale,
+                            visible_ids=gaussians.get_batch_visible_ids(
+                                batched_screenspace_pkg
+                            ),
+                        )
+                elif args.fused_adam or args.offload_optimizer_state != "none":
+                    if not args.stop_update_param:
+                        gaussians.optimizer.step(grad_scale=grad_scale)
+                else:
+                    if grad_scale != 1.0:
+                        for param in gaussians.all_parameters():
+                            if param.grad is not None:
+                                param.grad /= args.bsz
+
+                    if not args.stop_update_param:
+                        gaussians.optimizer.step()
                 gaussians.optimizer.zero_grad(set_to_none=True)
                 timers.stop("optimizer_step")
                 utils.check_initial_gpu_memory_usage("after optimizer step")
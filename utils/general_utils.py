@@ -31,6 +31,7 @@ DP_GROUP = None
 MP_GROUP = None
 DEFAULT_GROUP = None
 IN_NODE_GROUP = None
+CROSS_NODE_GROUP = None  # ranks with the same local rank on every node
 TIMERS = None
 DENSIFY_ITER = 0
 
@@ -192,7 +193,7 @@ def check_comm_group():
 
 
 def init_distributed(args):
-    global GLOBAL_RANK, LOCAL_RANK, WORLD_SIZE, DEFAULT_GROUP, IN_NODE_GROUP
+    global GLOBAL_RANK, LOCAL_RANK, WORLD_SIZE, DEFAULT_GROUP, IN_NODE_GROUP, CROSS_NODE_GROUP
     GLOBAL_RANK = int(os.environ.get("RANK", 0))
     LOCAL_RANK = int(os.environ.get("LOCAL_RANK", 0))
     WORLD_SIZE = int(os.environ.get("WORLD_SIZE", 1))
@@ -207,16 +208,7 @@ def init_distributed(args):
 
         DEFAULT_GROUP = dist.group.WORLD
 
-        num_gpu_per_node = one_node_device_count()
-        n_of_nodes = WORLD_SIZE // num_gpu_per_node
-        all_in_node_group = []
-        for rank in range(n_of_nodes):
-            in_node_group_ranks = list(
-                range(rank * num_gpu_per_node, (rank + 1) * num_gpu_per_node)
-            )
-            all_in_node_group.append(dist.new_group(in_node_group_ranks))
-        node_rank = GLOBAL_RANK // num_gpu_per_node
-        IN_NODE_GROUP = all_in_node_group[node_rank]
+        init_node_groups(one_node_device_count())
         print(
             "Initializing -> "
             + " world_size: "
@@ -232,6 +224,27 @@ def init_distributed(args):
     else:
         DEFAULT_GROUP = SingleGPUGroup()
         IN_NODE_GROUP = SingleGPUGroup()
+        CROSS_NODE_GROUP = SingleGPUGroup()
+
+
+def init_node_groups(num_gpu_per_node):
+    # every rank must call this, because dist.new_group is collective.
+    global IN_NODE_GROUP, CROSS_NODE_GROUP
+    n_of_nodes = WORLD_SIZE // num_gpu_per_node
+    all_in_node_group = []
+    for rank in range(n_of_nodes):
+        in_node_group_ranks = list(
+            range(rank * num_gpu_per_node, (rank + 1) * num_gpu_per_node)
+        )
+        all_in_node_group.append(dist.new_group(in_node_group_ranks))
+    all_cross_node_group = []
+    for local_rank in range(num_gpu_per_node):
+        cross_node_group_ranks = list(
+            range(local_rank, n_of_nodes * num_gpu_per_node, num_gpu_per_node)
+        )
+        all_cross_node_group.append(dist.new_group(cross_node_group_ranks))
+    IN_NODE_GROUP = all_in_node_group[GLOBAL_RANK // num_gpu_per_node]
+    CROSS_NODE_GROUP = all_cross_node_group[GLOBAL_RANK % num_gpu_per_node]
 
 
 def one_node_device_count():
@@ -269,6 +282,115 @@ def our_allgather_among_cpu_processes_float_list(data, group):
     return all_data
 
 
+def reorder_row_chunks(buffer, chunk_sizes, order):
+    # buffer: rows made of consecutive chunks of chunk_sizes rows; return the chunks concatenated in order.
+    chunks = torch.split(buffer, chunk_sizes, dim=0)
+    return torch.cat([chunks[i] for i in order], dim=0)
+
+
+def hierarchical_all_to_all_single(send_buffer, i2j_send_size):
+    """
+    Same result as all_to_all_single over DEFAULT_GROUP, in two levels.
+
+    send_buffer holds the rows for every rank, grouped by destination rank; i2j_send_size[i][j] is the
+    number of rows rank i sends to rank j, known by every rank. First, inside each node, the rows for all
+    ranks with local rank m on any node are gathered on local rank m; then every local rank exchanges with
+    its peers of the same local rank on the other nodes, so that the traffic between two nodes is one
+    aggregated message per local rank instead of one per pair of ranks. Works with gloo on cpu tensors.
+    """
+    n_local = IN_NODE_GROUP.size()
+    n_nodes = CROSS_NODE_GROUP.size()
+    node, local = CROSS_NODE_GROUP.rank(), IN_NODE_GROUP.rank()
+    rank = node * n_local + local
+
+    def global_rank(node_id, local_id):
+        return node_id * n_local + local_id
+
+    # 1. inside the node: send to local rank m the rows for (b, m) of every node b, ordered by b.
+    order = [global_rank(b, m) for m in range(n_local) for b in range(n_nodes)]
+    stage1_send = reorder_row_chunks(
+        send_buffer, [int(size) for size in i2j_send_size[rank]], order
+    )
+    stage1_send_splits = [
+        sum(int(i2j_send_size[rank][global_rank(b, m)]) for b in range(n_nodes))
+        for m in range(n_local)
+    ]
+    stage1_recv_splits = [
+        sum(
+            int(i2j_send_size[global_rank(node, l)][global_rank(b, local)])
+            for b in range(n_nodes)
+        )
+        for l in range(n_local)
+    ]
+    stage1_recv = send_buffer.new_empty(
+        (sum(stage1_recv_splits),) + send_buffer.shape[1:]
+    )
+    dist.all_to_all_single(
+        stage1_recv,
+        stage1_send,
+        output_split_sizes=stage1_recv_splits,
+        input_split_sizes=stage1_send_splits,
+        group=IN_NODE_GROUP,
+    )
+
+    # 2. across nodes: stage1_recv is ordered by (source local rank l, destination node b);
+    # send to node b all rows for (b, local), ordered by l.
+    stage1_chunk_sizes = [
+        int(i2j_send_size[global_rank(node, l)][global_rank(b, local)])
+        for l in range(n_local)
+        for b in range(n_nodes)
+    ]
+    order = [l * n_nodes + b for b in range(n_nodes) for l in range(n_local)]
+    stage2_send = reorder_row_chunks(stage1_recv, stage1_chunk_sizes, order)
+    stage2_send_splits = [
+        sum(
+            int(i2j_send_size[global_rank(node, l)][global_rank(b, local)])
+            for l in range(n_local)
+        )
+        for b in range(n_nodes)
+    ]
+    # rows arrive ordered by source node a then source local rank l, i.e. by source global rank.
+    stage2_recv_splits = [
+        sum(int(i2j_send_size[global_rank(a, l)][rank]) for l in range(n_local))
+        for a in range(n_nodes)
+    ]
+    stage2_recv = send_buffer.new_empty(
+        (sum(stage2_recv_splits),) + send_buffer.shape[1:]
+    )
+    dist.all_to_all_single(
+        stage2_recv,
+        stage2_send,
+        output_split_sizes=stage2_recv_splits,
+        input_split_sizes=stage2_send_splits,
+        group=CROSS_NODE_GROUP,
+    )
+    return stage2_recv
+
+
+def all_to_all_single_rows(send_buffer, i2j_send_size, group=None):
+    # all_to_all_single of row chunks over group (DEFAULT_GROUP by default); i2j_send_size as above.
+    # Goes through hierarchical_all_to_all_single when args.hierarchical_all_to_all is set on several nodes.
+    group = DEFAULT_GROUP if group is None else group
+    if (
+        get_args().hierarchical_all_to_all
+        and group is DEFAULT_GROUP
+        and CROSS_NODE_GROUP.size() > 1
+    ):
+        return hierarchical_all_to_all_single(send_buffer, i2j_send_size)
+    rank = group.rank()
+    recv_buffer = send_buffer.new_empty(
+        (sum(int(row[rank]) for row in i2j_send_size),) + send_buffer.shape[1:]
+    )
+    dist.all_to_all_single(
+        recv_buffer,
+        send_buffer,
+        output_split_sizes=[int(row[rank]) for row in i2j_send_size],
+        input_split_sizes=[int(size) for size in i2j_send_size[rank]],
+        group=group,
+    )
+    return recv_buffer
+
+
 def get_local_chunk_l_r(array_length, world_size, rank):
     chunk_size = (array_length + world_size - 1) // world_size
     l = rank * chunk_size
@@ -649,7 +771,13 @@ def load_checkpoint(args):
 
     global DEFAULT_GROUP
 
-    number_files = len(os.listdir(args.start_checkpoint))
+    number_files = len(
+        [
+            file_name
+            for file_name in os.listdir(args.start_checkpoint)
+            if file_name.startswith("chkpnt_")
+        ]
+    )
     if args.start_checkpoint[-1] != "/":
         args.start_checkpoint += "/"
     if number_files == DEFAULT_GROUP.size():
@@ -82,3 +82,33 @@ def fov2focal(fov, pixels):
 
 def focal2fov(focal, pixels):
     return 2 * math.atan(pixels / (2 * focal))
+
+
+def expand_bits_3d(v):
+    # Spread the lower 21 bits of v so that there are two zero bits between every two bits.
+    v = v & 0x1FFFFF
+    v = (v | (v << 32)) & 0x1F00000000FFFF
+    v = (v | (v << 16)) & 0x1F0000FF0000FF
+    v = (v | (v << 8)) & 0x100F00F00F00F00F
+    v = (v | (v << 4)) & 0x10C30C30C30C30C3
+    v = (v | (v << 2)) & 0x1249249249249249
+    return v
+
+
+def morton_code_3d(points, n_bits=21):
+    # points: (N, 3) float tensor on any device.
+    # return: (N,) int64 morton code of points quantized on a 2^n_bits grid over their bounding box.
+    assert 0 < n_bits <= 21, "At most 21 bits per axis fit into an int64 morton code."
+    if points.shape[0] == 0:
+        # e.g. a rank left without local 3dgs after pruning or redistribution.
+        return torch.zeros((0,), dtype=torch.int64, device=points.device)
+    min_xyz = points.min(dim=0).values
+    max_xyz = points.max(dim=0).values
+    extent = torch.clamp_min(max_xyz - min_xyz, 1e-12)
+    grid_max = (1 << n_bits) - 1
+    quantized = ((points - min_xyz) / extent * grid_max).long().clamp_(0, grid_max)
+    return (
+        (expand_bits_3d(quantized[:, 0]) << 2)
+        | (expand_bits_3d(quantized[:, 1]) << 1)
+        | expand_bits_3d(quantized[:, 2])
+    )
@@ -85,12 +85,47 @@ def _ssim(img1, img2, window, window_size, channel, size_average=True):
         return ssim_map.mean(1).mean(1).mean(1)
 
 
+LOSS_DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+}
+
+
+class _ScaleGradient(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, tensor, scale):
+        ctx.scale = scale
+        return tensor.view_as(tensor)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        return grad_output * ctx.scale, None
+
+
+def scale_gradient(tensor, scale):
+    # identity in forward; the gradient is multiplied by scale in backward, in the dtype of tensor.
+    if scale == 1.0:
+        return tensor
+    return _ScaleGradient.apply(tensor, scale)
+
+
+def normalize_gt_image(image, dtype=torch.float32):
+    # image: ground truth in [0, 255]. return: image in [0, 1] of the given dtype.
+    # A uint8 image needs no clamp, so it is converted with a single allocation.
+    if image.dtype == torch.uint8:
+        return image.to(dtype).div_(255.0)
+    return torch.clamp(image / 255.0, 0.0, 1.0).to(dtype)
+
+
 def pixelwise_l1_with_mask(img1, img2, pixel_mask):
-    # img1, img2: (3, H, W)
-    # pixel_mask: (H, W) bool torch tensor as mask.
+    # img1, img2: (3, H, W) or (B, 3, H, W)
+    # pixel_mask: (H, W) or (B, H, W) bool torch tensor as mask; None if all pixels are touched.
     # only compute l1 loss for the pixels that are touched
 
-    pixelwise_l1_loss = torch.abs((img1 - img2)) * pixel_mask.unsqueeze(0)
+    pixelwise_l1_loss = torch.abs((img1 - img2))
+    if pixel_mask is not None:
+        pixelwise_l1_loss = pixelwise_l1_loss * pixel_mask.unsqueeze(-3)
     return pixelwise_l1_loss
 
 
@@ -127,6 +162,72 @@ def pixelwise_ssim_with_mask(img1, img2, pixel_mask):
     pixelwise_ssim_loss = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / (
         (mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2)
     )
-    pixelwise_ssim_loss = pixelwise_ssim_loss * pixel_mask.unsqueeze(0)
+    if pixel_mask is not None:
+        pixelwise_ssim_loss = pixelwise_ssim_loss * pixel_mask.unsqueeze(0)
+
+    return pixelwise_ssim_loss
+
+
+SSIM_WINDOW_CACHE = {}
+
+
+def get_ssim_window_1d(window_size, device, dtype):
+    # (window_size,) gaussian window of ssim, built once per device and dtype.
+    key = (window_size, str(device), dtype)
+    if key not in SSIM_WINDOW_CACHE:
+        SSIM_WINDOW_CACHE[key] = gaussian(window_size, 1.5).to(
+            device=device, dtype=dtype
+        )
+    return SSIM_WINDOW_CACHE[key]
+
+
+def separable_gaussian_filter(stacked, window_size=11):
+    # stacked: (..., C, H, W). return: the same zero-padded 2D gaussian filter as create_window,
+    # applied as a 1 x window_size pass followed by a window_size x 1 pass over all C channels at once.
+    window = get_ssim_window_1d(window_size, stacked.device, stacked.dtype)
+    channel = stacked.shape[-3]
+    stacked = F.conv2d(
+        stacked,
+        window.view(1, 1, 1, window_size).expand(channel, 1, 1, window_size),
+        padding=(0, window_size // 2),
+        groups=channel,
+    )
+    return F.conv2d(
+        stacked,
+        window.view(1, 1, window_size, 1).expand(channel, 1, window_size, 1),
+        padding=(window_size // 2, 0),
+        groups=channel,
+    )
+
+
+def fast_pixelwise_ssim_with_mask(img1, img2, pixel_mask):
+    # Same result as pixelwise_ssim_with_mask up to float rounding.
+    # img1, img2: (3, H, W) or (B, 3, H, W); pixel_mask: (H, W) or (B, H, W) bool, or None.
+    # The five filtered maps come out of one separable convolution over the stacked channels.
+    channel = img1.size(-3)
+    filtered = separable_gaussian_filter(
+        torch.cat([img1, img2, img1 * img1, img2 * img2, img1 * img2], dim=-3)
+    )
+    # the maps are combined in float32 even for half precision inputs, because
+    # sigma = E[x^2] - mu^2 cancels badly with a 8 or 11 bit mantissa.
+    mu1, mu2, img1_sq, img2_sq, img1_img2 = torch.split(
+        filtered.float(), channel, dim=-3
+    )
+
+    mu1_sq = mu1.pow(2)
+    mu2_sq = mu2.pow(2)
+    mu1_mu2 = mu1 * mu2
+    sigma1_sq = img1_sq - mu1_sq
+    sigma2_sq = img2_sq - mu2_sq
+    sigma12 = img1_img2 - mu1_mu2
+
+    C1 = 0.01**2
+    C2 = 0.03**2
+
+    pixelwise_ssim_loss = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / (
+        (mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2)
+    )
+    if pixel_mask is not None:
+        pixelwise_ssim_loss = pixelwise_ssim_loss * pixel_mask.unsqueeze(-3)
 
     return pixelwise_ssim_loss